@@ -0,0 +1,190 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+"""
+A stand in martservice serving a synthetic gene table over HTTP on localhost.
+
+The size of the table and the latency of every response are configurable so the benchmarks measure scibiomart rather
+than the network, e.g.:
+
+    with MockMart(n_genes=50000, latency=0.05) as mart:
+        sb = SciBiomart(mart.url)
+"""
+
+import gzip
+import http.server
+import random
+import re
+import socketserver
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+DATASET = 'hsapiens_gene_ensembl'
+VERSION = 'Human genes (GRCh38.p13)'
+# Attribute: (description, page)
+ATTRIBUTES = {
+    'ensembl_gene_id': ('Gene stable ID', 'feature_page'),
+    'external_gene_name': ('Gene name', 'feature_page'),
+    'chromosome_name': ('Chromosome/scaffold name', 'feature_page'),
+    'start_position': ('Gene start (bp)', 'feature_page'),
+    'end_position': ('Gene end (bp)', 'feature_page'),
+    'strand': ('Strand', 'feature_page'),
+    'gene_biotype': ('Gene type', 'feature_page'),
+    'description': ('Gene description', 'feature_page'),
+    'mmusculus_homolog_ensembl_gene': ('Mouse gene stable ID', 'homologs'),
+}
+FILTERS = {'ensembl_gene_id': 'ensembl_gene_id', 'external_gene_name': 'external_gene_name',
+           'chromosome_name': 'chromosome_name', 'biotype': 'gene_biotype'}
+CHROMOSOMES = [str(c) for c in range(1, 23)] + ['X', 'Y', 'MT']
+BIOTYPES = ['protein_coding', 'lncRNA', 'miRNA', 'processed_pseudogene', 'snRNA']
+
+
+def make_genes(n_genes: int, seed=0) -> dict:
+    """ Makes a random gene table with the columns in ATTRIBUTES. """
+    rng = random.Random(seed)
+    genes = {name: [] for name in ATTRIBUTES}
+    for i in range(n_genes):
+        start = rng.randint(1, 200000000)
+        genes['ensembl_gene_id'].append(f'ENSG{i:011d}')
+        genes['external_gene_name'].append(f'GENE{i}' if rng.random() > 0.1 else '')
+        genes['chromosome_name'].append(rng.choice(CHROMOSOMES))
+        genes['start_position'].append(str(start))
+        genes['end_position'].append(str(start + rng.randint(100, 100000)))
+        genes['strand'].append(rng.choice(['1', '-1']))
+        genes['gene_biotype'].append(rng.choice(BIOTYPES))
+        genes['description'].append(f'gene {i} [Source:HGNC Symbol;Acc:HGNC:{i}]')
+        genes['mmusculus_homolog_ensembl_gene'].append(f'ENSMUSG{i:011d}' if rng.random() > 0.3 else '')
+    return genes
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    """ http.server.ThreadingHTTPServer, which needs Python 3.7. """
+
+    daemon_threads = True
+
+
+class MockMartHandler(http.server.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    mart = None  # Set on the subclass made for each server
+
+    def setup(self):
+        super().setup()
+        with self.mart.lock:
+            self.mart.connections += 1
+
+    def do_GET(self):
+        params = parse_qs(urlparse(self.path).query)
+        self.respond(params)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8')
+        self.respond(parse_qs(body))
+
+    def respond(self, params: dict):
+        mart = self.mart
+        with mart.lock:
+            mart.n_requests += 1
+        time.sleep(mart.latency)
+        request_type = params.get('type', [''])[0]
+        if 'query' in params:
+            status, body = mart.query(params['query'][0])
+        elif request_type == 'registry':
+            status, body = 200, ('<MartRegistry><MartURLLocation database="ensembl_mart_110" default="1" '
+                                 'displayName="Ensembl Genes 110" name="ENSEMBL_MART_ENSEMBL" /></MartRegistry>')
+        elif request_type == 'datasets':
+            status, body = 200, f'TableSet\t{DATASET}\t{VERSION}\t1\tGRCh38.p13\t200\t50000\tdefault\t2023-01-01\n'
+        elif request_type == 'configuration':
+            status, body = 200, f'<DatasetConfig dataset="{DATASET}" version="{VERSION}">{" " * 100000}</DatasetConfig>'
+        elif request_type == 'attributes':
+            # As in Ensembl the stable ID is on every page so the pages can be joined
+            attributes = list(ATTRIBUTES.items()) + [('ensembl_gene_id', ('Gene stable ID', 'homologs'))]
+            status, body = 200, ''.join(f'{name}\t{desc}\t\t{page}\thtml,txt,csv,tsv,xls\tgene\tcol_{i}\n'
+                                        for i, (name, (desc, page)) in enumerate(attributes))
+        elif request_type == 'filters':
+            status, body = 200, ''.join(f'{name}\t{name}\t[]\t\tfilters\ttext\t=,in\tgene\tcol_{i}\n'
+                                        for i, name in enumerate(FILTERS))
+        else:
+            status, body = 400, 'Unknown request'
+        body = body.encode('utf-8')
+        self.send_response(status)
+        if 'gzip' in self.headers.get('Accept-Encoding', '') and len(body) > 1024:
+            body = gzip.compress(body, compresslevel=1)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        return
+
+
+class MockMart:
+
+    def __init__(self, n_genes=20000, latency=0.0, seed=0):
+        """ Serves n_genes random genes, every response is delayed by latency seconds. """
+        self.n_genes = n_genes
+        self.latency = latency
+        self.genes = make_genes(n_genes, seed)
+        self.index = {name: {} for name in FILTERS.values()}
+        for column, index in self.index.items():
+            for i, value in enumerate(self.genes[column]):
+                index.setdefault(value, []).append(i)
+        self.n_requests = 0
+        self.connections = 0  # Connections accepted, kept alive connections are reused for several requests
+        self.lock = threading.Lock()
+        self.server = None
+        self.url = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def start(self):
+        handler = type('Handler', (MockMartHandler, ), {'mart': self})
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f'http://127.0.0.1:{self.server.server_port}/biomart/'
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def query(self, query: str):
+        """ Answers a query document, returning the status and TSV body (with the completion stamp). """
+        attrs = re.findall(r'<Attribute name\s*=\s*"([^"]+)"', query)
+        pages = {ATTRIBUTES[a][1] for a in attrs if a in ATTRIBUTES and a != 'ensembl_gene_id'}
+        if any(a not in ATTRIBUTES for a in attrs):
+            return 200, f'Query ERROR: caught BioMart::Exception::Usage: Attribute {attrs} NOT FOUND'
+        if len(pages) > 1:
+            return 200, 'Query ERROR: caught BioMart::Exception::Usage: Attributes from multiple attribute pages ' \
+                        'are not allowed'
+        rows = None
+        for name, value in re.findall(r'<Filter name\s*=\s*"([^"]+)"\s+value\s*=\s*"([^"]*)"', query):
+            index = self.index[FILTERS[name]]
+            matched = {i for v in value.split(',') for i in index.get(v, [])}
+            rows = matched if rows is None else rows & matched
+        rows = range(self.n_genes) if rows is None else sorted(rows)
+        if re.search(r'count\s*=\s*"1"', query):
+            return 200, f'{len(rows)}\n'
+        columns = [self.genes[a] for a in attrs]
+        body = ''.join('\t'.join(column[i] for column in columns) + '\n' for i in rows)
+        return 200, f'{body}[success]\n'
@@ -0,0 +1,171 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+"""
+Benchmarks for query building, parsing, sorting, annotation joins and concurrent queries against a local MockMart.
+
+Run from the repository root, e.g.:
+
+    python -m benchmarks.run --genes 50000 --latency 0.05 --output bench_1.0.3.tsv
+
+Each benchmark is timed repeat times (after a warm up run) and run once more under tracemalloc for the peak memory
+allocated by python (the mock server runs in the same process so its allocations are included for network benchmarks).
+"""
+
+import argparse
+import contextlib
+import io
+import statistics
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+from sciutil import SciUtil
+
+from benchmarks.mock_mart import DATASET, MockMart
+from scibiomart import SciBiomart, SciBiomartSession, GeneIndex
+from scibiomart.annot import Annot
+
+GENE_ATTRIBUTES = ['ensembl_gene_id', 'external_gene_name', 'chromosome_name', 'start_position', 'end_position',
+                   'strand', 'gene_biotype']
+BENCHMARK_COLUMNS = ['benchmark', 'rows', 'median_s', 'min_s', 'rows_per_s', 'peak_mb']
+
+
+class Benchmarks:
+
+    def __init__(self, mart: MockMart, max_workers=8):
+        self.mart = mart
+        self.max_workers = max_workers
+        # A pool large enough for the concurrent benchmarks, shared by every client
+        self.session = SciBiomartSession(maxsize=max_workers)
+        self.genes_df = self.new_client().run_query(None, GENE_ATTRIBUTES, stream=True)
+        self.ids = list(self.genes_df['ensembl_gene_id'])
+        body = self.mart.query(self.new_client().build_query(None, GENE_ATTRIBUTES))[1].encode('utf-8')
+        self.body = body[:body.rindex(b'[success]')]
+
+    def new_client(self, cls=SciBiomart, **kwargs) -> SciBiomart:
+        sb = cls(self.mart.url, session=self.session, **kwargs)
+        sb.set_mart('ENSEMBL_MART_ENSEMBL')
+        sb.set_dataset(DATASET)
+        return sb
+
+    def build_query(self) -> int:
+        sb = self.new_client()
+        for i in range(0, len(self.ids), 1000):
+            sb.build_query({'ensembl_gene_id': self.ids[i: i + 1000]}, GENE_ATTRIBUTES)
+        return len(self.ids)
+
+    def parse_results(self) -> int:
+        return len(self.new_client().parse_results(self.body, GENE_ATTRIBUTES))
+
+    def run_query(self) -> int:
+        return len(self.new_client().run_query(None, GENE_ATTRIBUTES))
+
+    def run_query_stream(self) -> int:
+        return len(self.new_client().run_query(None, GENE_ATTRIBUTES, stream=True))
+
+    def run_query_typed(self) -> int:
+        return len(self.new_client().run_query(None, GENE_ATTRIBUTES, stream=True, typed=True))
+
+    def batches_serial(self) -> int:
+        sb = self.new_client(batch_size=500, max_workers=1)
+        return len(sb.run_query({'ensembl_gene_id': self.ids[:10000]}, GENE_ATTRIBUTES))
+
+    def batches_concurrent(self) -> int:
+        sb = self.new_client(batch_size=500, max_workers=self.max_workers)
+        return len(sb.run_query({'ensembl_gene_id': self.ids[:10000]}, GENE_ATTRIBUTES))
+
+    def stream_query(self) -> int:
+        return self.new_client().stream_query(None, GENE_ATTRIBUTES, io.StringIO(), chunksize=10000)[1]
+
+    def sort_df_on_starts(self) -> int:
+        return len(SciBiomart.sort_df_on_starts(self.genes_df, 'natural'))
+
+    def annot(self) -> int:
+        annot = self.new_client(Annot)
+        df = pd.DataFrame({'id': self.ids[::-1], 'value': np.arange(len(self.ids))})
+        return len(annot.annot(df, ['id', 'ensembl_gene_id'], self.genes_df, how='left'))
+
+    def nearest_tss(self) -> int:
+        rng = np.random.default_rng(0)
+        index = GeneIndex(self.genes_df)
+        chroms = rng.choice(self.genes_df['chromosome_name'].unique(), 100000)
+        return len(index.nearest_tss(chroms, rng.integers(1, 200000000, 100000)))
+
+    def names(self) -> list:
+        return ['build_query', 'parse_results', 'run_query', 'run_query_stream', 'run_query_typed', 'batches_serial',
+                'batches_concurrent', 'stream_query', 'sort_df_on_starts', 'annot', 'nearest_tss']
+
+
+def time_benchmark(func, repeat=5) -> dict:
+    """ Times func (which returns the rows it processed), then measures its peak memory. """
+    func()  # Warm up, e.g. the dataset version and catalog are looked up once
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        rows = func()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    median = statistics.median(times)
+    return {'rows': rows, 'median_s': median, 'min_s': min(times), 'rows_per_s': rows / median if median else None,
+            'peak_mb': peak / 1024 ** 2}
+
+
+def run_benchmarks(n_genes=20000, latency=0.0, repeat=5, only=None, max_workers=8) -> pd.DataFrame:
+    """ Runs the benchmarks (those named in only, or all of them) and returns the timings. """
+    results = []
+    with MockMart(n_genes, latency) as mart:
+        benchmarks = Benchmarks(mart, max_workers)
+        # Keep the client logging out of the timings
+        with contextlib.redirect_stdout(io.StringIO()):
+            for name in benchmarks.names():
+                if not only or name in only:
+                    results.append({'benchmark': name, **time_benchmark(getattr(benchmarks, name), repeat)})
+        benchmarks.session.close()
+    return pd.DataFrame(results, columns=BENCHMARK_COLUMNS)
+
+
+def gen_parser():
+    parser = argparse.ArgumentParser(description='scibiomart benchmarks against a local mock martservice.')
+    parser.add_argument('--genes', type=int, default=20000, help='Genes served by the mock martservice.')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every response.')
+    parser.add_argument('--repeat', type=int, default=5, help='Timed runs of each benchmark.')
+    parser.add_argument('--max_workers', type=int, default=8, help='Threads for the concurrent benchmarks.')
+    parser.add_argument('--only', type=str, default=None, help='Comma separated benchmarks to run.')
+    parser.add_argument('--output', type=str, default=None, help='Save the results as a TSV, e.g. to compare '
+                                                                 'releases.')
+    return parser
+
+
+def main(args=None):
+    args = gen_parser().parse_args(args)
+    results_df = run_benchmarks(args.genes, args.latency, args.repeat, args.only.split(',') if args.only else None,
+                                args.max_workers)
+    print(results_df.to_string(index=False, float_format=lambda v: f'{v:.4g}'))
+    if args.output:
+        results_df.to_csv(args.output, sep='\t', index=False)
+        SciUtil().dp(['Saved the results to:', args.output])
+
+
+if __name__ == "__main__":
+    main()
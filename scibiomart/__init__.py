@@ -23,6 +23,39 @@ __author__ = 'Ariane Mora'
 __author_email__ = 'ariane.n.mora@gmail.com'
 __license__ = 'GPL3'
 
-from scibiomart.base import SciBiomart
-from scibiomart.api import SciBiomartApi
-from scibiomart.__main__ import gen_parser
+import importlib
+import sys
+
+# The classes are only imported when first used (PEP 562) so that importing scibiomart, or running the CLI for
+# --version, doesn't pay for pandas, numpy and urllib3.
+LAZY_ATTRIBUTES = {
+    'SciBiomartCache': 'scibiomart.cache',
+    'SciBiomartSession': 'scibiomart.session',
+    'CassetteTransport': 'scibiomart.transport',
+    'AiohttpTransport': 'scibiomart.transport',
+    'SciBiomartIdCache': 'scibiomart.memo',
+    'SciBiomartStats': 'scibiomart.instrument',
+    'SciBiomart': 'scibiomart.base',
+    'SciBiomartApi': 'scibiomart.api',
+    'GeneIndex': 'scibiomart.intervals',
+    'SciBiomartSnapshot': 'scibiomart.snapshot',
+    'AsyncSciBiomart': 'scibiomart.aio',
+    'gen_parser': 'scibiomart.__main__',
+}
+
+
+def __getattr__(name):
+    if name in LAZY_ATTRIBUTES:
+        value = getattr(importlib.import_module(LAZY_ATTRIBUTES[name]), name)
+        globals()[name] = value  # Only look it up once
+        return value
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def __dir__():
+    return sorted(list(globals()) + list(LAZY_ATTRIBUTES))
+
+
+if sys.version_info < (3, 7):  # No module __getattr__, import everything up front
+    for lazy_name in LAZY_ATTRIBUTES:
+        globals()[lazy_name] = __getattr__(lazy_name)
@@ -16,13 +16,11 @@
 ###############################################################################
 
 import argparse
+import contextlib
 import sys
 import json
 
-from sciutil import SciUtil
-
 from scibiomart import __version__
-from scibiomart import SciBiomart
 
 
 def print_help():
@@ -30,9 +28,13 @@ def print_help():
     print('\n'.join(lines))
 
 
-def run(args):
+def run(args, stdout=None):
+    # Imported here so --version and --help don't wait for the requests and listing marts doesn't wait for pandas
+    from scibiomart.base import SciBiomart
+    if args.snapshot or args.create_snapshot:
+        from scibiomart.snapshot import SciBiomartSnapshot
 
-    sb = SciBiomart()
+    sb = SciBiomart(snapshot=SciBiomartSnapshot(args.snapshot) if args.snapshot else None)
     if args.marts:  # Check if the user wanted to print the marts
         sb.list_marts(True)
         return
@@ -50,6 +52,9 @@ def run(args):
     if args.configs:
         sb.list_configs(True)
         return
+    if args.search:  # Search the attributes and filters
+        print(sb.search(args.search).to_string(index=False))
+        return
     # Otherwise they actually have a query so we run it
     # Convert the filetrs string to a dict
     if args.f:
@@ -62,28 +67,52 @@ def run(args):
         attrs = None
     if not attrs and args.s:  # We need the start and ends at least
         attrs = ['external_gene_name', 'chromosome_name', 'start_position', 'end_position', 'strand']
+    if args.create_snapshot:  # Save the query locally so it can be answered without the network
+        path = SciBiomartSnapshot(args.create_snapshot).create(sb, attrs, filters, args.format if args.format in
+                                                                ['parquet', 'feather', 'arrow'] else 'csv')
+        sb.u.dp(['Saved the snapshot to:', path])
+        return
     sb.u.dp(['Running query on:',
              '\nMart: ', sb.mart,
              '\nDataset: ', sb.dataset_version,
              '\nFilters: ', filters,
              '\nAttributes: ', attrs])
-    results_df = sb.run_query(filters, attrs)
+    if args.stream or args.o == '-':  # Write the results as they are downloaded
+        saved_file, n_rows = sb.stream_query(filters, attrs, stdout if args.o == '-' and stdout else args.o,
+                                             args.format, args.compression, sort=args.s == 't',
+                                             chrom_order=args.order, chunksize=args.chunksize)
+        sb.u.dp(['Saved', n_rows, 'rows to:', saved_file if isinstance(saved_file, str) else 'stdout'])
+        return
+    # When sorting we need the positions as integers
+    results_df = sb.run_query(filters, attrs, typed=args.s == 't')
     if args.s == 't':  # Check if we need to sort the file
-        convert_dict = {'start_position': int,
-                        'end_position': int,
-                        'strand': int,
-                        'chromosome_name': str}
         sb.u.warn_p(['Removing any genes with no gene name... Required for sorting.'])
 
         results_df = results_df[~results_df['external_gene_name'].isnull()]
 
-        results_df = results_df.astype(convert_dict)
-        results_df = sb.sort_df_on_starts(results_df)  # Note the user would have had to select the starts and ends
+        # Note the user would have had to select the starts and ends
+        results_df = sb.sort_df_on_starts(results_df, args.order)
 
-    saved_file = sb.save_as_csv(results_df, args.o)
+    saved_file = sb.save(results_df, args.o, args.format, args.compression)
     sb.u.dp(['Saved the output to:', saved_file])
 
 
+def run_batch(args):
+    from scibiomart.batch import load_manifest, run_manifest
+
+    report_df = run_manifest(load_manifest(args.manifest), args.max_workers)
+    print(report_df.to_string(index=False))
+    return int(report_df['error'].notnull().any())
+
+
+def gen_batch_parser():
+    parser = argparse.ArgumentParser(prog='scibiomart batch', description='Runs the queries in a manifest (YAML or '
+                                                                          'JSON) concurrently.')
+    parser.add_argument('manifest', type=str, help='Manifest listing the jobs, see scibiomart.batch.')
+    parser.add_argument('--max_workers', type=int, default=None, help='Jobs run at once (overrides the manifest).')
+    return parser
+
+
 def gen_parser():
     parser = argparse.ArgumentParser(description='sciloc2gene')
     parser.add_argument('--m', type=str, help='Mart: e.g. ENSEMBL_MART_ENSEMBL, '
@@ -94,9 +123,25 @@ def gen_parser():
                                               '\n \tuse --attrs to see available attributes.')
     parser.add_argument('--f', type=str, default=None, help='Filters as a comma separated list surrounded by "".'
                                               '\n \tuse --filters to see available filters.')
-    parser.add_argument('--o', type=str, default='', help='Output folder')
+    parser.add_argument('--o', type=str, default='', help='Output folder, - writes csv or tsv to stdout (streamed).')
+    parser.add_argument('--stream', action='store_true', help='Write the results (csv or tsv) as they are downloaded '
+                                                              'rather than holding them in memory, sorting uses '
+                                                              'temporary files.')
+    parser.add_argument('--chunksize', type=int, default=100000, help='Rows held in memory at once when streaming.')
+    parser.add_argument('--format', type=str, default='csv', choices=['csv', 'tsv', 'parquet', 'feather', 'arrow'],
+                        help='Output format, parquet, feather and arrow need pyarrow.')
+    parser.add_argument('--compression', type=str, default=None, help='Compression for the output e.g. gzip for csv, '
+                                                                      'zstd or snappy for parquet, lz4 or zstd for '
+                                                                      'feather and arrow.')
     parser.add_argument('--s', type=str, default='f', help='Sort the dataframe before returning on gene starts (used '
                                                            'for programs that require a sorted file e.g. sciloc2gene.')
+    parser.add_argument('--order', type=str, default='lexicographic', help='Chromosome order used when sorting: '
+                                                                          'lexicographic (as bedtools), natural or a '
+                                                                          'path to a .fai index.')
+    parser.add_argument('--snapshot', type=str, default=None, help='Folder of local snapshots, queries they can '
+                                                                   'answer are run without the network.')
+    parser.add_argument('--create_snapshot', type=str, default=None, help='Snapshot the mart and dataset (with the '
+                                                                          'attributes in --a) into this folder.')
     parser.add_argument('--marts', type=str, default=None, help='Lists available marts.')
     parser.add_argument('--datasets', type=str, default=None, help='Lists available datasets for a specific mart '
                                                      '(must use --m option)')
@@ -104,6 +149,9 @@ def gen_parser():
                                                     '(must use --m and --d options).')
     parser.add_argument('--filters', type=str, default=None, help='Lists available filters for a mart and dataset '
                                                     '(must use --m and --d options).')
+    parser.add_argument('--search', type=str, default=None, help='Search the attributes and filters of a mart and '
+                                                                 'dataset by name and description (must use --m and '
+                                                                 '--d options).')
     parser.add_argument('--configs', type=str, default=None, help='Lists configs filters for a mart and dataset '
                                                     '(must use --m and --d options).')
     return parser
@@ -119,11 +167,22 @@ def main(args=None):
     elif sys.argv[1] in {'-v', '--v', '-version', '--version'}:
         print(f'scibiomart v{__version__}')
         sys.exit(0)
-    else:
+    elif 'batch' in sys.argv[:2]:
         print(f'scibiomart v{__version__}')
+        args = gen_batch_parser().parse_args(sys.argv[sys.argv.index('batch') + 1:])
+        sys.exit(run_batch(args))
+    else:
         args = parser.parse_args(args)
-        # RUN!
-        run(args)
+        if args.o == '-':
+            # The results go to stdout so everything else goes to stderr
+            stdout = sys.stdout
+            with contextlib.redirect_stdout(sys.stderr):
+                print(f'scibiomart v{__version__}')
+                run(args, stdout)
+        else:
+            print(f'scibiomart v{__version__}')
+            # RUN!
+            run(args)
     # Done - no errors.
     sys.exit(0)
 
@@ -0,0 +1,128 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+"""
+asyncio interface to scibiomart.
+
+The queries run on a bounded thread pool (sharing one connection pool) so many queries can be gathered at once without
+blocking the event loop, e.g.:
+
+    async with AsyncSciBiomart() as sb:
+        human_df, mouse_df = await asyncio.gather(sb.get_human_default(), sb.get_mouse_default())
+"""
+
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from scibiomart.api import SciBiomartApi
+from scibiomart.session import SciBiomartSession
+
+
+class AsyncSciBiomart:
+
+    def __init__(self, url=None, max_concurrency=8, **kwargs):
+        """
+        At most max_concurrency queries run at once, kwargs are passed to SciBiomartApi. Unless a session is passed
+        in the clients share a connection pool sized for max_concurrency, closed with close_session.
+        """
+        self.url = url
+        self.max_concurrency = max_concurrency
+        self.owns_session = kwargs.get('session') is None
+        if self.owns_session:
+            kwargs['session'] = SciBiomartSession(maxsize=max(max_concurrency, kwargs.get('max_workers', 4)),
+                                                  compress=kwargs.get('compress', True))
+        self.session = kwargs['session']
+        self.kwargs = kwargs
+        self.sb = SciBiomartApi(url, **kwargs)
+        self.u = self.sb.u
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.close_session()
+
+    async def _run(self, func, *args, **kwargs):
+        """ Runs a blocking scibiomart call on the thread pool. """
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    def new_client(self) -> SciBiomartApi:
+        """ Returns a new client sharing the connection pool (and cache) so it can use its own mart and dataset. """
+        return SciBiomartApi(self.url, **{**self.kwargs, 'session': self.sb.session})
+
+    @property
+    def mart(self):
+        return self.sb.mart
+
+    @property
+    def dataset(self):
+        return self.sb.dataset
+
+    @property
+    def dataset_version(self):
+        """ Blocks if the version hasn't been looked up yet, use get_dataset_version from a coroutine. """
+        return self.sb.dataset_version
+
+    async def get_dataset_version(self) -> str:
+        return await self._run(getattr, self.sb, 'dataset_version')
+
+    def set_mart(self, mart: str):
+        self.sb.set_mart(mart)
+
+    async def set_dataset(self, dataset: str):
+        await self._run(self.sb.set_dataset, dataset)
+
+    async def list_marts(self, print_values=False):
+        return await self._run(self.sb.list_marts, print_values)
+
+    async def list_datasets(self, print_values=False):
+        return await self._run(self.sb.list_datasets, print_values)
+
+    async def list_attributes(self, print_values=False):
+        return await self._run(self.sb.list_attributes, print_values)
+
+    async def list_filters(self, print_values=False):
+        return await self._run(self.sb.list_filters, print_values)
+
+    async def list_configs(self, print_values=False):
+        return await self._run(self.sb.list_configs, print_values)
+
+    async def run_query(self, filter_dict: dict, attr_list: list, **kwargs):
+        """ Runs a query on the current mart and dataset (see SciBiomart.run_query for the options). """
+        return await self._run(self.sb.run_query, filter_dict, attr_list, **kwargs)
+
+    async def query(self, mart: str, dataset: str, filter_dict: dict, attr_list: list, **kwargs):
+        """ Runs a query on any mart and dataset, use this to gather queries across several datasets. """
+        sb = self.new_client()
+        sb.set_mart(mart)
+        await self._run(sb.set_dataset, dataset)
+        return await self._run(sb.run_query, filter_dict, attr_list, **kwargs)
+
+    async def get_human_default(self, filter_dict=None, attr_list=None, dataset=None, mart=None):
+        return await self._run(self.new_client().get_human_default, filter_dict, attr_list, dataset, mart)
+
+    async def get_mouse_default(self, filter_dict=None, attr_list=None, dataset=None, mart=None):
+        return await self._run(self.new_client().get_mouse_default, filter_dict, attr_list, dataset, mart)
+
+    def close_session(self):
+        """ Stops the thread pool and terminates any connections that are hanging. """
+        self.executor.shutdown(wait=False)
+        if self.owns_session:
+            self.session.close()
@@ -17,30 +17,83 @@
 
 """
 Adds annotation to a dataframe.
+
+The annotation key is indexed once (a hash index over the unique keys plus the rows for each key) so the same annotation
+dataframe can be joined onto many dataframes, including one-to-many mappings such as homologs.
 """
+import numpy as np
 import pandas as pd
+from pandas.api.extensions import take
 
 from scibiomart import SciBiomartApi
 
 
 class Annot(SciBiomartApi):
 
-    def __init__(self):
-        super().__init__()
+    def __init__(self, url=None, **kwargs):
+        super().__init__(url, **kwargs)
+        self.annotation_df = None
+        self.annotation_key = None
+        self.annotation_index = None
+
+    def set_annotation(self, annotation_df: pd.DataFrame, key: str):
+        """ Indexes the annotation dataframe on key, the index is reused by annot until the annotation changes. """
+        # Missing keys get the code -1
+        codes, uniques = pd.factorize(annotation_df[key].values)
+        # Rows grouped by key: the rows for key i are rows[offsets[i]: offsets[i] + counts[i]]
+        rows = np.argsort(codes, kind='stable')
+        counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+        offsets = np.searchsorted(codes[rows], np.arange(len(uniques)))
+        self.annotation_df = annotation_df
+        self.annotation_key = key
+        self.annotation_index = {'keys': pd.Index(uniques), 'rows': rows, 'counts': counts, 'offsets': offsets}
+
+    def annot(self, df: pd.DataFrame, merge_ids: list, annotation_df=None, keep_na=False, how=None):
+        """
+        Adds annotation information to a dataframe, merge_ids are the column in df and the column in the
+        annotation to join on. If annotation_df isn't passed we use the last annotation (set_annotation) or the
+        most recent dataframe from scibiomart.
 
-    def annot(self, df: pd.DataFrame, merge_ids: list, annotation_df=None, keep_na=False):
-        """ Adds annotation information to a dataframe. """
-        if self.df is None and annotation_df is None:
+        how is one of inner, left or outer (by default inner, or outer if keep_na). Rows in df with several matches
+        are repeated once per match. The index of df is kept for inner and left joins.
+        """
+        if annotation_df is None:
+            annotation_df = self.annotation_df if self.annotation_df is not None else self.df
+        if annotation_df is None:
             self.u.err_p(['Annot error: you need to pass a dataframe or generate annotation dataframe '
                           'using scibiomart. See get_mouse_default and get_human_default for examples.'])
             return
+        how = how or ('outer' if keep_na else 'inner')
+        if how not in ('inner', 'left', 'outer'):
+            self.u.err_p([f'Annot error: how must be one of inner, left or outer not {how}.'])
+            return
+        left_key, right_key = merge_ids
+        if annotation_df is not self.annotation_df or right_key != self.annotation_key:
+            self.set_annotation(annotation_df, right_key)
+        index = self.annotation_index
+
+        codes = index['keys'].get_indexer(df[left_key].values)
+        matched = codes >= 0
+        counts = np.zeros(len(df), dtype=np.int64)
+        counts[matched] = index['counts'][codes[matched]]  # Only index counts with matches, it is empty if no keys
+        if how != 'inner':
+            counts = np.where(matched, counts, 1)  # Keep rows without a match once
+        left_rows = np.repeat(np.arange(len(df)), counts)
+        # Position of each output row within the group of annotation rows for its key
+        group_pos = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        left_codes = codes[left_rows]
+        has_match = left_codes >= 0
+        right_rows = np.full(len(left_rows), -1)
+        right_rows[has_match] = index['rows'][index['offsets'][left_codes[has_match]] + group_pos[has_match]]
 
-        # Otherwise we can continue
-        # We can do a merge on the index's (an inner merge if we don't have keep na)
-        df.set_index(merge_ids[0])
-        annotation_df.set_index(merge_ids[1])
-        if not keep_na:
-            merged_df = df.join(annotation_df, how='inner')
-            return merged_df
-        else:
-            return df.join(annotation_df, how='outer')
+        annot_columns = [c for c in annotation_df.columns if not (c == right_key and c == left_key)]
+        renamed = {c: f'{c}_annot' for c in annot_columns if c in df.columns}
+        annot_df = pd.DataFrame({renamed.get(c, c): take(annotation_df[c].values, right_rows, allow_fill=True)
+                                 for c in annot_columns}, index=df.index.take(left_rows))
+        merged_df = pd.concat([df.take(left_rows), annot_df], axis=1)
+        if how == 'outer':
+            # Add the annotations that didn't match anything
+            unmatched = np.setdiff1d(np.arange(len(annotation_df)), right_rows)
+            extra_df = annotation_df.take(unmatched).rename(columns=renamed)
+            merged_df = pd.concat([merged_df, extra_df], ignore_index=True)
+        return merged_df
@@ -20,8 +20,8 @@ from scibiomart import SciBiomart
 
 class SciBiomartApi(SciBiomart):
 
-    def __init__(self, url=None):
-        super().__init__(url)
+    def __init__(self, url=None, **kwargs):
+        super().__init__(url, **kwargs)
 
     def get_human_default(self, filter_dict=None, attr_list=None, dataset=None, mart=None):
         """ Run a default human query that gets location information and gene names for Ensembl IDs """
@@ -41,21 +41,20 @@ class SciBiomartApi(SciBiomart):
         self.set_dataset(dataset)
         return self.run_default(filter_dict, attr_list)
 
-    def run_default(self, filter_dict=None, attr_list=None):
-        """ Run the queries once the datasets have been assigned """
+    def run_default(self, filter_dict=None, attr_list=None, typed=True):
+        """
+        Run the queries once the datasets have been assigned, by default the positions are returned as integers,
+        strand as int8 and the chromosome as a categorical (see run_query).
+        """
         filter_dict = filter_dict or {}
         attr_list = attr_list or []
         attr_list = ['ensembl_gene_id', 'external_gene_name', 'chromosome_name', 'start_position',
                      'end_position', 'strand'] + attr_list
         # Here we just run the query
-        results_df = self.run_query(filter_dict, attr_list)
-        # Remove any NA ensembl IDs
-        results_df = results_df[~results_df['external_gene_name'].isnull()]
-        convert_dict = {'start_position': int,
-                        'end_position': int,
-                        'strand': int,
-                        'chromosome_name': str}     # This is the same way that bedtools sorts data i.e. 11 is before 2
-        #results_df = results_df.astype(convert_dict)
+        results_df = self.run_query(filter_dict, attr_list, typed=typed)
+        with self.tracer.span('postprocess', rows=len(results_df)):
+            # Remove any NA ensembl IDs
+            results_df = results_df[~results_df['external_gene_name'].isnull()]
         return results_df
 
 
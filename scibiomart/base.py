@@ -23,101 +23,755 @@ https://m.ensembl.org/info/data/biomart/biomart_restful.html#wget
 
 """
 
-import urllib3
+import csv
+import io
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING
+from urllib.parse import urlencode
+from xml.parsers import expat
+
 import xmltodict
-import pandas as pd
 
-from sciutil import SciUtil, SciException
+from sciutil import SciUtil
 from scibiomart.errors import *
+from scibiomart.session import get_default_session
+from scibiomart.stream import STREAM_FORMATS, open_output, write_chunks, sort_chunks
+from scibiomart.instrument import Tracer
+from scibiomart.query import get_template, render_attributes, render_filters
+
+# pandas (and the modules using it) are imported when first needed so listing marts etc. from the CLI doesn't wait
+# for them
+if TYPE_CHECKING:
+    import pandas as pd
+    from scibiomart.catalog import SciBiomartCatalog
+
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+STRATEGIES = {'auto', 'single', 'batched', 'stream'}
+SUCCESS_STAMP = b'[success]'
+
+
+class CountingReader:
+    """ Wraps a response stream counting the (decompressed) bytes read from it. """
 
+    def __init__(self, stream):
+        self.stream = stream
+        self.n_bytes = 0
 
-class SciBiomartException(SciException):
-    def __init__(self, message=''):
-        Exception.__init__(self, message)
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.n_bytes += len(data)
+        return data
+
+    def __iter__(self):
+        return iter(self.read, b'')
 
 
 class SciBiomart:
 
-    def __init__(self, url=None):
+    # Dataset versions by (url, mart, dataset), shared by every instance so we only look each one up once.
+    dataset_versions = {}
+    dataset_versions_lock = threading.Lock()
+    # Attribute and filter catalogs by (url, mart, dataset)
+    catalogs = {}
+    catalogs_lock = threading.Lock()
+    # Attribute metadata (used to type results) by (url, mart, dataset)
+    attribute_tables = {}
+    attribute_tables_lock = threading.Lock()
+
+    def __init__(self, url=None, batch_size=250, max_workers=4, cache=None, retries=3, backoff_factor=1.0,
+                 max_backoff=60.0, snapshot=None, validate=False, compress=True, session=None, id_cache=None,
+                 instruments=None, post=True, strategy=None, stream_rows=1000000, max_rows=5000000):
         self.mart = None
         self.dataset = None
         self.url = url or 'http://www.ensembl.org/biomart/'
         self.url = self.url if self.url[-1] == '/' else f'{self.url}/'
         self.u = SciUtil()
-        self.dataset_version = ''
-        self.session = urllib3.PoolManager()
+        self._dataset_version = None  # Resolved when first used, see dataset_version.
+        # Large filter lists are split into batches of batch_size values and run on at most max_workers threads.
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        # Responses are compressed on the wire as negotiated by the session, without compress we ask for them as is.
+        self.compress = compress
+        # Connections are pooled in a SciBiomartSession, by default the process wide one so they are kept alive
+        # between instances. Any other transport can be passed in (see scibiomart.transport).
+        self.session = session if session is not None else get_default_session()
+        self.transfer_stats = {'requests': 0, 'wire_bytes': 0, 'decoded_bytes': 0}
+        self.transfer_stats_lock = threading.Lock()
+        self.cache = cache  # Optional SciBiomartCache, responses are reused from here before going to the network.
+        # Queries are sent as a form encoded POST body, which unlike the URL has no practical limit on its length.
+        self.post = post
+        # The default strategy of run_query, with auto we count the rows first and parse results of at least
+        # stream_rows rows as they are read. Queries of more than max_rows rows are refused (see plan_query).
+        self.strategy = strategy
+        self.stream_rows = stream_rows
+        self.max_rows = max_rows
+        self.row_counts = {}  # Counts of queries (see count_query) by request and dataset version
+        # Failed requests are retried after a random wait of up to backoff_factor * 2^attempt (capped at max_backoff)
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.snapshot = snapshot  # Optional SciBiomartSnapshot, queries it can answer don't go to the server.
+        self.validate = validate  # Check attributes and filters against the catalog before sending queries.
+        self.id_cache = id_cache  # Optional SciBiomartIdCache, IDs already looked up are answered from memory.
+        # Instruments (see scibiomart.instrument) get the timing of each phase of a query, cache hits and retries.
+        self.tracer = Tracer(instruments)
+        self.completed_batches = {}  # Results of batches from queries that had failed batches, reused when re-run.
         self.df = None  # Stores the most recent dataframe.
+        self.attributes_df = None  # Attribute metadata for the current dataset, used to type the results.
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close_session()
 
-    def query_biomart(self, query):
+    def add_instrument(self, instrument):
+        """ Adds an instrument (e.g. a SciBiomartStats) that gets the spans and events of every query. """
+        self.tracer.instruments.append(instrument)
+
+    def record_transfer(self, response, decoded_bytes: int) -> int:
+        """ Records the bytes received over the wire (compressed) and after decompressing them. """
+        wire_bytes = response.tell() if hasattr(response, 'tell') else decoded_bytes
+        with self.transfer_stats_lock:
+            self.transfer_stats['requests'] += 1
+            self.transfer_stats['wire_bytes'] += wire_bytes
+            self.transfer_stats['decoded_bytes'] += decoded_bytes
+        return wire_bytes
+
+    def query_biomart(self, query, version='', complete=False, check=None):
+        """
+        Runs a query against the martservice. If we have a cache the response is keyed on the request (see
+        request_key) and the version (pass the dataset version for anything that changes between releases).
+
+        With complete the response must end with biomart's [success] stamp (see build_query), which is removed. A
+        missing stamp means the response was truncated so like connection errors and busy servers it is retried.
+        check is called on responses from the server before they are cached, it should raise for invalid responses.
+        """
+        data = self.get_cached(query, version)
+        if data is None:
+            data = self.with_retries(self.fetch_biomart, query, complete)
+            if check is not None:
+                check(data, query)
+            if self.cache is not None and data:
+                self.cache.put(self.request_key(query), data, version)
+        return self.check_complete(data, query) if complete else data
+
+    def fetch_biomart(self, query, complete=False) -> bytes:
+        """ Gets the response to a query from the server, checking that it is complete. """
+        with self.tracer.span('request') as span:
+            response = self.request_biomart(query)
+            data = response.data
+            span.set_attribute('wire_bytes', self.record_transfer(response, len(data)))
+            span.set_attribute('decoded_bytes', len(data))
+        if complete:
+            self.check_complete(data, query)
+        return data
+
+    def query_request(self, query: str) -> dict:
+        """ Returns the method, url, body and headers to send a query (a query document from build_query or a URL). """
+        if not query.startswith('<'):
+            request = {'method': 'GET', 'url': query, 'headers': {}}
+        elif not self.post:
+            request = {'method': 'GET', 'url': f'{self.url}martservice?{urlencode({"query": query})}', 'headers': {}}
+        else:
+            request = {'method': 'POST', 'url': f'{self.url}martservice', 'body': urlencode({'query': query}),
+                       'headers': {'Content-Type': 'application/x-www-form-urlencoded'}}
+        if not self.compress:
+            # Overrides the encodings the session asks for, so one session serves both settings
+            request['headers']['Accept-Encoding'] = 'identity'
+        return request
+
+    def request_key(self, query: str) -> str:
+        """ The method, url and body a query is sent as, so cached responses are never shared between servers. """
+        request = self.query_request(query)
+        return f'{request["method"]} {request["url"]}\n{request.get("body") or ""}'
+
+    def request_biomart(self, query, **kwargs):
+        """ Sends a query to the server, raises a SciBiomartRetryException for failures worth retrying. """
         try:
-            response = self.session.request('GET', query)
-            return response.data
+            response = self.session.request(**self.query_request(query), **kwargs)
         except Exception as e:
-            self.u.err_p(['query_biomart: Error running biomart query: ', query])
-            raise SciBiomartException(str(e))
+            raise SciBiomartRetryException(f'Error running biomart query: {e}')
+        if response.status in RETRY_STATUSES:
+            raise SciBiomartRetryException(f'Biomart returned HTTP {response.status}')
+        if response.status >= 400:
+            raise SciBiomartException(f'Biomart returned HTTP {response.status}')
+        return response
+
+    def check_complete(self, data: bytes, query='') -> bytes:
+        """ Checks the response ends with the [success] stamp and returns it without the stamp. """
+        end = data.rfind(SUCCESS_STAMP, max(0, len(data) - len(SUCCESS_STAMP) - 16))
+        if end >= 0 and not data[end + len(SUCCESS_STAMP):].strip():
+            return data[:end]
+        if data.startswith(b'Query ERROR'):
+            raise SciBiomartException(data[:1000].decode('utf-8', errors='replace'))
+        raise SciBiomartRetryException(f'Incomplete response from biomart ({len(data)} bytes).')
+
+    def with_retries(self, func, *args, **kwargs):
+        """ Calls func retrying on a SciBiomartRetryException with exponential backoff and jitter. """
+        for attempt in range(self.retries + 1):
+            try:
+                return func(*args, **kwargs)
+            except SciBiomartRetryException as e:
+                if attempt == self.retries:
+                    self.u.err_p([f'query_biomart: Giving up after {attempt + 1} attempts: ', str(e)])
+                    raise
+                delay = random.uniform(0, min(self.max_backoff, self.backoff_factor * 2 ** attempt))
+                self.tracer.event('retry', attempt=attempt + 1, delay=delay, error=str(e))
+                self.u.warn_p([f'query_biomart: {e} Retrying in {delay:.1f}s ({attempt + 1}/{self.retries}).'])
+                time.sleep(delay)
+
+    def stream_biomart(self, query, version=''):
+        """
+        Opens a query without reading the body so that it can be parsed as it arrives, returns a file like object.
+        Cached responses are served from the cache but streamed responses aren't written to it.
+        """
+        data = self.get_cached(query, version)
+        if data is not None:
+            return io.BytesIO(data)
+        return self.with_retries(self.request_biomart, query, preload_content=False)
+
+    @staticmethod
+    def close_stream(stream, consumed=True):
+        """ Returns the connection to the pool if we read the whole response, otherwise it is closed. """
+        if consumed and hasattr(stream, 'release_conn'):
+            stream.release_conn()
+        else:
+            stream.close()
+
+    def get_cached(self, query, version=''):
+        """ Returns the cached response for a query (None if not cached), when offline a miss is an error. """
+        if self.cache is None:
+            return None
+        data = self.cache.get(self.request_key(query), version)
+        self.tracer.event('cache_miss' if data is None else 'cache_hit')
+        if data is None and self.cache.offline:
+            self.u.err_p(['query_biomart: Running offline and the query is not in the cache: ', query])
+            raise SciBiomartException(f'Query not cached (offline mode): {query}')
+        return data
 
     def set_mart(self, mart: str):
         if self.mart:
             self.u.dp([f'Overriding current mart: {self.mart} with new mart: {mart}'])
         self.mart = mart
+        self._dataset_version = None
 
     def set_dataset(self, dataset: str):
         if self.dataset:
             self.u.dp([f'Overriding current dataset: {self.dataset} with new dataset: {dataset}'])
         self.dataset = dataset
-        # Here we do a cheeky and even though people don't ask for it, we're going to go and add the dataset
-        # version to the label of the dataset (this way people can trace it back)
-        dataset_configs = self.list_configs(False)
-        if dataset_configs['@version']:
-            self.dataset_version = f'{dataset}-{dataset_configs["@version"]}'
+        self._dataset_version = None
+        self.attributes_df = None
+
+    @property
+    def dataset_version(self) -> str:
+        """
+        Here we do a cheeky and even though people don't ask for it, we're going to go and add the dataset
+        version to the label of the dataset (this way people can trace it back). The version is only looked up
+        the first time it is used and then kept for the mart and dataset.
+        """
+        if self._dataset_version is None:
+            if not self.mart or not self.dataset:
+                return ''
+            if self.has_snapshot():
+                self._dataset_version = self.snapshot.metadata(self.mart, self.dataset)['dataset_version']
+                return self._dataset_version
+            key = (self.url, self.mart, self.dataset)
+            with SciBiomart.dataset_versions_lock:
+                version = SciBiomart.dataset_versions.get(key)
+            if version is None:
+                version = self.get_dataset_version()
+                with SciBiomart.dataset_versions_lock:
+                    SciBiomart.dataset_versions[key] = version
+            self._dataset_version = f'{self.dataset}-{version}' if version else ''
+        return self._dataset_version
+
+    @dataset_version.setter
+    def dataset_version(self, dataset_version: str):
+        self._dataset_version = dataset_version
+
+    def get_dataset_version(self) -> str:
+        """
+        Gets the version from the dataset configuration. The configuration is large but the version is an attribute
+        of the root element so we parse the response as it streams in and stop at the root element.
+        """
+        query = f'{self.url}martservice?type=configuration&dataset={self.dataset}&mart={self.mart}'
+        root_attrs = {}
+
+        def start_element(name, attrs):
+            root_attrs.update(attrs)
+            raise StopIteration
+
+        parser = expat.ParserCreate()
+        parser.StartElementHandler = start_element
+        # With a cache we keep the whole configuration so the version can still be found when offline
+        stream = io.BytesIO(self.query_biomart(query)) if self.cache is not None else self.stream_biomart(query)
+        try:
+            while True:
+                chunk = stream.read(8192)
+                if not chunk:
+                    break
+                parser.Parse(chunk, False)
+        except StopIteration:
+            pass
+        except expat.ExpatError as e:
+            self.u.err_p(['get_dataset_version: Could not parse the dataset configuration: ', query])
+            raise SciBiomartException(str(e))
+        finally:
+            # We usually stop part way through the response so we can't reuse the connection
+            self.close_stream(stream, consumed=False)
+        return root_attrs.get('version', '')
+
+    def has_snapshot(self) -> bool:
+        """ Whether we have a local snapshot of the current mart and dataset. """
+        return self.snapshot is not None and self.snapshot.has(self.mart, self.dataset)
+
+    def cache_version(self) -> str:
+        """ The version cached responses are keyed on, only looked up if we have a cache. """
+        return self.dataset_version if self.cache is not None else ''
 
     def add_filters(self, filter_dict: dict) -> str:
-        filter_str = ''
-        if filter_dict:
-            for filter_name, filter_value in filter_dict.items():
-                # Check if it is a list, if so parse the values to strings & then add it
-                if isinstance(filter_value, list):
-                    filter_value = ','.join(str(val) for val in filter_value)
-                filter_str += f'<Filter name = "{filter_name}" value = "{filter_value}" />'
-        return filter_str
+        return render_filters(filter_dict)
 
     def add_attrs(self, attr_list: list) -> str:
-        attr_str = ''
-        if attr_list:
-            for attr_name in attr_list:
-                attr_str += f'<Attribute name = "{attr_name}" />'
-        return attr_str
+        return render_attributes(attr_list)
 
     def build_query(self, filter_dict: dict, attr_list: list) -> str:
-        """ Builds a query formatted to get values from a dataset """
-        query = f'{self.url}martservice?query=<?xml version="1.0" encoding="UTF-8"?><!DOCTYPE Query>' \
-                f'<Query virtualSchemaName = "default" formatter = "TSV" header = "0" uniqueRows = "0" count = "" datasetConfigVersion = "0.6" >' \
-                f'<Dataset name = "{self.dataset}" interface = "default" >'\
-                f'{self.add_filters(filter_dict)}{self.add_attrs(attr_list)}</Dataset>' \
-                f'</Query>'
-        return query
-
-    def run_query(self, filter_dict: dict, attr_list: list):
+        """
+        Builds a query document formatted to get values from a dataset. Only the filters are rendered for each
+        query, the rest comes from a template cached for the dataset and attributes (see scibiomart.query).
+        """
+        return get_template(self.dataset, tuple(attr_list or [])).render(filter_dict)
+
+    def split_filters(self, filter_dict: dict, batch_size=None) -> list:
+        """
+        Splits the largest list valued filter into batches of batch_size values. Biomart ORs the values within
+        a filter so running each batch separately and concatenating the results gives the same rows.
+        """
+        batch_size = batch_size or self.batch_size
+        if not filter_dict or not batch_size:
+            return [filter_dict]
+        list_filters = [f for f, v in filter_dict.items() if isinstance(v, (list, tuple))]
+        if not list_filters:
+            return [filter_dict]
+        batch_filter = max(list_filters, key=lambda f: len(filter_dict[f]))
+        values = list(filter_dict[batch_filter])
+        if len(values) <= batch_size:
+            return [filter_dict]
+        batches = []
+        for i in range(0, len(values), batch_size):
+            batch = dict(filter_dict)
+            batch[batch_filter] = values[i: i + batch_size]
+            batches.append(batch)
+        return batches
+
+    def parse_results(self, results: bytes, attr_list: list) -> 'pd.DataFrame':
+        """ Parses the TSV returned by biomart into a dataframe with the attributes as the columns. """
+        import pandas as pd
+        rows = []
+        for line in results.decode("utf-8").split('\n'):
+            # Only the line ending is removed, leading or trailing tabs are empty values
+            line = line.rstrip('\r')
+            if line:
+                rows.append(line.split('\t'))
+        df = pd.DataFrame(rows)
+        if len(df.columns) == len(attr_list):
+            df.columns = attr_list
+        return df
+
+    def read_query(self, query: str, attr_list: list, chunksize=None):
+        """
+        Streams the response of a query straight into pandas read_csv rather than decoding the whole body. Yields
+        dataframes of at most chunksize rows (or a single dataframe if chunksize is None). The last row should be
+        biomart's [success] stamp, if it is missing we raise once the stream ends.
+        """
+        import pandas as pd
+        # The span isn't nested as it stays open while the caller handles each chunk
+        with self.tracer.span('stream', nest=False) as span:
+            stream = self.stream_biomart(query, self.cache_version())
+            counter = CountingReader(stream)
+            n_rows = 0
+            consumed = False
+            last_chunk = None
+            reader = None
+            try:
+                reader = pd.read_csv(counter, sep='\t', header=None, names=attr_list, dtype=str, na_filter=False,
+                                     quoting=csv.QUOTE_NONE, chunksize=chunksize)
+                # Hold back a chunk so we can check the last one for the stamp
+                for chunk in ([reader] if chunksize is None else reader):
+                    if last_chunk is not None and len(last_chunk):
+                        n_rows += len(last_chunk)
+                        span.set_attribute('rows', n_rows)
+                        yield last_chunk
+                    last_chunk = chunk
+                consumed = True
+            except pd.errors.EmptyDataError:
+                consumed = True
+            finally:
+                if chunksize is not None and reader is not None:
+                    reader.close()
+                span.set_attribute('decoded_bytes', counter.n_bytes)
+                if hasattr(stream, 'release_conn'):  # Not from the cache
+                    span.set_attribute('wire_bytes', self.record_transfer(stream, counter.n_bytes))
+                self.close_stream(stream, consumed)
+            has_rows = last_chunk is not None and len(last_chunk)
+            if not has_rows or last_chunk.iloc[-1, 0] != SUCCESS_STAMP.decode('utf-8'):
+                if has_rows and str(last_chunk.iloc[0, 0]).startswith('Query ERROR'):
+                    raise SciBiomartException(str(last_chunk.iloc[0, 0]))
+                raise SciBiomartRetryException('Incomplete response from biomart.')
+            if len(last_chunk) > 1:
+                span.set_attribute('rows', n_rows + len(last_chunk) - 1)
+                yield last_chunk.iloc[:-1]
+
+    def query_to_df(self, query: str, attr_list: list, stream=False):
+        """ Runs a single query and returns the results as a dataframe (None if there were no results). """
+        if stream:
+            dfs = self.with_retries(lambda: list(self.read_query(query, attr_list)))
+            return dfs[0] if dfs else None
+        results = self.query_biomart(query, self.cache_version(), complete=True)
+        if not results:
+            return None
+        with self.tracer.span('parse') as span:
+            df = self.parse_results(results, attr_list)
+            span.set_attribute('rows', len(df))
+        return df
+
+    def get_catalog(self) -> 'SciBiomartCatalog':
+        """ Returns the attribute and filter catalog of the dataset, downloaded once per mart and dataset. """
+        from scibiomart.catalog import SciBiomartCatalog
+        key = (self.url, self.mart, self.dataset)
+        with SciBiomart.catalogs_lock:
+            catalog = SciBiomart.catalogs.get(key)
+        if catalog is None:
+            df = self.df
+            catalog = SciBiomartCatalog(self.list_attributes(False), self.list_filters(False))
+            self.df = df  # Listing the attributes replaces the most recent dataframe
+            with SciBiomart.catalogs_lock:
+                SciBiomart.catalogs[key] = catalog
+        return catalog
+
+    def validate_query(self, filter_dict: dict, attr_list: list, check_pages=True):
+        """ Checks the attributes and filters exist and the attributes are on one page, raises if not. """
+        try:
+            self.get_catalog().validate(filter_dict, attr_list, check_pages)
+        except SciBiomartException as e:
+            self.u.err_p(['validate_query: Invalid query, not sending it.\n', str(e)])
+            raise
+
+    def search(self, term: str, limit=20) -> 'pd.DataFrame':
+        """ Searches the attributes and filters of the dataset by name and description (see SciBiomartCatalog). """
+        return self.get_catalog().search(term, limit)
+
+    def get_attribute_types(self, attr_list: list) -> dict:
+        """
+        Returns the kind of each attribute (integer, strand, float or category) using the attribute metadata of the
+        dataset, if we can't get the metadata we fall back on the attribute names.
+        """
+        import pandas as pd
+        from scibiomart.dtypes import attribute_types
+        if self.attributes_df is None:
+            key = (self.url, self.mart, self.dataset)
+            with SciBiomart.attribute_tables_lock:
+                self.attributes_df = SciBiomart.attribute_tables.get(key)
+        if self.attributes_df is None:
+            df = self.df
+            try:
+                attributes_df = self.list_attributes(False)
+                if isinstance(attributes_df, pd.DataFrame):
+                    self.attributes_df = attributes_df
+                    with SciBiomart.attribute_tables_lock:
+                        SciBiomart.attribute_tables[key] = attributes_df
+            except SciBiomartException:
+                self.u.warn_p(['get_attribute_types: Could not get the attribute metadata, using attribute names.'])
+            self.df = df  # Listing the attributes replaces the most recent dataframe
+        return attribute_types(attr_list, self.attributes_df)
+
+    def run_query(self, filter_dict: dict, attr_list: list, batch_size=None, max_workers=None, stream=False,
+                  typed=False, split_pages=True, join_key='ensembl_gene_id', strategy=None):
+        """
+        Runs a query against the dataset, if any of the filters has more than batch_size values the query is
+        split into batches which are run concurrently (using at most max_workers threads) and the results are
+        concatenated in the same order as the input values.
+
+        If we have a snapshot of the dataset that has the attributes and filters the query is answered locally. With an
+        id_cache, queries on a list of IDs (returned in one of the attributes) only fetch the IDs we haven't seen
+        and the rows come back in the order of the IDs.
+
+        Biomart can't return attributes from different pages (e.g. gene positions and homologs) in one query, with
+        split_pages these are run as one query per page (each with the join_key) and joined on join_key.
+
+        With stream the responses are parsed as they are read which avoids holding several copies of large
+        results in memory. With typed, coordinates are returned as integers, strand as int8 and columns like the
+        chromosome or biotype as categoricals (otherwise every column is a string).
+
+        strategy (by default the one given to SciBiomart) forces how the query is run: single (one request),
+        batched or stream (as with stream). With auto the rows are counted first and the strategy picked from the
+        estimate (see estimate). The results are still returned as one dataframe, so auto refuses queries of more
+        than max_rows rows, these should be written to disk with stream_query or processed in chunks with iter_query.
+        """
         err = self.check_mart()
         if err:
             return err
         err = self.check_dataset()
         if err:
             return err
-        results = self.query_biomart(self.build_query(filter_dict, attr_list))
-
-        if results:
-            datasets = results.decode("utf-8").split('\n')
-            rows = []
-            header = attr_list
-            for line in datasets:
-                line = line.strip().split('\t')
-                rows.append(line)
-            df = pd.DataFrame(rows)
-            if len(attr_list) > 1:
-                df.columns = header
-            self.df = df
-            return df
+        with self.tracer.span('run_query', dataset=self.dataset, attributes=len(attr_list)) as span:
+            df = self.run_dataset_query(filter_dict, attr_list, batch_size, max_workers, stream, typed, split_pages,
+                                        join_key, strategy or self.strategy)
+            span.set_attribute('rows', 0 if df is None else len(df))
+        if df is None:
+            return None
+        self.df = df
+        return df
+
+    def run_dataset_query(self, filter_dict: dict, attr_list: list, batch_size=None, max_workers=None, stream=False,
+                          typed=False, split_pages=True, join_key='ensembl_gene_id', strategy=None):
+        """ Runs a query once the mart and dataset have been checked, see run_query. """
+        from scibiomart.dtypes import convert_dtypes
+        if self.has_snapshot():
+            df = self.snapshot.query(self.mart, self.dataset, filter_dict, attr_list)
+            if df is not None:
+                self.tracer.event('snapshot_hit')
+                # Snapshots are stored typed
+                return df if typed else df.astype(object).where(df.notnull(), '').astype(str)
+        if self.validate:
+            self.validate_query(filter_dict, attr_list, check_pages=not split_pages)
+        if strategy:
+            batch_size, stream = self.plan_query(filter_dict, attr_list, strategy, batch_size, stream)
+        if self.id_cache is not None and self.id_cache.id_filter(filter_dict, attr_list):
+            df = self.id_cache.query(self, filter_dict, attr_list, lambda f: self.fetch_dataset(
+                f, attr_list, batch_size, max_workers, stream, split_pages, join_key))
+        else:
+            df = self.fetch_dataset(filter_dict, attr_list, batch_size, max_workers, stream, split_pages, join_key)
+        if df is not None and typed:
+            with self.tracer.span('convert', rows=len(df)):
+                df = convert_dtypes(df, self.get_attribute_types(attr_list))
+        return df
+
+    def plan_query(self, filter_dict: dict, attr_list: list, strategy: str, batch_size=None, stream=False) -> tuple:
+        """ Returns the batch_size and stream to run a query with for a strategy (see run_query). """
+        if strategy not in STRATEGIES:
+            raise SciBiomartException(f'Unknown strategy: {strategy}, use one of: {", ".join(sorted(STRATEGIES))}')
+        if strategy == 'auto':
+            query_estimate = self.estimate(filter_dict, attr_list, batch_size)
+            if self.max_rows and query_estimate['rows'] > self.max_rows:
+                self.u.err_p([f'run_query: The query would return about {query_estimate["rows"]} rows, more than '
+                              f'max_rows ({self.max_rows}).'])
+                raise SciBiomartException(f'Query too large ({query_estimate["rows"]} rows), use stream_query to write '
+                                          f'it to disk or iter_query to process it in chunks (or raise max_rows).')
+            strategy = query_estimate['strategy']
+            self.u.dp([f'Estimated {query_estimate["rows"]} rows ({query_estimate["bytes"] / 1024 ** 2:.1f} MB), '
+                       f'running the query as {strategy}.'])
+        if strategy == 'single':
+            # A batch large enough for every value
+            return max([len(v) for v in (filter_dict or {}).values() if isinstance(v, (list, tuple))] + [1]), stream
+        return batch_size, stream or strategy == 'stream'
+
+    def count_query(self, filter_dict: dict, attr_list=None, batch_size=None, max_workers=None) -> int:
+        """
+        Asks biomart how many entries of the dataset (e.g. genes) match the filters without downloading them. When
+        queries are sent as GET, large filters are counted in batches. Attributes with several values per entry (e.g.
+        transcripts or homologs of genes) return more rows than this. Counts are remembered by the instance.
+        """
+        err = self.check_mart() or self.check_dataset()
+        if err:
+            return err
+        # Biomart counts entries whatever the attributes, so one is enough (and avoids mixing attribute pages)
+        attrs = tuple((attr_list or ['ensembl_gene_id'])[:1])
+        # POSTed queries have no limit on their length so everything is counted at once
+        batches = self.split_filters(filter_dict, batch_size) if not self.post else [filter_dict]
+        queries = [get_template(self.dataset, attrs, count=True).render(batch) for batch in batches]
+        version = self.cache_version()
+        with self.tracer.span('count', batches=len(queries)) as span:
+            with ThreadPoolExecutor(max_workers=min(len(queries), max_workers or self.max_workers)) as executor:
+                rows = sum(executor.map(lambda q: self.count_batch(q, version), queries))
+            span.set_attribute('rows', rows)
+        return rows
+
+    def count_batch(self, query: str, version: str) -> int:
+        """ Runs a count query, reusing the count if the instance has already run it. """
+        key = (self.request_key(query), version)
+        if key not in self.row_counts:
+            self.row_counts[key] = self.parse_count(self.query_biomart(query, version, check=self.parse_count), query)
+        return self.row_counts[key]
+
+    def parse_count(self, data: bytes, query='') -> int:
+        """ Reads the count from a count query's response (possibly followed by the completion stamp). """
+        values = data.decode('utf-8', errors='replace').split()
+        if not values or not values[0].isdigit():
+            self.u.err_p(['count_query: Could not count the rows of the query: ', query])
+            raise SciBiomartException(data[:1000].decode('utf-8', errors='replace') or 'Empty count')
+        return int(values[0])
+
+    def estimate(self, filter_dict: dict, attr_list: list, batch_size=None) -> dict:
+        """
+        Estimates the size of a query from the count of its rows: rows, bytes (of the response), memory_bytes (as an
+        untyped dataframe), batches and the strategy run_query would use: single, batched (filters with more than
+        batch_size values) or stream (at least stream_rows rows).
+        """
+        from scibiomart.dtypes import estimate_row_bytes
+        rows = self.count_query(filter_dict, attr_list, batch_size)
+        if isinstance(rows, dict):  # The mart or dataset isn't set
+            return rows
+        # The attribute metadata is used if we already have it, otherwise the kinds come from the attribute names
+        row_bytes, row_memory = estimate_row_bytes(attr_list, self.attributes_df)
+        n_batches = len(self.split_filters(filter_dict, batch_size))
+        if rows >= self.stream_rows:
+            strategy = 'stream'
+        else:
+            strategy = 'batched' if n_batches > 1 else 'single'
+        return {'rows': rows, 'bytes': rows * row_bytes, 'memory_bytes': rows * row_memory, 'batches': n_batches,
+                'strategy': strategy}
+
+    def fetch_dataset(self, filter_dict: dict, attr_list: list, batch_size=None, max_workers=None, stream=False,
+                      split_pages=True, join_key='ensembl_gene_id'):
+        """ Gets the results of a query from the server, see run_query. """
+        # We only know the pages if we have the catalog, otherwise we find out if the server refuses the query
+        attr_groups = self.split_attributes(attr_list, join_key) if split_pages and self.has_catalog() else [attr_list]
+        try:
+            if len(attr_groups) > 1:
+                return self.query_pages(filter_dict, attr_groups, attr_list, join_key, batch_size, max_workers, stream)
+            return self.query_dataset(filter_dict, attr_list, batch_size, max_workers, stream)
+        except SciBiomartException as e:
+            # Only log errors we don't handle, a mixed page query is expected to fail before we split it
+            if not split_pages or len(attr_groups) > 1 or 'attribute pages' not in str(e).lower():
+                self.u.err_p(['run_query: Error running biomart query: ', str(e)])
+                raise
+        self.u.warn_p(['run_query: The attributes are on different pages, running a query for each page.'])
+        attr_groups = self.split_attributes(attr_list, join_key)
+        return self.query_pages(filter_dict, attr_groups, attr_list, join_key, batch_size, max_workers, stream)
+
+    def query_dataset(self, filter_dict: dict, attr_list: list, batch_size=None, max_workers=None, stream=False):
+        """ Runs a query (in batches if the filters are large) returning the untyped results or None. """
+        import pandas as pd
+        with self.tracer.span('split') as span:
+            batches = self.split_filters(filter_dict, batch_size)
+            queries = [self.build_query(batch, attr_list) for batch in batches]
+            span.set_attribute('batches', len(batches))
+        if len(batches) == 1:
+            return self.query_to_df(queries[0], attr_list, stream)
+        max_workers = max_workers or self.max_workers
+        self.u.dp([f'Running query in {len(batches)} batches using {max_workers} workers.'])
+        dfs = self.run_batches(queries, attr_list, max_workers, stream)
+        dfs = [df for df in dfs if df is not None]
+        return pd.concat(dfs, ignore_index=True) if dfs else None
+
+    def has_catalog(self) -> bool:
+        with SciBiomart.catalogs_lock:
+            return (self.url, self.mart, self.dataset) in SciBiomart.catalogs
+
+    def split_attributes(self, attr_list: list, join_key='ensembl_gene_id') -> list:
+        """
+        Splits attributes into groups that are each on one page, adding the join_key to every group. Attributes are
+        put on a page we already use if they can be, otherwise on the page that has the most of the other attributes.
+        """
+        catalog = self.get_catalog()
+        if catalog.pages(attr_list):
+            return [attr_list]
+        groups = {}
+        for attr_name in attr_list:
+            if attr_name == join_key:
+                continue
+            attr_pages = catalog.attribute_pages.get(attr_name, [])
+            page = next((p for p in groups if p in attr_pages), None)
+            if page is None:
+                if not attr_pages:
+                    raise SciBiomartException(f'Unknown attribute: {attr_name}')
+                page = max(attr_pages, key=lambda p: sum(p in catalog.attribute_pages.get(a, []) for a in attr_list))
+                groups[page] = []
+            groups[page].append(attr_name)
+        attr_groups = []
+        for page, attrs in groups.items():
+            if page not in catalog.attribute_pages.get(join_key, []):
+                raise SciBiomartException(f'Can not join the {page} attributes ({", ".join(attrs)}) as {join_key} '
+                                          f'is not on that page.')
+            attr_groups.append([join_key] + attrs)
+        return attr_groups
+
+    def query_pages(self, filter_dict: dict, attr_groups: list, attr_list: list, join_key='ensembl_gene_id',
+                    batch_size=None, max_workers=None, stream=False) -> 'pd.DataFrame':
+        """ Runs one query per group of attributes concurrently and joins them on join_key. """
+        import pandas as pd
+        with ThreadPoolExecutor(max_workers=len(attr_groups)) as executor:
+            futures = [executor.submit(self.query_dataset, filter_dict, attrs, batch_size, max_workers, stream)
+                       for attrs in attr_groups]
+            dfs = [future.result() for future in futures]
+        with self.tracer.span('join', pages=len(attr_groups)) as span:
+            df = None
+            for attrs, page_df in zip(attr_groups, dfs):
+                page_df = page_df if page_df is not None else pd.DataFrame(columns=attrs)
+                if len(attrs) == 1:
+                    page_df.columns = attrs
+                df = page_df if df is None else df.merge(page_df, on=join_key, how='outer', sort=False)
+            span.set_attribute('rows', len(df))
+        columns = [a for a in attr_list if a in df.columns]
+        return df[columns]
+
+    def run_batches(self, queries: list, attr_list: list, max_workers: int, stream=False) -> list:
+        """
+        Runs the batches of a query concurrently returning the dataframes in the order of the queries. If any batch
+        fails the others are kept so that running the same query again only re-runs the batches that failed.
+        """
+        def run_batch(query):
+            if query not in self.completed_batches:
+                self.completed_batches[query] = self.query_to_df(query, attr_list, stream)
+            return self.completed_batches[query]
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(run_batch, query) for query in queries]
+        dfs = []
+        errors = []
+        for future in futures:
+            try:
+                dfs.append(future.result())
+            except SciBiomartException as e:
+                errors.append(str(e))
+        if errors:
+            raise SciBiomartException(f'{len(errors)} of {len(queries)} batches failed, run the same query again to '
+                                      f'only re-run the failed batches. First error: {errors[0]}')
+        for query in queries:
+            self.completed_batches.pop(query, None)
+        return dfs
+
+    def iter_query(self, filter_dict: dict, attr_list: list, chunksize=100000, batch_size=None, typed=False):
+        """
+        Runs a query yielding the results as dataframes of at most chunksize rows, each chunk is parsed as the
+        response is read so memory stays bounded regardless of the size of the result. Batches are run one at a time.
+        """
+        from scibiomart.dtypes import convert_dtypes
+        if self.check_mart() or self.check_dataset():
+            return
+        if self.validate:
+            self.validate_query(filter_dict, attr_list)
+        attr_types = self.get_attribute_types(attr_list) if typed else {}
+        for batch in self.split_filters(filter_dict, batch_size):
+            for df in self.read_query(self.build_query(batch, attr_list), attr_list, chunksize):
+                yield convert_dtypes(df, attr_types)
+
+    def stream_query(self, filter_dict: dict, attr_list: list, file_path, fmt='csv', compression=None, sort=False,
+                     chrom_order='lexicographic', chunksize=100000, batch_size=None, tmp_dir=None):
+        """
+        Runs a query writing the results to a csv or tsv file as they are downloaded, so memory is bounded by chunksize
+        rather than the size of the result. As for save, file_path has the version and extension added (- writes to
+        stdout, an open file is written to as is). With sort the results are sorted as sort_df_on_starts would using
+        an external merge sort (temporary files go in tmp_dir). Returns the path and number of rows written.
+        """
+        from scibiomart.formats import FORMATS
+        if fmt not in STREAM_FORMATS:
+            raise SciBiomartException(f'Only {" and ".join(STREAM_FORMATS)} can be streamed, not: {fmt}')
+        if isinstance(file_path, str) and file_path != '-':
+            file_path = f'{file_path}{self.dataset_version}{FORMATS[fmt]}'
+        chunks = self.iter_query(filter_dict, attr_list, chunksize, batch_size, typed=sort)
+        with open_output(file_path, compression) as out:
+            if sort:
+                n_rows = sort_chunks(chunks, out, STREAM_FORMATS[fmt], chrom_order, tmp_dir)
+            else:
+                n_rows = write_chunks(chunks, out, STREAM_FORMATS[fmt])
+        return file_path, n_rows
 
     def list_marts(self, print_values=True) -> dict:
         """
@@ -140,10 +794,11 @@ class SciBiomart:
                 self.u.err_p(['Query list_marts failed. Are you connected to the internet? Maybe try again.'])
                 raise SciBiomartException(e)
 
-    def list_datasets(self, print_values=True) -> pd.DataFrame:
+    def list_datasets(self, print_values=True) -> 'pd.DataFrame':
         """
         Prints out a list of available datasets for a mart.
         """
+        import pandas as pd
         err = self.check_mart()
         if err:
             return err
@@ -169,14 +824,18 @@ class SciBiomart:
         """
         Lists attributes for a given dataset.
         """
+        import pandas as pd
         err = self.check_mart()
         if err:
             return err
         err = self.check_dataset()
         if err:
             return err
+        if self.has_snapshot():
+            self.df = self.snapshot.attributes(self.mart, self.dataset)
+            return self.df
         dataset_attributes = self.query_biomart(f'{self.url}martservice?type=attributes&dataset='
-                                           f'{self.dataset}&mart={self.mart}')
+                                                f'{self.dataset}&mart={self.mart}', self.cache_version())
         # Marts is returned as a tsv so just print each line
         if dataset_attributes:
             dataset_attributes = dataset_attributes.decode("utf-8").split('\n')
@@ -225,14 +884,18 @@ class SciBiomart:
         """
         Lists filters for a given dataset.
         """
+        import pandas as pd
         err = self.check_mart()
         if err:
             return err
         err = self.check_dataset()
         if err:
             return err
+        if self.has_snapshot():
+            self.current_df = self.snapshot.filters(self.mart, self.dataset)
+            return self.current_df
         dataset_filters = self.query_biomart(f'{self.url}martservice?type=filters&dataset'
-                                        f'={self.dataset}&mart={self.mart}')
+                                             f'={self.dataset}&mart={self.mart}', self.cache_version())
         # Marts is returned as a tsv so just print each line
         if dataset_filters:
             dataset_filters = dataset_filters.decode("utf-8").split('\n')
@@ -263,12 +926,30 @@ class SciBiomart:
             self.u.warn_p([err_msg])
             return {'err': err_msg}
 
-    def save_as_csv(self, df: pd.DataFrame, file_path: str):
-        self.u.save_df(df, f'{file_path}{self.dataset_version}.csv')
-        return f'{file_path}{self.dataset_version}.csv'
+    def save_as_csv(self, df: 'pd.DataFrame', file_path: str):
+        return self.save(df, file_path, 'csv')
+
+    def save(self, df: 'pd.DataFrame', file_path: str, fmt='csv', compression=None) -> str:
+        """
+        Saves the results as csv, tsv, parquet, feather or arrow. The dataset version is added to the file name and,
+        for the columnar formats, stored in the file metadata (see formats.load_metadata).
+        """
+        from scibiomart.formats import FORMATS, save_df
+        path = f'{file_path}{self.dataset_version}{FORMATS[fmt]}' if fmt in FORMATS else file_path
+        return save_df(df, path, fmt, compression, {'dataset_version': self.dataset_version,
+                                                     'mart': self.mart or '', 'dataset': self.dataset or ''})
+
+    @staticmethod
+    def load(file_path: str, fmt=None, columns=None) -> 'pd.DataFrame':
+        """ Loads results saved with save, the format is taken from the extension if not given. """
+        from scibiomart.formats import load_df
+        return load_df(file_path, fmt, columns)
 
     def close_session(self):
-        """ Terminate any connections that are hanging. """
+        """
+        Terminate any connections that are hanging. The session is shared (the default one or one passed in) so it
+        stays open for the other instances using it, new connections are made as needed.
+        """
         self.session.clear()
 
     def get_current_df(self):
@@ -276,30 +957,54 @@ class SciBiomart:
         return self.df
 
     @staticmethod
-    def sort_df_on_starts(results_df):
+    def chromosome_order(chromosomes, chrom_order='lexicographic') -> list:
+        """
+        Orders chromosome names. chrom_order can be:
+            lexicographic: the same way that bedtools/samtools sort i.e. 11 is before 2.
+            natural: 1, 2, ..., 22, X, Y, MT then any other contigs lexicographically.
+            a path to a .fai index (or a list of names): in the order of the index with anything not in it at the end.
+        """
+        chromosomes = sorted(set(str(c) for c in chromosomes))
+        if isinstance(chrom_order, str) and chrom_order == 'lexicographic':
+            return chromosomes
+        if isinstance(chrom_order, str) and chrom_order == 'natural':
+            sex_chroms = {'X': 0, 'Y': 1, 'W': 2, 'Z': 3, 'M': 4, 'MT': 4}
+
+            def natural_key(chrom):
+                name = chrom[3:] if chrom.lower().startswith('chr') else chrom
+                if name.isdigit():
+                    return 0, int(name), chrom
+                if name.upper() in sex_chroms:
+                    return 1, sex_chroms[name.upper()], chrom
+                return 2, 0, chrom
+            return sorted(chromosomes, key=natural_key)
+        if isinstance(chrom_order, str):
+            # A .fai index, the first column is the name of the sequence
+            with open(chrom_order, 'r') as fai:
+                chrom_order = [line.split('\t')[0].strip() for line in fai if line.strip()]
+        ordered = [str(c) for c in chrom_order]
+        in_order = set(ordered)
+        return ordered + [c for c in chromosomes if c not in in_order]
+
+    @staticmethod
+    def sort_df_on_starts(results_df, chrom_order='lexicographic'):
         """
         Sorts a results dataframe by chr, start, and end. This allows us to do fast matching in
         other tools i.e. when we're looking at annotating regions to genes. (sciloc2gene)
 
-        We sort this in the same way that our peak files are sorted using samtools.
+        We sort this in the same way that our peak files are sorted using samtools (see chromosome_order for the
+        other orderings). The start is the TSS i.e. the end for genes on the negative strand. Returns a new dataframe,
+        the input isn't changed.
         """
-
-        starts = results_df['start_position'].values
-        ends = results_df['end_position'].values
-        strands = results_df['strand'].values
-        fake_starts = []
-        i = 0
-        for strand in strands:
-            # Lets make this have a "fake" start based on the TSS
-            if int(strand) < 0:
-                fake_starts.append(int(ends[i]))
-            else:
-                fake_starts.append(int(starts[i]))
-            i += 1
-        # Again, lets use the ordering of the index keys
-        results_df['fake_starts'] = fake_starts
-        # Sort on fake starts and chr
-        sorted_df = results_df.sort_values(['chromosome_name', 'fake_starts'], ascending=[True, True])
-        # Drop our fake col
-        sorted_df = sorted_df.drop(['fake_starts'], axis=1)
-        return sorted_df
+        import numpy as np
+        import pandas as pd
+        starts = pd.to_numeric(results_df['start_position']).values
+        ends = pd.to_numeric(results_df['end_position']).values
+        strands = pd.to_numeric(results_df['strand']).values
+        # Lets make this have a "fake" start based on the TSS
+        fake_starts = np.where(strands < 0, ends, starts)
+        chromosomes = results_df['chromosome_name'].astype(str).values
+        chrom_key = pd.Categorical(chromosomes,
+                                   categories=SciBiomart.chromosome_order(chromosomes, chrom_order)).codes
+        # Sort on chr then fake starts, lexsort is stable so ties keep the order they came in
+        return results_df.iloc[np.lexsort((fake_starts, chrom_key))]
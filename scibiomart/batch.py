@@ -0,0 +1,143 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+"""
+Runs many queries described in a manifest (YAML or JSON) concurrently, e.g.:
+
+    max_workers: 4              # Jobs run at once
+    cache: biomart_cache/       # Optional, a SciBiomartCache shared by the jobs
+    report: batch_report.tsv    # Optional, the timing of each job
+    defaults:                   # Used for any value a job doesn't set
+      mart: ENSEMBL_MART_ENSEMBL
+      attributes: [ensembl_gene_id, external_gene_name, chromosome_name, start_position, end_position, strand]
+      format: parquet
+    jobs:
+      - name: human
+        dataset: hsapiens_gene_ensembl
+        output: refs/hsapiens_
+        sort: true
+      - name: mouse_brca2
+        dataset: mmusculus_gene_ensembl
+        filters: {ensembl_gene_id: [ENSMUSG00000041147]}
+        output: refs/brca2_
+        format: csv
+
+The jobs share one connection pool (and the cache), a failed job is reported and doesn't stop the others.
+"""
+
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+from sciutil import SciUtil
+
+from scibiomart.base import SciBiomart
+from scibiomart.cache import SciBiomartCache
+from scibiomart.errors import SciBiomartException
+from scibiomart.session import SciBiomartSession
+from scibiomart.snapshot import SciBiomartSnapshot
+
+JOB_DEFAULTS = {'mart': 'ENSEMBL_MART_ENSEMBL', 'filters': None, 'format': 'csv', 'compression': None, 'sort': False,
+                'order': 'lexicographic', 'stream': False, 'chunksize': 100000}
+SORT_ATTRIBUTES = ['external_gene_name', 'chromosome_name', 'start_position', 'end_position', 'strand']
+REPORT_COLUMNS = ['name', 'mart', 'dataset', 'rows', 'seconds', 'output', 'error']
+
+
+def load_manifest(path: str) -> dict:
+    """ Reads a manifest, .json files are read as JSON and anything else as YAML (which needs PyYAML). """
+    with open(path, 'r') as f:
+        text = f.read()
+    if path.lower().endswith('.json'):
+        return json.loads(text)
+    try:
+        import yaml
+    except ImportError:
+        raise SciBiomartException('Reading YAML manifests needs PyYAML, install it with: pip install pyyaml '
+                                  '(or use a .json manifest)')
+    return yaml.safe_load(text)
+
+
+def get_jobs(manifest: dict) -> list:
+    """ Returns the jobs of a manifest with the defaults filled in, checking each has a dataset and output. """
+    jobs = []
+    for i, job in enumerate(manifest.get('jobs') or []):
+        job = {**JOB_DEFAULTS, **(manifest.get('defaults') or {}), **job}
+        job.setdefault('name', job.get('dataset') or f'job_{i}')
+        if not job.get('dataset') or not job.get('output'):
+            raise SciBiomartException(f'Job {job["name"]} in the manifest needs a dataset and an output.')
+        if isinstance(job.get('attributes'), str):
+            job['attributes'] = job['attributes'].split(',')
+        if not job.get('attributes') and job['sort']:  # We need the start and ends at least
+            job['attributes'] = SORT_ATTRIBUTES
+        jobs.append(job)
+    if not jobs:
+        raise SciBiomartException('The manifest has no jobs.')
+    return jobs
+
+
+def run_job(job: dict, url=None, session=None, cache=None, snapshot=None) -> dict:
+    """ Runs one job of a manifest, returns the number of rows written and where to. """
+    sb = SciBiomart(url, session=session, cache=cache, snapshot=snapshot)
+    sb.set_mart(job['mart'])
+    sb.set_dataset(job['dataset'])
+    filters, attrs = job['filters'], job['attributes']
+    if job['stream']:
+        output, n_rows = sb.stream_query(filters, attrs, job['output'], job['format'], job['compression'],
+                                         sort=job['sort'], chrom_order=job['order'], chunksize=job['chunksize'])
+        return {'rows': n_rows, 'output': output}
+    results_df = sb.run_query(filters, attrs, typed=job['sort'])
+    if results_df is None:
+        results_df = pd.DataFrame(columns=attrs)
+    if job['sort']:
+        results_df = results_df[~results_df['external_gene_name'].isnull()]
+        results_df = sb.sort_df_on_starts(results_df, job['order'])
+    return {'rows': len(results_df), 'output': sb.save(results_df, job['output'], job['format'], job['compression'])}
+
+
+def run_manifest(manifest: dict, max_workers=None) -> pd.DataFrame:
+    """
+    Runs the jobs of a manifest on max_workers threads (from the manifest if not given) and returns a report of the
+    rows, output and time taken by each job (and the error for any that failed).
+    """
+    u = SciUtil()
+    jobs = get_jobs(manifest)
+    max_workers = max_workers or manifest.get('max_workers') or 4
+    cache = SciBiomartCache(manifest['cache']) if manifest.get('cache') else None
+    snapshot = SciBiomartSnapshot(manifest['snapshot']) if manifest.get('snapshot') else None
+
+    def run(job: dict) -> dict:
+        start = time.perf_counter()
+        report = {'name': job['name'], 'mart': job['mart'], 'dataset': job['dataset'], 'rows': None, 'output': None,
+                  'error': None}
+        try:
+            report.update(run_job(job, manifest.get('url'), session, cache, snapshot))
+        except Exception as e:
+            u.err_p([f'Job {job["name"]} failed: ', e])
+            report['error'] = str(e)
+        report['seconds'] = round(time.perf_counter() - start, 3)
+        u.dp([f'Finished {job["name"]} in {report["seconds"]}s'])
+        return report
+
+    # Each job may run its batches on 4 threads, size the pool so they all keep their connections alive
+    with SciBiomartSession(maxsize=max_workers * 4) as session:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            reports = list(executor.map(run, jobs))
+    report_df = pd.DataFrame(reports, columns=REPORT_COLUMNS)
+    if manifest.get('report'):
+        report_df.to_csv(manifest['report'], sep='\t', index=False)
+    return report_df
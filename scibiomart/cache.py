@@ -0,0 +1,113 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+"""
+On disk cache for martservice responses.
+
+Responses are stored content addressed (the file name is the sha256 of the query and the dataset version) so that
+an entry is only reused for the same query against the same Ensembl release. The modified time of each file records
+when it was written (used for the TTL) and the access time when it was last read (used for LRU eviction).
+"""
+
+import hashlib
+import os
+import tempfile
+import threading
+import time
+
+
+class SciBiomartCache:
+
+    def __init__(self, cache_dir=None, max_size=1024 ** 3, ttl=None, unversioned_ttl=24 * 60 * 60, offline=False):
+        """
+        cache_dir: folder to store the responses in (defaults to ~/.cache/scibiomart).
+        max_size: maximum size in bytes of the cache, the least recently used entries are removed past this.
+        ttl: seconds before an entry keyed on a dataset version expires (None never expires these).
+        unversioned_ttl: seconds before an entry with no dataset version (e.g. the list of marts) expires.
+        offline: never go to the network, only answer queries from the cache (expired entries are still used).
+        """
+        self.cache_dir = cache_dir or os.path.join(os.path.expanduser('~'), '.cache', 'scibiomart')
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.max_size = max_size
+        self.ttl = ttl
+        self.unversioned_ttl = unversioned_ttl
+        self.offline = offline
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(query: str, version='') -> str:
+        return hashlib.sha256(f'{version or ""}\n{query}'.encode('utf-8')).hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f'{key}.tsv')
+
+    def get(self, query: str, version=''):
+        """ Returns the cached response for a query or None if it isn't cached (or has expired). """
+        path = self.path(self.key(query, version))
+        try:
+            stat = os.stat(path)
+            ttl = self.ttl if version else self.unversioned_ttl
+            if not self.offline and ttl is not None and time.time() - stat.st_mtime > ttl:
+                self.misses += 1
+                return None
+            with open(path, 'rb') as fh:
+                data = fh.read()
+            # Record the access for the LRU but keep the modified time as the time the entry was written.
+            os.utime(path, (time.time(), stat.st_mtime))
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return data
+
+    def put(self, query: str, data: bytes, version=''):
+        """ Stores a response, writing to a temp file first so readers never see a partial entry. """
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as fh:
+            fh.write(data)
+        os.replace(tmp_path, self.path(self.key(query, version)))
+        self.evict()
+
+    def evict(self):
+        """ Removes the least recently used entries until the cache is under max_size. """
+        if self.max_size is None:
+            return
+        with self._lock:
+            entries = []
+            total = 0
+            for entry in os.scandir(self.cache_dir):
+                if entry.name.endswith('.tsv'):
+                    stat = entry.stat()
+                    entries.append((stat.st_atime, stat.st_size, entry.path))
+                    total += stat.st_size
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_size:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+    def clear(self):
+        """ Removes every entry from the cache. """
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.tsv') or entry.name.endswith('.tmp'):
+                os.remove(entry.path)
@@ -0,0 +1,107 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+"""
+Catalog of the attributes and filters of a dataset used to check queries before they are sent.
+
+Biomart only fails once the query reaches the server (and with an unhelpful message) so we look up every attribute and
+filter locally, suggest close matches for typos and check the attributes can be returned together: attributes are
+grouped into pages (e.g. feature_page, homologs, sequences) and a query can only use attributes from one page.
+"""
+
+import difflib
+
+import pandas as pd
+
+from scibiomart.errors import SciBiomartException
+
+# Position of the page in the attribute listing (the columns of list_attributes are named by position)
+ATTRIBUTE_PAGE_COLUMN = 3
+
+
+class SciBiomartCatalog:
+
+    def __init__(self, attributes_df: pd.DataFrame, filters_df: pd.DataFrame):
+        self.attributes_df = attributes_df
+        self.filters_df = filters_df
+        # An attribute can be on several pages (e.g. ensembl_gene_id) so keep every page for each name
+        self.attribute_pages = {}
+        for name, page in zip(attributes_df['name'].values, attributes_df.iloc[:, ATTRIBUTE_PAGE_COLUMN].values):
+            self.attribute_pages.setdefault(name, []).append(page)
+        self.filters = set(filters_df['name'].values)
+        self.descriptions = {}
+        for kind, df in [('attribute', attributes_df), ('filter', filters_df)]:
+            for name, label in zip(df['name'].values, df['description'].values):
+                self.descriptions.setdefault((kind, name), label)
+
+    def has_attribute(self, attr_name: str) -> bool:
+        return attr_name in self.attribute_pages
+
+    def has_filter(self, filter_name: str) -> bool:
+        return filter_name in self.filters
+
+    def suggest(self, name: str, names, n=3) -> list:
+        """ Returns the closest names to a (probably misspelt) name. """
+        return difflib.get_close_matches(name, list(names), n=n, cutoff=0.6)
+
+    def pages(self, attr_list: list) -> list:
+        """ Returns the pages that have every attribute in attr_list (an empty list means the query must be split). """
+        pages = None
+        for attr_name in attr_list:
+            attr_pages = self.attribute_pages.get(attr_name, [])
+            pages = [p for p in attr_pages if p in pages] if pages is not None else list(attr_pages)
+        return pages or []
+
+    def validate(self, filter_dict: dict, attr_list: list, check_pages=True):
+        """ Raises a SciBiomartException describing unknown attributes or filters or attributes on several pages. """
+        errors = []
+        for attr_name in attr_list or []:
+            if not self.has_attribute(attr_name):
+                suggestions = self.suggest(attr_name, self.attribute_pages)
+                errors.append(f'Unknown attribute: {attr_name}' +
+                              (f' (did you mean: {", ".join(suggestions)}?)' if suggestions else ''))
+        for filter_name in filter_dict or {}:
+            if not self.has_filter(filter_name):
+                suggestions = self.suggest(filter_name, self.filters)
+                errors.append(f'Unknown filter: {filter_name}' +
+                              (f' (did you mean: {", ".join(suggestions)}?)' if suggestions else ''))
+        if not errors and check_pages and attr_list and not self.pages(attr_list):
+            attr_pages = {a: ','.join(self.attribute_pages[a]) for a in attr_list}
+            errors.append('Attributes from different pages can not be used in one query: ' +
+                          ', '.join(f'{a} ({p})' for a, p in attr_pages.items()))
+        if errors:
+            raise SciBiomartException('\n'.join(errors))
+
+    def search(self, term: str, limit=20) -> pd.DataFrame:
+        """
+        Searches the names and descriptions of the attributes and filters, exact substring matches come first
+        followed by fuzzy matches.
+        """
+        term = term.lower()
+        rows = []
+        for (kind, name), description in self.descriptions.items():
+            text = f'{name} {description}'.lower()
+            if term in text:
+                score = 1.0 + (term in name.lower())
+            else:
+                score = max(difflib.SequenceMatcher(None, term, name.lower()).ratio(),
+                            difflib.SequenceMatcher(None, term, str(description).lower()).ratio())
+            if score >= 0.6:
+                pages = ','.join(self.attribute_pages.get(name, [])) if kind == 'attribute' else ''
+                rows.append([kind, name, description, pages, score])
+        results_df = pd.DataFrame(rows, columns=['kind', 'name', 'description', 'page', 'score'])
+        return results_df.sort_values('score', ascending=False, kind='stable').head(limit).reset_index(drop=True)
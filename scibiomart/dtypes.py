@@ -0,0 +1,114 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+"""
+Maps biomart attributes to compact pandas dtypes.
+
+Biomart returns everything as text so we use the attribute name and, when we have the attribute metadata from
+list_attributes, the database column the attribute comes from (e.g. seq_region_start_1020) to pick a dtype.
+"""
+
+import re
+
+import numpy as np
+import pandas as pd
+
+INTEGER = 'integer'
+STRAND = 'strand'
+FLOAT = 'float'
+CATEGORY = 'category'
+
+INTEGER_ATTRS = {'start_position', 'end_position', 'transcript_start', 'transcript_end', 'transcription_start_site',
+                 'transcript_length', 'exon_chrom_start', 'exon_chrom_end', 'cds_start', 'cds_end', 'cds_length',
+                 'genomic_coding_start', 'genomic_coding_end', 'start_exon_id', 'rank', 'gene_flank_length'}
+CATEGORY_ATTRS = {'chromosome_name', 'gene_biotype', 'transcript_biotype', 'source', 'transcript_source',
+                  'gene_source', 'status', 'transcript_status', 'band'}
+FLOAT_ATTRS = {'percentage_gene_gc_content'}
+
+# Typical characters in a value of each kind, used to estimate the size of results (None is any other text)
+ESTIMATED_WIDTHS = {INTEGER: 9, STRAND: 2, FLOAT: 6, CATEGORY: 10, None: 20}
+# Bytes held by each string in an untyped dataframe beyond its characters (the object and the pointer to it)
+STRING_OVERHEAD = 57
+
+INTEGER_COLUMN = re.compile(r'^(seq_region_(start|end)|.*_chrom_(start|end)|.*_length)(_\d+)?$')
+STRAND_COLUMN = re.compile(r'^seq_region_strand(_\d+)?$')
+CATEGORY_COLUMN = re.compile(r'^(.*biotype|.*_source|.*status)(_\d+)?$')
+FLOAT_COLUMN = re.compile(r'^(.*perc(entage)?_.*|.*_gc_content)(_\d+)?$')
+
+
+def attribute_type(attr_name: str, column=None):
+    """ Returns the kind of data an attribute holds (INTEGER, STRAND, FLOAT, CATEGORY) or None for text. """
+    if attr_name == 'strand' or attr_name.endswith('_strand') or (column and STRAND_COLUMN.match(column)):
+        return STRAND
+    if attr_name in INTEGER_ATTRS or (column and INTEGER_COLUMN.match(column)):
+        return INTEGER
+    if attr_name in FLOAT_ATTRS or '_perc_' in attr_name or (column and FLOAT_COLUMN.match(column)):
+        return FLOAT
+    if attr_name in CATEGORY_ATTRS or attr_name.endswith('_biotype') or (column and CATEGORY_COLUMN.match(column)):
+        return CATEGORY
+    return None
+
+
+def attribute_types(attr_list: list, attributes_df=None) -> dict:
+    """ Maps each attribute in attr_list to its kind using the attribute metadata (from list_attributes) if given. """
+    columns = {}
+    if attributes_df is not None and len(attributes_df) > 0:
+        columns = dict(zip(attributes_df['name'].values, attributes_df['id'].values))
+    attr_types = {}
+    for attr_name in attr_list:
+        attr_type = attribute_type(attr_name, columns.get(attr_name))
+        if attr_type:
+            attr_types[attr_name] = attr_type
+    return attr_types
+
+
+def estimate_row_bytes(attr_list: list, attributes_df=None) -> tuple:
+    """ Estimates the bytes of a row of results as TSV and held in an untyped dataframe. """
+    attr_types = attribute_types(attr_list, attributes_df)
+    widths = [ESTIMATED_WIDTHS[attr_types.get(attr_name)] for attr_name in attr_list]
+    return sum(widths) + len(widths), sum(widths) + STRING_OVERHEAD * len(widths)
+
+
+def to_integer(values: pd.Series, attr_type=INTEGER) -> pd.Series:
+    """ Converts to the smallest integer type that holds the values, using a nullable type if there are gaps. """
+    numbers = pd.to_numeric(values, errors='coerce')
+    if attr_type == STRAND:
+        dtype = np.int8
+    elif len(numbers) == 0 or (numbers.min() >= np.iinfo(np.int32).min and numbers.max() <= np.iinfo(np.int32).max):
+        dtype = np.int32
+    else:
+        dtype = np.int64
+    if numbers.isnull().any():
+        return numbers.astype(pd.api.types.pandas_dtype(dtype.__name__.capitalize()))
+    return numbers.astype(dtype)
+
+
+def convert_dtypes(df: pd.DataFrame, attr_types: dict) -> pd.DataFrame:
+    """ Converts the columns of a results dataframe to the dtypes for each kind of attribute. """
+    converted = {}
+    for attr_name, attr_type in attr_types.items():
+        if attr_name not in df.columns:
+            continue
+        if attr_type in (INTEGER, STRAND):
+            converted[attr_name] = to_integer(df[attr_name], attr_type)
+        elif attr_type == FLOAT:
+            converted[attr_name] = pd.to_numeric(df[attr_name], errors='coerce').astype(np.float64)
+        elif attr_type == CATEGORY:
+            converted[attr_name] = df[attr_name].astype(str).astype('category')
+    if not converted:
+        return df
+    return df.assign(**converted)
@@ -1,4 +1,16 @@
+from sciutil import SciException
+
 MART_SET_ERR = 'Warning: You have not yet set the mart.\nPlease run [set_mart].' \
                       '\nFor a list of available marts run [list_marts]'
 DATASET_SET_ERR = 'Warning: You have not yet set the dataset.\nPlease run [set_dataset].' \
                       '\nFor a list of available marts run [list_datasets]'
+
+
+class SciBiomartException(SciException):
+    def __init__(self, message=''):
+        Exception.__init__(self, message)
+
+
+class SciBiomartRetryException(SciBiomartException):
+    """ A failure that is worth retrying e.g. a dropped connection, the server being busy or a truncated response. """
+    pass
@@ -0,0 +1,111 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+"""
+Saving and loading results in text (csv, tsv) and columnar (parquet, feather, arrow) formats.
+
+The columnar formats keep the dtypes and store the dataset version in the file metadata, they need pyarrow
+(pip install scibiomart[arrow]). Feather and arrow files are Arrow IPC files which are memory mapped when loaded.
+"""
+
+import os
+
+import pandas as pd
+
+from scibiomart.errors import SciBiomartException
+
+FORMATS = {'csv': '.csv', 'tsv': '.tsv', 'parquet': '.parquet', 'feather': '.feather', 'arrow': '.arrow'}
+COLUMNAR_FORMATS = {'parquet', 'feather', 'arrow'}
+DEFAULT_COMPRESSION = {'parquet': 'zstd', 'feather': 'lz4', 'arrow': None}
+METADATA_PREFIX = 'scibiomart.'
+
+
+def import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.feather
+        import pyarrow.parquet
+        return pyarrow
+    except ImportError:
+        raise SciBiomartException('Saving parquet, feather or arrow files needs pyarrow, install it with: '
+                                  'pip install pyarrow')
+
+
+def get_format(file_path: str, fmt=None) -> str:
+    """ Returns the format, from the file extension if not given. """
+    if fmt is None:
+        extension = os.path.splitext(file_path)[1].lower()
+        formats = {ext: name for name, ext in FORMATS.items()}
+        formats['.ipc'] = 'arrow'
+        fmt = formats.get(extension, 'csv')
+    if fmt not in FORMATS:
+        raise SciBiomartException(f'Unknown format: {fmt}, use one of: {", ".join(FORMATS)}')
+    return fmt
+
+
+def save_df(df: pd.DataFrame, file_path: str, fmt=None, compression=None, metadata=None) -> str:
+    """
+    Saves a dataframe (without the index). compression is passed to pandas for text formats (e.g. gzip) and to
+    pyarrow for the columnar ones (parquet: zstd, snappy, gzip...; feather/arrow: lz4, zstd or None).
+    metadata (a dict of strings) is stored in the file for the columnar formats.
+    """
+    fmt = get_format(file_path, fmt)
+    if fmt not in COLUMNAR_FORMATS:
+        df.to_csv(file_path, index=False, sep='\t' if fmt == 'tsv' else ',', compression=compression)
+        return file_path
+    pa = import_pyarrow()
+    compression = compression or DEFAULT_COMPRESSION[fmt]
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    schema_metadata = dict(table.schema.metadata or {})
+    for key, value in (metadata or {}).items():
+        schema_metadata[f'{METADATA_PREFIX}{key}'.encode('utf-8')] = str(value).encode('utf-8')
+    table = table.replace_schema_metadata(schema_metadata)
+    if fmt == 'parquet':
+        pa.parquet.write_table(table, file_path, compression=compression)
+    else:
+        pa.feather.write_feather(table, file_path, compression=compression or 'uncompressed')
+    return file_path
+
+
+def load_df(file_path: str, fmt=None, columns=None) -> pd.DataFrame:
+    """ Loads a dataframe saved with save_df, Arrow IPC files are memory mapped. """
+    fmt = get_format(file_path, fmt)
+    if fmt not in COLUMNAR_FORMATS:
+        return pd.read_csv(file_path, sep='\t' if fmt == 'tsv' else ',', usecols=columns)
+    pa = import_pyarrow()
+    if fmt == 'parquet':
+        return pa.parquet.read_table(file_path, columns=columns, memory_map=True).to_pandas()
+    return pa.feather.read_table(file_path, columns=columns, memory_map=True).to_pandas()
+
+
+def load_metadata(file_path: str, fmt=None) -> dict:
+    """ Returns the scibiomart metadata (e.g. the dataset_version) stored in a columnar file. """
+    fmt = get_format(file_path, fmt)
+    if fmt not in COLUMNAR_FORMATS:
+        return {}
+    pa = import_pyarrow()
+    if fmt == 'parquet':
+        schema = pa.parquet.read_schema(file_path)
+    else:
+        with pa.memory_map(file_path) as source:
+            schema = pa.ipc.open_file(source).schema
+    metadata = {}
+    for key, value in (schema.metadata or {}).items():
+        key = key.decode('utf-8')
+        if key.startswith(METADATA_PREFIX):
+            metadata[key[len(METADATA_PREFIX):]] = value.decode('utf-8')
+    return metadata
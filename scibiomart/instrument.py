@@ -0,0 +1,221 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+"""
+Timing hooks for scibiomart.
+
+SciBiomart wraps each phase of a query in a span (similar to OpenTelemetry spans) and reports one off events such as
+cache hits and retries. Instruments passed to SciBiomart(instruments=[...]) get every span once it ends and every
+event. The phases are:
+
+    run_query   the whole query (attributes: dataset, attributes, rows)
+    count       counting the rows of a query before running it (batches, rows)
+    split       splitting large filters into batches (batches)
+    request     sending a query and reading the response (wire_bytes, decoded_bytes)
+    stream      reading and parsing a streamed response (decoded_bytes, rows)
+    parse       parsing a response into a dataframe (rows)
+    join        joining queries on different attribute pages (rows)
+    convert     converting the columns to their types (rows)
+    postprocess the processing of run_default (rows)
+
+and the events: cache_hit, cache_miss, snapshot_hit, id_cache (hits, misses) and retry (attempt, delay, error).
+SciBiomartStats is a collector of these, e.g.:
+
+    stats = SciBiomartStats()
+    sb = SciBiomartApi(instruments=[stats])
+    sb.get_human_default()
+    print(stats.summary())
+"""
+
+import contextlib
+import threading
+import time
+from collections import defaultdict, deque
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+SPAN_TOTALS = ['wire_bytes', 'decoded_bytes', 'rows']
+
+
+class Span:
+
+    def __init__(self, name: str, attributes: dict, parent=None):
+        self.name = name
+        self.attributes = attributes
+        self.parent = parent  # The span this one is nested in (on the same thread)
+        self.start_time = time.time()
+        self.start = time.perf_counter()
+        self.end = None
+        self.error = None
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    @property
+    def duration(self) -> float:
+        """ Seconds the span took (so far if it hasn't ended). """
+        return (self.end or time.perf_counter()) - self.start
+
+
+class SciBiomartInstrument:
+    """ Base class for instruments, override the hooks that are needed. """
+
+    def on_span_end(self, span: Span):
+        return
+
+    def on_event(self, name: str, attributes: dict):
+        return
+
+
+class CallbackInstrument(SciBiomartInstrument):
+    """ Calls on_span_end(span) and on_event(name, attributes) if they are given. """
+
+    def __init__(self, on_span_end=None, on_event=None):
+        self.span_callback = on_span_end
+        self.event_callback = on_event
+
+    def on_span_end(self, span: Span):
+        if self.span_callback:
+            self.span_callback(span)
+
+    def on_event(self, name: str, attributes: dict):
+        if self.event_callback:
+            self.event_callback(name, attributes)
+
+
+class OpenTelemetryInstrument(SciBiomartInstrument):
+    """ Exports spans (and events) to an OpenTelemetry tracer, e.g. trace.get_tracer('scibiomart'). """
+
+    def __init__(self, tracer):
+        self.tracer = tracer
+
+    @staticmethod
+    def otel_attributes(attributes: dict) -> dict:
+        """ OpenTelemetry only takes primitive attribute values. """
+        return {f'scibiomart.{k}': v for k, v in attributes.items() if isinstance(v, (str, bool, int, float))}
+
+    def on_span_end(self, span: Span):
+        otel_span = self.tracer.start_span(f'scibiomart.{span.name}', attributes=self.otel_attributes(span.attributes),
+                                           start_time=int(span.start_time * 1e9))
+        if span.error is not None:
+            otel_span.set_attribute('error', True)
+            otel_span.set_attribute('scibiomart.error', str(span.error))
+        otel_span.end(end_time=int((span.start_time + span.duration) * 1e9))
+
+    def on_event(self, name: str, attributes: dict):
+        # Recorded as spans with no duration as the span they happened in may already have been exported
+        self.tracer.start_span(f'scibiomart.{name}', attributes=self.otel_attributes(attributes)).end()
+
+
+class SciBiomartStats(SciBiomartInstrument):
+
+    def __init__(self, max_samples=10000):
+        """ Keeps the latest max_samples durations of each phase for the percentiles. """
+        self.max_samples = max_samples
+        self.durations = defaultdict(lambda: deque(maxlen=self.max_samples))
+        self.counts = defaultdict(int)
+        self.errors = defaultdict(int)
+        self.totals = defaultdict(lambda: defaultdict(int))  # Sums of the byte and row counts of each phase
+        self.events = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def on_span_end(self, span: Span):
+        with self.lock:
+            self.durations[span.name].append(span.duration)
+            self.counts[span.name] += 1
+            self.errors[span.name] += span.error is not None
+            for key in SPAN_TOTALS:
+                if isinstance(span.attributes.get(key), int):
+                    self.totals[span.name][key] += span.attributes[key]
+
+    def on_event(self, name: str, attributes: dict):
+        with self.lock:
+            # The ID cache reports how many IDs were found and fetched
+            if name == 'id_cache':
+                self.events['id_cache_hits'] += attributes.get('hits', 0)
+                self.events['id_cache_misses'] += attributes.get('misses', 0)
+            else:
+                self.events[name] += 1
+
+    def summary(self) -> 'pd.DataFrame':
+        """ The count, errors, latency (mean and percentiles in seconds) and byte/row totals of each phase. """
+        import pandas as pd  # Only needed for the summary, see scibiomart.base
+        rows = []
+        with self.lock:
+            for name, durations in self.durations.items():
+                durations = pd.Series(list(durations))
+                rows.append({'phase': name, 'count': self.counts[name], 'errors': self.errors[name],
+                             'mean_s': durations.mean(), 'p50_s': durations.quantile(0.5),
+                             'p95_s': durations.quantile(0.95), 'p99_s': durations.quantile(0.99),
+                             'max_s': durations.max(), **{k: self.totals[name][k] for k in SPAN_TOTALS}})
+        return pd.DataFrame(rows, columns=['phase', 'count', 'errors', 'mean_s', 'p50_s', 'p95_s', 'p99_s', 'max_s']
+                            + SPAN_TOTALS)
+
+    def reset(self):
+        with self.lock:
+            self.durations.clear()
+            self.counts.clear()
+            self.errors.clear()
+            self.totals.clear()
+            self.events.clear()
+
+
+class Tracer:
+    """ Sends spans and events to a list of instruments, doing nothing if there aren't any. """
+
+    local = threading.local()  # The current span of each thread
+
+    def __init__(self, instruments=None):
+        self.instruments = list(instruments or [])
+
+    @contextlib.contextmanager
+    def span(self, name: str, nest=True, **attributes):
+        """ Times the block, spans started in it (on the same thread) are its children unless nest is False. """
+        if not self.instruments:
+            yield NULL_SPAN
+            return
+        parent = getattr(Tracer.local, 'span', None)
+        span = Span(name, attributes, parent)
+        if nest:
+            Tracer.local.span = span
+        try:
+            yield span
+        except BaseException as e:
+            span.error = e
+            raise
+        finally:
+            span.end = time.perf_counter()
+            if nest:
+                Tracer.local.span = parent
+            for instrument in self.instruments:
+                instrument.on_span_end(span)
+
+    def event(self, name: str, **attributes):
+        for instrument in self.instruments:
+            instrument.on_event(name, attributes)
+
+
+class NullSpan:
+    """ Used when there are no instruments so recording attributes costs nothing. """
+
+    def set_attribute(self, key: str, value):
+        return
+
+
+NULL_SPAN = NullSpan()
@@ -0,0 +1,154 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+"""
+Interval index over a gene table (e.g. the output of run_default) for matching regions to genes.
+
+Genes are stored per chromosome as NumPy arrays sorted on the start (and on the TSS) so that every lookup is a binary
+search, queries are passed as arrays and answered for all regions at once. Positions use the same coordinates as
+biomart (1 based, inclusive), add 1 to the starts of BED regions before querying.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+class GeneIndex:
+
+    def __init__(self, genes_df: pd.DataFrame, chrom_col='chromosome_name', start_col='start_position',
+                 end_col='end_position', strand_col='strand'):
+        self.genes_df = genes_df
+        starts = pd.to_numeric(genes_df[start_col]).values.astype(np.int64)
+        ends = pd.to_numeric(genes_df[end_col]).values.astype(np.int64)
+        strands = pd.to_numeric(genes_df[strand_col]).values.astype(np.int8)
+        tss = np.where(strands < 0, ends, starts)
+        chromosomes = genes_df[chrom_col].astype(str).values
+        self.chromosomes = {}
+        codes, names = pd.factorize(chromosomes)
+        for code, chrom in enumerate(names):
+            rows = np.flatnonzero(codes == code)
+            by_start = rows[np.argsort(starts[rows], kind='stable')]
+            by_tss = rows[np.argsort(tss[rows], kind='stable')]
+            self.chromosomes[chrom] = {
+                'rows': by_start,
+                'starts': starts[by_start],
+                'ends': ends[by_start],
+                # The running max of the ends lets us binary search for the first gene that could overlap a region
+                'max_ends': np.maximum.accumulate(ends[by_start]),
+                'tss_rows': by_tss,
+                'tss': tss[by_tss],
+                'tss_strands': strands[by_tss],
+            }
+
+    @staticmethod
+    def _group_queries(chromosomes):
+        """ Yields the chromosome and the positions of the queries on that chromosome. """
+        codes, names = pd.factorize(np.asarray(chromosomes).astype(str))
+        order = np.argsort(codes, kind='stable')
+        bounds = np.searchsorted(codes[order], np.arange(len(names) + 1))
+        for code, chrom in enumerate(names):
+            yield chrom, order[bounds[code]: bounds[code + 1]]
+
+    def _results(self, query_idx, gene_rows, **columns) -> pd.DataFrame:
+        """ Returns the genes that matched with the index of the query they matched. """
+        results_df = self.genes_df.iloc[gene_rows].reset_index(drop=True)
+        results_df.insert(0, 'query_idx', query_idx)
+        for name, values in columns.items():
+            results_df[name] = values
+        return results_df
+
+    @staticmethod
+    def _expand(query_idx, lo, hi):
+        """ Expands [lo, hi) ranges into the query and the position of each element in the range. """
+        counts = hi - lo
+        repeated_query = np.repeat(query_idx, counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        return repeated_query, np.repeat(lo, counts) + offsets
+
+    def _range_query(self, chromosomes, starts, ends, on_tss=False):
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        query_idx = []
+        gene_rows = []
+        for chrom, queries in self._group_queries(chromosomes):
+            genes = self.chromosomes.get(chrom)
+            if genes is None:
+                continue
+            if on_tss:
+                lo = np.searchsorted(genes['tss'], starts[queries], side='left')
+                hi = np.searchsorted(genes['tss'], ends[queries], side='right')
+                q, positions = self._expand(queries, lo, hi)
+                rows = genes['tss_rows'][positions]
+            else:
+                lo = np.searchsorted(genes['max_ends'], starts[queries], side='left')
+                hi = np.searchsorted(genes['starts'], ends[queries], side='right')
+                lo = np.minimum(lo, hi)
+                q, positions = self._expand(queries, lo, hi)
+                overlapping = genes['ends'][positions] >= starts[q]
+                q, rows = q[overlapping], genes['rows'][positions[overlapping]]
+            query_idx.append(q)
+            gene_rows.append(rows)
+        if not query_idx:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+        query_idx = np.concatenate(query_idx)
+        gene_rows = np.concatenate(gene_rows)
+        order = np.argsort(query_idx, kind='stable')
+        return query_idx[order], gene_rows[order]
+
+    def overlaps(self, chromosomes, starts, ends) -> pd.DataFrame:
+        """ Returns every gene that overlaps each region, one row per region and gene. """
+        query_idx, gene_rows = self._range_query(chromosomes, starts, ends)
+        return self._results(query_idx, gene_rows)
+
+    def window(self, chromosomes, starts, ends, flank=0) -> pd.DataFrame:
+        """ Returns every gene with a TSS within flank bp of each region, one row per region and gene. """
+        starts = np.asarray(starts, dtype=np.int64) - flank
+        ends = np.asarray(ends, dtype=np.int64) + flank
+        query_idx, gene_rows = self._range_query(chromosomes, starts, ends, on_tss=True)
+        return self._results(query_idx, gene_rows)
+
+    def nearest_tss(self, chromosomes, positions) -> pd.DataFrame:
+        """
+        Returns the gene with the closest TSS to each position (ties go to the gene with the smaller TSS).
+        The distance is relative to the strand of the gene so a negative distance is upstream of the TSS.
+        Positions on chromosomes with no genes aren't returned.
+        """
+        positions = np.asarray(positions, dtype=np.int64)
+        query_idx = []
+        gene_rows = []
+        distances = []
+        for chrom, queries in self._group_queries(chromosomes):
+            genes = self.chromosomes.get(chrom)
+            if genes is None:
+                continue
+            tss = genes['tss']
+            query_positions = positions[queries]
+            right = np.clip(np.searchsorted(tss, query_positions, side='left'), 0, len(tss) - 1)
+            left = np.clip(right - 1, 0, len(tss) - 1)
+            use_left = np.abs(query_positions - tss[left]) <= np.abs(tss[right] - query_positions)
+            closest = np.where(use_left, left, right)
+            query_idx.append(queries)
+            gene_rows.append(genes['tss_rows'][closest])
+            strand = np.where(genes['tss_strands'][closest] < 0, -1, 1)
+            distances.append((query_positions - tss[closest]) * strand)
+        if not query_idx:
+            return self._results(np.array([], dtype=np.int64), np.array([], dtype=np.int64),
+                                 distance=np.array([], dtype=np.int64))
+        query_idx = np.concatenate(query_idx)
+        order = np.argsort(query_idx, kind='stable')
+        return self._results(query_idx[order], np.concatenate(gene_rows)[order],
+                             distance=np.concatenate(distances)[order])
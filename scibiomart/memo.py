@@ -0,0 +1,155 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+"""
+In memory cache of query results by ID.
+
+Services often look up small, overlapping sets of IDs (e.g. {'ensembl_gene_id': [...]}) over and over. The rows for
+each ID are kept per dataset, attribute list and dataset version so IDs we have already seen are answered locally and
+only the missing ones are fetched, in one query. Concurrent lookups that need the same ID wait for the request that is
+already fetching it rather than sending their own.
+"""
+
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+from scibiomart.snapshot import FILTER_ATTRS
+
+
+class SciBiomartIdCache:
+
+    def __init__(self, max_ids=1000000):
+        """ At most max_ids IDs are kept (over every dataset), the least recently used are dropped first. """
+        self.max_ids = max_ids
+        self.tables = OrderedDict()  # Rows for each ID (as tuples) by query key, in least recently used order
+        self.n_ids = 0
+        self.in_flight = {}  # Events set once the IDs being fetched by another thread are in the cache
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def id_filter(filter_dict: dict, attr_list: list):
+        """
+        Returns the filter the results can be keyed on: a list filter whose values are returned in one of the
+        attributes (e.g. ensembl_gene_id), or None if the query can't be cached by ID.
+        """
+        id_filters = [k for k, v in (filter_dict or {}).items()
+                      if isinstance(v, (list, tuple)) and FILTER_ATTRS.get(k, k) in attr_list]
+        return max(id_filters, key=lambda k: len(filter_dict[k])) if id_filters else None
+
+    def key(self, sb, filter_name: str, filter_dict: dict, attr_list: list) -> tuple:
+        """ Rows are only shared between queries with the same dataset, release, attributes and other filters. """
+        others = sorted((k, str(v)) for k, v in filter_dict.items() if k != filter_name)
+        return (sb.url, sb.mart, sb.dataset, sb.dataset_version, filter_name, tuple(attr_list), tuple(others))
+
+    def query(self, sb, filter_dict: dict, attr_list: list, fetch):
+        """
+        Answers a query from the cache, fetch(filter_dict) is called with only the IDs that aren't cached (or being
+        fetched by another thread) and should return the results as a dataframe (or None). The rows are returned in
+        the order of the IDs, None if there are none.
+        """
+        filter_name = self.id_filter(filter_dict, attr_list)
+        ids = list(dict.fromkeys(str(v) for v in filter_dict[filter_name]))
+        key = self.key(sb, filter_name, filter_dict, attr_list)
+        found = {}
+        unmatched = []  # Rows whose ID isn't one we asked for (e.g. another case), returned but not cached
+        n_fetched = 0
+        while True:
+            missing, waiting = [], []
+            event = threading.Event()
+            with self.lock:
+                table = self.tables.setdefault(key, OrderedDict())
+                self.tables.move_to_end(key)
+                for id_value in ids:
+                    if id_value in found:
+                        continue
+                    if id_value in table:
+                        found[id_value] = table[id_value]
+                        table.move_to_end(id_value)
+                        self.hits += 1
+                    elif (key, id_value) in self.in_flight:
+                        waiting.append(self.in_flight[(key, id_value)])
+                        self.coalesced += 1
+                    else:
+                        self.in_flight[(key, id_value)] = event
+                        missing.append(id_value)
+                self.misses += len(missing)
+            if missing:
+                n_fetched += len(missing)
+                try:
+                    df = fetch({**filter_dict, filter_name: missing})
+                    rows, other_rows = self.put(key, missing, df, attr_list.index(FILTER_ATTRS.get(filter_name,
+                                                                                                  filter_name)))
+                    found.update(rows)
+                    found.update({id_value: () for id_value in missing if id_value not in rows})
+                    unmatched += other_rows
+                finally:
+                    with self.lock:
+                        for id_value in missing:
+                            self.in_flight.pop((key, id_value), None)
+                    event.set()
+            if not waiting:
+                break
+            # The other requests have finished, pick up their rows (or fetch them ourselves if they failed)
+            for waiting_event in set(waiting):
+                waiting_event.wait()
+        sb.tracer.event('id_cache', hits=len(ids) - n_fetched, misses=n_fetched)
+        rows = [row for id_value in ids for row in found[id_value]] + unmatched
+        return pd.DataFrame(rows, columns=attr_list) if rows else None
+
+    def put(self, key: tuple, ids: list, df, column: int) -> tuple:
+        """
+        Stores the rows of df by the ID in column and returns them with the rows whose ID isn't in ids. IDs without
+        rows are stored as having none, unless some rows didn't map back to an ID: the server may match an ID
+        differently to us (e.g. TP53 for tp53) so then we can't tell which IDs have none.
+        """
+        rows = {id_value: [] for id_value in ids}
+        other_rows = []
+        if df is not None:
+            for row in df.itertuples(index=False, name=None):
+                if row[column] in rows:
+                    rows[row[column]].append(row)
+                else:
+                    other_rows.append(row)
+        rows = {id_value: tuple(id_rows) for id_value, id_rows in rows.items() if id_rows or not other_rows}
+        with self.lock:
+            table = self.tables.setdefault(key, OrderedDict())
+            for id_value, id_rows in rows.items():
+                self.n_ids += id_value not in table
+                table[id_value] = id_rows
+            self.evict()
+        return rows, other_rows
+
+    def evict(self):
+        """ Drops the least recently used IDs until we are under max_ids (call with the lock held). """
+        while self.n_ids > self.max_ids and self.tables:
+            key, table = next(iter(self.tables.items()))
+            if table:
+                table.popitem(last=False)
+                self.n_ids -= 1
+            else:
+                del self.tables[key]
+
+    def clear(self):
+        """ Removes every cached ID. """
+        with self.lock:
+            self.tables.clear()
+            self.n_ids = 0
@@ -0,0 +1,77 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+"""
+Builds martservice query documents.
+
+A query is the XML document biomart expects, e.g.:
+
+    <?xml version="1.0" encoding="UTF-8"?><!DOCTYPE Query><Query virtualSchemaName = "default" formatter = "TSV"
+    header = "0" uniqueRows = "0" count = "" datasetConfigVersion = "0.6" completionStamp = "1" >
+    <Dataset name = "hsapiens_gene_ensembl" interface = "default" ><Filter name = "ensembl_gene_id" value = "..." />
+    <Attribute name = "ensembl_gene_id" /></Dataset></Query>
+
+Everything except the filters is the same for every batch of a query so a QueryTemplate renders it once (templates are
+cached by dataset and attributes) and only the filters are rendered per batch. Names and values are XML escaped.
+"""
+
+import functools
+from xml.sax.saxutils import escape
+
+XML_ATTRIBUTE_ENTITIES = {'"': '&quot;'}
+
+
+def xml_value(value) -> str:
+    """ Escapes a value for an XML attribute. """
+    return escape(str(value), XML_ATTRIBUTE_ENTITIES)
+
+
+def render_filters(filter_dict: dict) -> str:
+    """ Renders filters, lists of values are comma separated (biomart ORs them). """
+    parts = []
+    for filter_name, filter_value in (filter_dict or {}).items():
+        if isinstance(filter_value, (list, tuple)):
+            filter_value = ','.join(str(val) for val in filter_value)
+        parts.append(f'<Filter name = "{xml_value(filter_name)}" value = "{xml_value(filter_value)}" />')
+    return ''.join(parts)
+
+
+def render_attributes(attr_list: list) -> str:
+    return ''.join(f'<Attribute name = "{xml_value(attr_name)}" />' for attr_name in attr_list or [])
+
+
+class QueryTemplate:
+
+    def __init__(self, dataset: str, attr_list: list, count=False, virtual_schema='default'):
+        """ With count the query returns the number of rows rather than the rows. """
+        self.dataset = dataset
+        self.attr_list = list(attr_list or [])
+        self.count = count
+        self.prefix = f'<?xml version="1.0" encoding="UTF-8"?><!DOCTYPE Query>' \
+                      f'<Query virtualSchemaName = "{xml_value(virtual_schema)}" formatter = "TSV" header = "0" ' \
+                      f'uniqueRows = "0" count = "{"1" if count else ""}" datasetConfigVersion = "0.6" ' \
+                      f'completionStamp = "1" ><Dataset name = "{xml_value(dataset)}" interface = "default" >'
+        self.suffix = f'{render_attributes(self.attr_list)}</Dataset></Query>'
+
+    def render(self, filter_dict: dict) -> str:
+        return f'{self.prefix}{render_filters(filter_dict)}{self.suffix}'
+
+
+@functools.lru_cache(maxsize=256)
+def get_template(dataset: str, attrs: tuple, count=False) -> QueryTemplate:
+    """ Returns the (cached) template for a dataset and attributes. """
+    return QueryTemplate(dataset, list(attrs), count)
@@ -0,0 +1,184 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+"""
+Local snapshots of a mart/dataset so that queries can be answered without network access.
+
+A snapshot is a folder per mart and dataset holding the results of one query (the chosen attributes for every gene),
+the attribute and filter metadata and a metadata.json with the dataset version. Filters are answered from a hash index
+(value -> rows) built once per column.
+"""
+
+import json
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from scibiomart.dtypes import attribute_types, convert_dtypes
+from scibiomart.formats import FORMATS, save_df, load_df
+
+# Filters that don't have the same name as the attribute they filter on
+FILTER_ATTRS = {'biotype': 'gene_biotype', 'transcript_biotype': 'transcript_biotype', 'strand': 'strand',
+                'chromosome_name': 'chromosome_name', 'link_ensembl_gene_id': 'ensembl_gene_id'}
+# Region filters, genes are kept if they overlap start..end
+REGION_FILTERS = {'start': 'end_position', 'end': 'start_position'}
+
+
+class SciBiomartSnapshot:
+
+    def __init__(self, snapshot_dir: str):
+        self.snapshot_dir = snapshot_dir
+        self.tables = {}  # Loaded snapshots by (mart, dataset)
+        self.lock = threading.Lock()
+
+    def path(self, mart: str, dataset: str) -> str:
+        return os.path.join(self.snapshot_dir, mart, dataset)
+
+    def has(self, mart: str, dataset: str) -> bool:
+        return bool(mart and dataset) and os.path.exists(os.path.join(self.path(mart, dataset), 'metadata.json'))
+
+    def create(self, sb, attr_list: list, filter_dict=None, fmt='parquet') -> str:
+        """
+        Snapshots the current mart and dataset of sb (a SciBiomart): runs the query for attr_list and saves it with
+        the attribute and filter metadata. Returns the folder of the snapshot.
+        """
+        path = self.path(sb.mart, sb.dataset)
+        os.makedirs(path, exist_ok=True)
+        results_df = sb.run_query(filter_dict, attr_list, typed=True)
+        if results_df is None:  # Nothing matched the filters
+            results_df = pd.DataFrame(columns=attr_list)
+        metadata = {'mart': sb.mart, 'dataset': sb.dataset, 'dataset_version': sb.dataset_version, 'url': sb.url,
+                    'attributes': list(attr_list), 'filters': filter_dict or {}, 'format': fmt,
+                    'rows': len(results_df), 'created': time.strftime('%Y-%m-%dT%H:%M:%S')}
+        save_df(results_df, os.path.join(path, f'data{FORMATS[fmt]}'), fmt,
+                metadata={'dataset_version': sb.dataset_version})
+        sb.list_attributes(False).to_csv(os.path.join(path, 'attributes.tsv'), sep='\t', index=False)
+        sb.list_filters(False).to_csv(os.path.join(path, 'filters.tsv'), sep='\t', index=False)
+        with open(os.path.join(path, 'metadata.json'), 'w') as fh:
+            json.dump(metadata, fh, indent=2)
+        with self.lock:
+            self.tables.pop((sb.mart, sb.dataset), None)
+        return path
+
+    def metadata(self, mart: str, dataset: str) -> dict:
+        with open(os.path.join(self.path(mart, dataset), 'metadata.json'), 'r') as fh:
+            return json.load(fh)
+
+    def attributes(self, mart: str, dataset: str) -> pd.DataFrame:
+        return pd.read_csv(os.path.join(self.path(mart, dataset), 'attributes.tsv'), sep='\t', dtype=str,
+                           keep_default_na=False)
+
+    def filters(self, mart: str, dataset: str) -> pd.DataFrame:
+        return pd.read_csv(os.path.join(self.path(mart, dataset), 'filters.tsv'), sep='\t', dtype=str,
+                           keep_default_na=False)
+
+    def load(self, mart: str, dataset: str) -> dict:
+        """ Loads the data of a snapshot (kept in memory), the indexes on each column are built when first used. """
+        key = (mart, dataset)
+        with self.lock:
+            if key not in self.tables:
+                metadata = self.metadata(mart, dataset)
+                df = load_df(os.path.join(self.path(mart, dataset), f'data{FORMATS[metadata["format"]]}'))
+                # Text formats lose the dtypes so type them again
+                df = convert_dtypes(df, attribute_types(df.columns, self.attributes(mart, dataset)))
+                self.tables[key] = {'metadata': metadata, 'df': df, 'indexes': {}}
+            return self.tables[key]
+
+    @staticmethod
+    def get_index(table: dict, column: str) -> dict:
+        """ Returns a hash index of the values of a column to the (sorted) rows they are in. """
+        if column not in table['indexes']:
+            values = table['df'][column].astype(str).values
+            table['indexes'][column] = pd.Series(np.arange(len(values))).groupby(values, sort=False).indices
+        return table['indexes'][column]
+
+    @staticmethod
+    def filter_values(filter_value) -> set:
+        """ The values of a filter, given as a list or a comma separated string. """
+        values = filter_value if isinstance(filter_value, (list, tuple)) else str(filter_value).split(',')
+        return {str(v) for v in values}
+
+    def covers(self, snapshot_filters: dict, filter_dict: dict) -> bool:
+        """
+        Checks that every row of a query is in a snapshot made with snapshot_filters, i.e. the query has each of
+        these filters with the same or fewer values (or a region inside the snapshot's).
+        """
+        filter_dict = filter_dict or {}
+        for filter_name, snapshot_value in snapshot_filters.items():
+            if filter_name not in filter_dict:
+                return False
+            filter_value = filter_dict[filter_name]
+            if filter_name == 'start':
+                if int(filter_value) < int(snapshot_value):
+                    return False
+            elif filter_name == 'end':
+                if int(filter_value) > int(snapshot_value):
+                    return False
+            elif not self.filter_values(filter_value) <= self.filter_values(snapshot_value):
+                return False
+        return True
+
+    def can_answer(self, mart: str, dataset: str, filter_dict: dict, attr_list: list) -> bool:
+        """
+        Checks the snapshot has every attribute, can apply every filter and, if it was made with filters, that the
+        query asks for a subset of what it holds.
+        """
+        if not self.has(mart, dataset):
+            return False
+        metadata = self.metadata(mart, dataset)
+        columns = set(metadata['attributes'])
+        if any(attr not in columns for attr in attr_list):
+            return False
+        snapshot_filters = metadata.get('filters') or {}
+        if not self.covers(snapshot_filters, filter_dict):
+            return False
+        for filter_name, filter_value in (filter_dict or {}).items():
+            column = REGION_FILTERS.get(filter_name) or FILTER_ATTRS.get(filter_name, filter_name)
+            # Filters the snapshot was made with hold for every row so don't need a column
+            if column not in columns and (filter_name not in snapshot_filters or self.filter_values(filter_value)
+                                          != self.filter_values(snapshot_filters[filter_name])):
+                return False
+        return True
+
+    def query(self, mart: str, dataset: str, filter_dict: dict, attr_list: list):
+        """
+        Answers a query from the snapshot, returns None if the snapshot can't answer it (it is missing an attribute
+        or a filter, or was made with filters the query isn't within). Filter values can be a list or a comma
+        separated string, as for run_query.
+        """
+        if not self.can_answer(mart, dataset, filter_dict, attr_list):
+            return None
+        table = self.load(mart, dataset)
+        df = table['df']
+        rows = None
+        for filter_name, filter_value in (filter_dict or {}).items():
+            if (REGION_FILTERS.get(filter_name) or FILTER_ATTRS.get(filter_name, filter_name)) not in df.columns:
+                continue  # The same as the snapshot's filter (see can_answer)
+            if filter_name in REGION_FILTERS:
+                positions = pd.to_numeric(df[REGION_FILTERS[filter_name]]).values
+                position = int(filter_value)
+                matched = np.flatnonzero(positions >= position if filter_name == 'start' else positions <= position)
+            else:
+                index = self.get_index(table, FILTER_ATTRS.get(filter_name, filter_name))
+                matched = [index[v] for v in self.filter_values(filter_value) if v in index]
+                matched = np.unique(np.concatenate(matched)) if matched else np.array([], dtype=np.int64)
+            rows = matched if rows is None else np.intersect1d(rows, matched, assume_unique=True)
+        results_df = df[list(attr_list)] if rows is None else df[list(attr_list)].iloc[rows]
+        return results_df.reset_index(drop=True)
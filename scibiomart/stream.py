@@ -0,0 +1,130 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+"""
+Writing query results to a file as they are downloaded.
+
+Unsorted results are written chunk by chunk so memory is bounded by the chunk size. Sorted results use an external
+merge sort: each chunk is sorted and written to a temporary run file and the runs are then merged into the output.
+"""
+
+import contextlib
+import csv
+import gzip
+import heapq
+import os
+import shutil
+import sys
+import tempfile
+import uuid
+
+from scibiomart.errors import SciBiomartException
+
+STREAM_FORMATS = {'csv': ',', 'tsv': '\t'}
+SORT_COLUMNS = ['chromosome_name', 'start_position', 'end_position', 'strand']
+
+
+@contextlib.contextmanager
+def open_output(file_path, compression=None):
+    """
+    Opens a text file for writing, - is stdout and an open file is used as is. Only gzip compression is supported
+    when streaming. Files are written to a temp file first and only moved to file_path once everything is written,
+    so a failed download never leaves a partial file behind.
+    """
+    if compression not in (None, 'gzip'):
+        raise SciBiomartException(f'Streamed output can only be gzip compressed, not: {compression}')
+    if not isinstance(file_path, str):
+        yield file_path
+        return
+    if file_path == '-':
+        yield sys.stdout
+        return
+    # Not mkstemp as that would make the output only readable by us
+    tmp_path = f'{file_path}.{uuid.uuid4().hex}.tmp'
+    try:
+        if compression == 'gzip':
+            with gzip.open(tmp_path, 'xt', newline='') as out:
+                yield out
+        else:
+            with open(tmp_path, 'x', newline='') as out:
+                yield out
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def write_chunks(chunks, out, sep=',') -> int:
+    """ Writes dataframes to an open file (the header only once), returns the number of rows written. """
+    n_rows = 0
+    for df in chunks:
+        df.to_csv(out, sep=sep, index=False, header=n_rows == 0)
+        n_rows += len(df)
+    return n_rows
+
+
+def sort_chunks(chunks, out, sep=',', chrom_order='lexicographic', tmp_dir=None) -> int:
+    """
+    Writes dataframes to an open file sorted as sort_df_on_starts would, using temporary files in tmp_dir so only
+    one chunk is in memory at a time. Ties keep the order they came in. Returns the number of rows written.
+    """
+    from scibiomart.base import SciBiomart
+
+    run_dir = tempfile.mkdtemp(prefix='scibiomart_sort_', dir=tmp_dir)
+    try:
+        runs = []
+        columns = None
+        chromosomes = set()
+        for df in chunks:
+            if columns is None:
+                columns = list(df.columns)
+            if not len(df):
+                continue
+            missing = [c for c in SORT_COLUMNS if c not in df.columns]
+            if missing:
+                raise SciBiomartException(f'Sorting needs the attributes: {", ".join(missing)}')
+            df = SciBiomart.sort_df_on_starts(df, chrom_order)
+            chromosomes.update(df['chromosome_name'].astype(str).unique())
+            path = os.path.join(run_dir, f'{len(runs)}.tsv')
+            df.to_csv(path, sep='\t', index=False, header=False)
+            runs.append(path)
+        if columns is None:
+            return 0
+        # Every run is sorted with the same ordering of chromosomes, so the merge only needs the rank of each one
+        rank = {c: i for i, c in enumerate(SciBiomart.chromosome_order(chromosomes, chrom_order))}
+        chrom_i, start_i, end_i, strand_i = [columns.index(c) for c in SORT_COLUMNS]
+
+        def row_key(row: list) -> tuple:
+            # The TSS i.e. the end for genes on the negative strand
+            position = row[end_i] if row[strand_i].startswith('-') else row[start_i]
+            return rank[row[chrom_i]], int(float(position)) if position else 0
+
+        def read_run(path: str):
+            with open(path, 'r', newline='') as run:
+                yield from csv.reader(run, delimiter='\t')
+
+        writer = csv.writer(out, delimiter=sep, lineterminator='\n')
+        writer.writerow(columns)
+        n_rows = 0
+        # heapq.merge is stable, runs earlier in the input come first for equal keys
+        for row in heapq.merge(*[read_run(path) for path in runs], key=row_key):
+            writer.writerow(row)
+            n_rows += 1
+        return n_rows
+    finally:
+        shutil.rmtree(run_dir, ignore_errors=True)
@@ -0,0 +1,233 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+"""
+HTTP transports used by SciBiomart to talk to the martservice.
+
+A transport has request(method, url, body=None, headers=None, preload_content=True) returning a response with status,
+data (the body, if preloaded) and, when not preloaded, read(size), release_conn() and close(). tell() gives the bytes
+received over the wire. The transports are:
+
+    SciBiomartSession      urllib3 connection pools (the default, see scibiomart.session)
+    AiohttpTransport       an aiohttp client running on its own event loop, also usable from coroutines (arequest)
+    CassetteTransport      records responses from another transport to disk and replays them without the network
+
+e.g. to run a pipeline offline and deterministically once it has been recorded:
+
+    sb = SciBiomartApi(session=CassetteTransport('tests/cassettes', mode='once'))
+"""
+
+import asyncio
+import hashlib
+import io
+import json
+import os
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+
+from scibiomart.errors import SciBiomartException
+
+CASSETTE_MODES = {'replay', 'record', 'once'}
+
+
+class SciBiomartTransport(ABC):
+    """ Base class of the transports, subclasses must implement request. """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @abstractmethod
+    def request(self, method: str, url: str, body=None, headers=None, preload_content=True, **kwargs):
+        """ Sends a request and returns the response (see the module docstring). """
+
+    def clear(self):
+        """ Closes idle connections, the transport can still be used. """
+        return
+
+    def close(self):
+        """ Releases the connections, the transport shouldn't be used afterwards. """
+        return
+
+
+class TransportResponse:
+    """ A response whose body has already been read, returned by the transports other than urllib3. """
+
+    def __init__(self, data: bytes, status=200, headers=None, wire_bytes=None):
+        self.data = data
+        self.status = status
+        self.headers = headers or {}
+        self.wire_bytes = len(data) if wire_bytes is None else wire_bytes
+        self.body = io.BytesIO(data)
+
+    def read(self, size=-1) -> bytes:
+        return self.body.read(size)
+
+    def tell(self) -> int:
+        return self.wire_bytes
+
+    def release_conn(self):
+        return
+
+    def close(self):
+        self.body.close()
+
+
+class CassetteTransport(SciBiomartTransport):
+
+    def __init__(self, cassette_dir: str, mode='once', transport=None):
+        """
+        Responses are stored in cassette_dir keyed on the method, url and body of the request. mode is one of:
+            replay: only serve recorded responses, a request that wasn't recorded is an error.
+            record: send every request with transport (by default the shared SciBiomartSession) and record it.
+            once: replay responses that were recorded and record the others.
+        Replayed responses are kept in memory after they are first read.
+        """
+        if mode not in CASSETTE_MODES:
+            raise SciBiomartException(f'Unknown cassette mode: {mode}, use one of: {", ".join(CASSETTE_MODES)}')
+        self.cassette_dir = cassette_dir
+        self.mode = mode
+        self.transport = transport
+        self.responses = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.recorded = 0
+        os.makedirs(cassette_dir, exist_ok=True)
+
+    @staticmethod
+    def key(method: str, url: str, body=None) -> str:
+        body = body.encode('utf-8') if isinstance(body, str) else (body or b'')
+        return hashlib.sha256(method.upper().encode('utf-8') + b'\n' + url.encode('utf-8') + b'\n' + body).hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.cassette_dir, key)
+
+    def load(self, key: str):
+        """ Returns the recorded status, headers and body for a key, None if it wasn't recorded. """
+        with self.lock:
+            if key in self.responses:
+                return self.responses[key]
+        try:
+            with open(f'{self.path(key)}.json', 'r') as f:
+                meta = json.load(f)
+            with open(f'{self.path(key)}.body', 'rb') as f:
+                body = f.read()
+        except FileNotFoundError:
+            return None
+        response = (meta['status'], meta['headers'], body)
+        with self.lock:
+            self.responses[key] = response
+        return response
+
+    def save(self, key: str, method: str, url: str, status: int, headers: dict, body: bytes):
+        """ Writes a response, the body first so a partly written recording is never replayed. """
+        for extension, data in [('.body', body), ('.json', json.dumps({'method': method, 'url': url, 'status': status,
+                                                                        'headers': headers}).encode('utf-8'))]:
+            fd, tmp_path = tempfile.mkstemp(dir=self.cassette_dir, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, f'{self.path(key)}{extension}')
+        with self.lock:
+            self.responses[key] = (status, headers, body)
+            self.recorded += 1
+
+    def request(self, method: str, url: str, body=None, headers=None, preload_content=True, **kwargs):
+        key = self.key(method, url, body)
+        recorded = self.load(key) if self.mode != 'record' else None
+        if recorded is not None:
+            with self.lock:
+                self.hits += 1
+            status, response_headers, data = recorded
+            return TransportResponse(data, status, response_headers)
+        if self.mode == 'replay':
+            raise SciBiomartException(f'Request not in the cassette {self.cassette_dir}: {method} {url}')
+        if self.transport is None:
+            from scibiomart.session import get_default_session
+            self.transport = get_default_session()
+        response = self.transport.request(method, url, body=body, headers=headers, preload_content=True, **kwargs)
+        data = response.data
+        response_headers = {k: v for k, v in dict(response.headers or {}).items()
+                            if k.lower() not in ('content-encoding', 'content-length', 'transfer-encoding')}
+        # Server errors are passed on but not recorded so they aren't replayed
+        if response.status < 500 and response.status != 429:
+            self.save(key, method, url, response.status, response_headers, data)
+        return TransportResponse(data, response.status, response_headers)
+
+    def clear(self):
+        """ Forgets the responses held in memory. """
+        with self.lock:
+            self.responses.clear()
+
+
+class AiohttpTransport(SciBiomartTransport):
+
+    def __init__(self, limit=10, connect_timeout=10.0, read_timeout=300.0, proxy=None, compress=True):
+        """
+        Sends requests with aiohttp (pip install scibiomart[async]) on an event loop running in a background thread,
+        at most limit connections are open at once. Coroutines can await arequest directly.
+        """
+        try:
+            import aiohttp
+        except ImportError:
+            raise SciBiomartException('AiohttpTransport needs aiohttp, install it with: pip install aiohttp')
+        self.aiohttp = aiohttp
+        self.limit = limit
+        self.timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        self.proxy = proxy
+        self.compress = compress
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.client = self.run(self.new_client())
+        self.closed = False
+
+    async def new_client(self):
+        connector = self.aiohttp.TCPConnector(limit=self.limit)
+        # aiohttp asks for gzip/deflate by default, without compress we ask for the body as is
+        headers = None if self.compress else {'Accept-Encoding': 'identity'}
+        return self.aiohttp.ClientSession(connector=connector, timeout=self.timeout, headers=headers,
+                                          auto_decompress=self.compress)
+
+    def run(self, coroutine):
+        """ Runs a coroutine on the transport's event loop from any other thread. """
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    async def arequest(self, method: str, url: str, body=None, headers=None, **kwargs) -> TransportResponse:
+        """ Sends a request, reading the whole body. """
+        if asyncio.get_event_loop() is not self.loop:
+            return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(
+                self.arequest(method, url, body, headers), self.loop))
+        async with self.client.request(method, url, data=body, headers=headers, proxy=self.proxy) as response:
+            data = await response.read()
+            return TransportResponse(data, response.status, dict(response.headers),
+                                     int(response.headers.get('Content-Length', len(data))))
+
+    def request(self, method: str, url: str, body=None, headers=None, preload_content=True, **kwargs):
+        """ Sends a request and waits for the response, the body is always read (preload_content is ignored). """
+        return self.run(self.arequest(method, url, body, headers))
+
+    def close(self):
+        if self.closed:
+            return
+        self.run(self.client.close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        self.closed = True
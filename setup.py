@@ -47,6 +47,8 @@ setup(name='scibiomart',
           ]
       },
       install_requires=['pandas', 'numpy', 'sciutil', 'xmltodict', 'urllib3'],
+      extras_require={'arrow': ['pyarrow'], 'compression': ['urllib3[brotli,zstd]'],
+                      'batch': ['pyyaml'], 'async': ['aiohttp']},
       python_requires='>=3.6',
       data_files=[("", ["LICENSE"])]
       )
@@ -0,0 +1,99 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+"""
+Stand ins for the martservice shared by the tests. FakeSession answers queries in process without HTTP, tests that
+need a real server (connections, compression, transports) use benchmarks.mock_mart.MockMart.
+"""
+
+import asyncio
+import io
+import re
+import threading
+import time
+from urllib.parse import unquote, unquote_plus
+
+
+class FakeResponse(io.BytesIO):
+    """ A response like urllib3's: the body as data and as a stream. """
+
+    def __init__(self, data: bytes, status=200):
+        super().__init__(data)
+        self.data = data
+        self.status = status
+        self.released = False
+
+    def release_conn(self):
+        self.released = True
+
+
+def request_query(url: str, body=None) -> str:
+    """ The query sent in a request: queries are POSTed as a form, other requests are in the URL. """
+    return unquote_plus(body) if body else unquote(url)
+
+
+def filter_values(query: str, name='ensembl_gene_id') -> list:
+    """ The values of a filter in a query document, empty if the query doesn't have the filter. """
+    match = re.search(rf'name = "{name}" value = "([^"]*)"', query)
+    return match.group(1).split(',') if match else []
+
+
+class FakeSession:
+    """
+    Returns a TSV row per ensembl ID in the query, by default the ID and the ID lower cased (row returns the values
+    for an ID, or None to leave it out). Records the queries and how many requests ran at once.
+    """
+
+    def __init__(self, row=None, delay=0.0):
+        self.row = row or (lambda gene_id: [gene_id, gene_id.lower()])
+        self.delay = delay
+        self.queries = []
+        self.response = None
+        self.running = 0
+        self.max_running = 0
+        self.lock = threading.Lock()
+
+    def request(self, method, url, body=None, **kwargs):
+        query = request_query(url, body)
+        with self.lock:
+            self.queries.append(query)
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        try:
+            time.sleep(self.delay)
+            self.response = self.respond(query)
+        finally:
+            with self.lock:
+                self.running -= 1
+        return self.response
+
+    def respond(self, query: str) -> FakeResponse:
+        rows = [self.row(gene_id) for gene_id in filter_values(query)]
+        data = ''.join('\t'.join(row) + '\n' for row in rows if row is not None) + '[success]\n'
+        return FakeResponse(data.encode('utf-8'))
+
+    def clear(self):
+        return
+
+
+def run_async(coroutine):
+    """ Runs a coroutine on a new event loop (asyncio.run needs Python 3.7). """
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
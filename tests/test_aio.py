@@ -0,0 +1,66 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+import asyncio
+import re
+import unittest
+
+from scibiomart import AsyncSciBiomart
+from tests.fakes import FakeResponse, FakeSession, run_async
+
+
+class SlowSession(FakeSession):
+    """ Answers configuration and TSV queries after a delay with the dataset queried. """
+
+    def __init__(self, delay=0.05):
+        super().__init__(delay=delay)
+
+    def respond(self, query: str) -> FakeResponse:
+        if 'type=configuration' in query:
+            dataset = re.search(r'dataset=(\w+)', query).group(1)
+            return FakeResponse(f'<DatasetConfig dataset="{dataset}" version="V1"></DatasetConfig>'.encode('utf-8'))
+        dataset = re.search(r'Dataset name = "(\w+)"', query).group(1)
+        return FakeResponse(f'{dataset}\tGENE1\n[success]\n'.encode('utf-8'))
+
+
+class TestAsync(unittest.TestCase):
+
+    def test_gather_datasets(self):
+        async def run():
+            async with AsyncSciBiomart(max_concurrency=4) as sb:
+                sb.sb.session = SlowSession()
+                results = await asyncio.gather(*[sb.query('ENSEMBL_MART_ENSEMBL', d, None, ['dataset', 'gene'])
+                                                 for d in ['hsapiens_gene_ensembl', 'mmusculus_gene_ensembl',
+                                                           'drerio_gene_ensembl']])
+                return sb.sb.session, results
+        session, results = run_async(run())
+        assert [df['dataset'].values[0] for df in results] == ['hsapiens_gene_ensembl', 'mmusculus_gene_ensembl',
+                                                               'drerio_gene_ensembl']
+        assert session.max_running > 1
+
+    def test_concurrency_limit(self):
+        async def run():
+            sb = AsyncSciBiomart(max_concurrency=2)
+            sb.sb.session = SlowSession()
+            sb.set_mart('ENSEMBL_MART_ENSEMBL')
+            await sb.set_dataset('hsapiens_gene_ensembl')
+            assert await sb.get_dataset_version() == 'hsapiens_gene_ensembl-V1'
+            await asyncio.gather(*[sb.run_query(None, ['dataset', 'gene']) for _ in range(6)])
+            sb.close_session()
+            return sb.sb.session
+        session = run_async(run())
+        assert session.max_running == 2
@@ -0,0 +1,71 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+import unittest
+
+import pandas as pd
+
+from scibiomart.annot import Annot
+
+
+class TestAnnot(unittest.TestCase):
+
+    def setUp(self):
+        self.de_df = pd.DataFrame({'id': ['ENSG1', 'ENSG2', 'ENSG3', 'ENSG1'], 'logFC': [1.0, -2.0, 0.5, 3.0]},
+                                  index=['r1', 'r2', 'r3', 'r4'])
+        # ENSG2 has two mouse homologs, ENSG4 isn't in the DE table
+        self.homologs_df = pd.DataFrame({'ensembl_gene_id': ['ENSG1', 'ENSG2', 'ENSG2', 'ENSG4'],
+                                         'mmusculus_homolog_ensembl_gene': ['M1', 'M2a', 'M2b', 'M4']})
+        self.annot = Annot()
+
+    def test_inner(self):
+        merged_df = self.annot.annot(self.de_df, ['id', 'ensembl_gene_id'], self.homologs_df)
+        assert list(merged_df.index) == ['r1', 'r2', 'r2', 'r4']
+        assert list(merged_df['mmusculus_homolog_ensembl_gene'].values) == ['M1', 'M2a', 'M2b', 'M1']
+        assert list(merged_df['logFC'].values) == [1.0, -2.0, -2.0, 3.0]
+        # The caller's dataframe isn't changed
+        assert list(self.de_df.columns) == ['id', 'logFC']
+
+    def test_left(self):
+        merged_df = self.annot.annot(self.de_df, ['id', 'ensembl_gene_id'], self.homologs_df, how='left')
+        assert len(merged_df) == 5
+        assert merged_df.loc['r3', 'mmusculus_homolog_ensembl_gene'] is None or \
+            pd.isnull(merged_df.loc['r3', 'mmusculus_homolog_ensembl_gene'])
+
+    def test_outer(self):
+        merged_df = self.annot.annot(self.de_df, ['id', 'ensembl_gene_id'], self.homologs_df, keep_na=True)
+        assert len(merged_df) == 6
+        assert merged_df['mmusculus_homolog_ensembl_gene'].values[-1] == 'M4'
+        assert pd.isnull(merged_df['id'].values[-1])
+
+    def test_reuse_annotation(self):
+        self.annot.set_annotation(self.homologs_df, 'ensembl_gene_id')
+        index = self.annot.annotation_index
+        merged_df = self.annot.annot(self.de_df, ['id', 'ensembl_gene_id'])
+        assert self.annot.annotation_index is index
+        assert len(merged_df) == 4
+        # Same key name in both so it is only kept once
+        de_df = self.de_df.rename(columns={'id': 'ensembl_gene_id'})
+        merged_df = self.annot.annot(de_df, ['ensembl_gene_id', 'ensembl_gene_id'])
+        assert list(merged_df.columns) == ['ensembl_gene_id', 'logFC', 'mmusculus_homolog_ensembl_gene']
+
+    def test_empty_annotation(self):
+        empty_df = self.homologs_df.iloc[:0]
+        merged_df = self.annot.annot(self.de_df, ['id', 'ensembl_gene_id'], empty_df, how='left')
+        assert len(merged_df) == len(self.de_df)
+        assert merged_df['mmusculus_homolog_ensembl_gene'].isnull().all()
+        assert len(self.annot.annot(self.de_df, ['id', 'ensembl_gene_id'], empty_df)) == 0
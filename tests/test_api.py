@@ -54,7 +54,7 @@ class TestApi(unittest.TestCase):
         sb = SciBiomartApi()
         results_df = sb.get_mouse_default({'ensembl_gene_id': 'ENSMUSG00000029844,ENSMUSG00000032446'})
         print(results_df.head())
-        assert results_df['end_position'][0] == '52135297' #'52158317' hmm recently changed for hoxa1?
+        assert results_df['end_position'][0] == 52135297 #'52158317' hmm recently changed for hoxa1?
         self.sb = sb
 
     def test_sort_df_on_starts(self):
@@ -0,0 +1,81 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import pandas as pd
+
+from benchmarks.mock_mart import MockMart
+from scibiomart.__main__ import main
+from scibiomart.batch import load_manifest, run_manifest
+
+
+class TestBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.mart = MockMart(n_genes=50).start()
+        self.ids = self.mart.genes['ensembl_gene_id'][:2]
+        self.tmp_dir = tempfile.mkdtemp(prefix='scibiomart_batch_')
+        self.manifest = {
+            'url': self.mart.url,
+            'max_workers': 3,
+            'cache': os.path.join(self.tmp_dir, 'cache'),
+            'report': os.path.join(self.tmp_dir, 'report.tsv'),
+            'defaults': {'attributes': 'ensembl_gene_id,external_gene_name,chromosome_name,start_position,'
+                                       'end_position,strand'},
+            'jobs': [
+                {'name': 'human', 'dataset': 'hsapiens_gene_ensembl', 'output': os.path.join(self.tmp_dir, 'hs_'),
+                 'sort': True},
+                {'name': 'subset', 'dataset': 'hsapiens_gene_ensembl', 'output': os.path.join(self.tmp_dir, 'sub_'),
+                 'format': 'tsv', 'stream': True, 'filters': {'ensembl_gene_id': self.ids}},
+                {'name': 'broken', 'dataset': 'hsapiens_gene_ensembl', 'output': os.path.join(self.tmp_dir, 'br_'),
+                 'attributes': ['not_an_attribute']}
+            ]
+        }
+
+    def tearDown(self):
+        self.mart.stop()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_run_manifest(self):
+        report_df = run_manifest(self.manifest).set_index('name')
+        assert list(report_df['rows'][['human', 'subset']]) == [50, 2]
+        assert 'NOT FOUND' in report_df['error']['broken']
+        assert (report_df['seconds'] >= 0).all()
+        human_df = pd.read_csv(report_df['output']['human'])
+        assert sorted(human_df['ensembl_gene_id']) == self.mart.genes['ensembl_gene_id']
+        assert list(human_df['ensembl_gene_id']) != self.mart.genes['ensembl_gene_id']  # Sorted on the positions
+        assert report_df['output']['subset'].endswith('sub_hsapiens_gene_ensembl-Human genes (GRCh38.p13).tsv')
+        subset_df = pd.read_csv(report_df['output']['subset'], sep='\t')
+        assert list(subset_df['ensembl_gene_id']) == self.ids
+        assert len(pd.read_csv(self.manifest['report'], sep='\t')) == 3
+        # The jobs share the cache
+        assert os.listdir(self.manifest['cache'])
+
+    def test_cli(self):
+        path = os.path.join(self.tmp_dir, 'manifest.yaml')
+        self.manifest['jobs'] = self.manifest['jobs'][:2]
+        with open(path, 'w') as f:
+            f.write(json.dumps(self.manifest))  # JSON is valid YAML
+        assert load_manifest(path) == self.manifest
+        with self.assertRaises(SystemExit) as e:
+            main(['scibiomart', 'batch', path, '--max_workers', '2'])
+        assert e.exception.code == 0
@@ -0,0 +1,43 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+import unittest
+
+from benchmarks.mock_mart import MockMart
+from benchmarks.run import run_benchmarks
+from scibiomart import SciBiomart
+
+
+class TestBenchmarks(unittest.TestCase):
+
+    def test_mock_mart(self):
+        with MockMart(n_genes=100) as mart:
+            sb = SciBiomart(mart.url)
+            sb.set_mart('ENSEMBL_MART_ENSEMBL')
+            sb.set_dataset('hsapiens_gene_ensembl')
+            assert sb.dataset_version == 'hsapiens_gene_ensembl-Human genes (GRCh38.p13)'
+            df = sb.run_query({'ensembl_gene_id': ['ENSG00000000001', 'ENSG00000000042']},
+                              ['ensembl_gene_id', 'chromosome_name', 'start_position'])
+            assert list(df['ensembl_gene_id']) == ['ENSG00000000001', 'ENSG00000000042']
+            assert list(df['start_position']) == [mart.genes['start_position'][1], mart.genes['start_position'][42]]
+            assert len(sb.run_query(None, ['ensembl_gene_id'], stream=True)) == 100
+
+    def test_run_benchmarks(self):
+        results_df = run_benchmarks(n_genes=200, repeat=1, only=['parse_results', 'batches_concurrent', 'annot'])
+        assert list(results_df['benchmark']) == ['parse_results', 'batches_concurrent', 'annot']
+        assert list(results_df['rows']) == [200, 200, 200]
+        assert (results_df['median_s'] > 0).all()
@@ -0,0 +1,94 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from benchmarks.mock_mart import MockMart
+from scibiomart import SciBiomart, SciBiomartCache
+from scibiomart.base import SciBiomartException
+from tests.fakes import FakeSession
+
+
+class TestCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='scibiomart_cache_')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_versioned_keys(self):
+        cache = SciBiomartCache(self.tmp_dir)
+        cache.put('query', b'data', 'hsapiens_gene_ensembl-GRCh38.p13')
+        assert cache.get('query', 'hsapiens_gene_ensembl-GRCh38.p13') == b'data'
+        # A new release doesn't reuse the old response
+        assert cache.get('query', 'hsapiens_gene_ensembl-GRCh38.p14') is None
+        assert cache.hits == 1 and cache.misses == 1
+
+    def test_ttl(self):
+        cache = SciBiomartCache(self.tmp_dir, unversioned_ttl=60)
+        cache.put('query', b'data')
+        path = cache.path(cache.key('query'))
+        os.utime(path, (time.time(), time.time() - 120))
+        assert cache.get('query') is None
+        # Offline we would rather have stale data than nothing
+        cache.offline = True
+        assert cache.get('query') == b'data'
+
+    def test_lru_eviction(self):
+        cache = SciBiomartCache(self.tmp_dir, max_size=25)
+        now = time.time()
+        for i in range(2):
+            cache.put(f'query{i}', b'0123456789', 'v')
+            os.utime(cache.path(cache.key(f'query{i}', 'v')), (now - 100 + i, now))
+        cache.get('query0', 'v')  # query0 is now the most recently used
+        cache.put('query2', b'0123456789', 'v')
+        assert cache.get('query1', 'v') is None
+        assert cache.get('query0', 'v') == b'0123456789'
+        assert cache.get('query2', 'v') == b'0123456789'
+
+    def test_query_biomart(self):
+        sb = SciBiomart(cache=SciBiomartCache(self.tmp_dir))
+        sb.session = FakeSession()
+        sb.set_mart('ENSEMBL_MART_ENSEMBL')
+        sb.dataset = 'hsapiens_gene_ensembl'
+        sb.dataset_version = 'hsapiens_gene_ensembl-GRCh38.p13'
+        df = sb.run_query({'ensembl_gene_id': 'ENSG1,ENSG2'}, ['ensembl_gene_id', 'external_gene_name'])
+        df_cached = sb.run_query({'ensembl_gene_id': 'ENSG1,ENSG2'}, ['ensembl_gene_id', 'external_gene_name'])
+        assert len(sb.session.queries) == 1
+        assert df.equals(df_cached)
+        sb.cache.offline = True
+        with self.assertRaises(SciBiomartException):
+            sb.run_query({'ensembl_gene_id': 'ENSG3'}, ['ensembl_gene_id', 'external_gene_name'])
+
+    def test_servers_not_shared(self):
+        # Two servers on the same release with different data don't answer for each other
+        cache = SciBiomartCache(self.tmp_dir)
+        with MockMart(n_genes=10, seed=1) as mart_a, MockMart(n_genes=10, seed=2) as mart_b:
+            starts = []
+            for mart in [mart_a, mart_b]:
+                sb = SciBiomart(mart.url, cache=cache)
+                sb.set_mart('ENSEMBL_MART_ENSEMBL')
+                sb.set_dataset('hsapiens_gene_ensembl')
+                df = sb.run_query({'ensembl_gene_id': ['ENSG00000000001']}, ['ensembl_gene_id', 'start_position'])
+                starts.append(df['start_position'].values[0])
+            assert starts == [mart_a.genes['start_position'][1], mart_b.genes['start_position'][1]]
+            assert starts[0] != starts[1]
@@ -0,0 +1,144 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+import re
+import unittest
+
+import pandas as pd
+
+from scibiomart import SciBiomart
+from scibiomart.base import SciBiomartException
+from scibiomart.catalog import SciBiomartCatalog
+from tests.fakes import FakeResponse, FakeSession
+
+
+def make_catalog():
+    attributes = [['ensembl_gene_id', 'Gene stable ID', 'Stable ID of the gene', 'feature_page'],
+                  ['external_gene_name', 'Gene name', 'Name of the gene', 'feature_page'],
+                  ['chromosome_name', 'Chromosome/scaffold name', '', 'feature_page'],
+                  ['ensembl_gene_id', 'Gene stable ID', 'Stable ID of the gene', 'homologs'],
+                  ['mmusculus_homolog_ensembl_gene', 'Mouse gene stable ID', '', 'homologs'],
+                  ['ensembl_gene_id', 'Gene stable ID', 'Stable ID of the gene', 'sequences'],
+                  ['gene_flank', 'Flank (Gene)', '', 'sequences']]
+    attributes_df = pd.DataFrame([a + ['html,txt', 'gene', f'col_{i}'] for i, a in enumerate(attributes)],
+                                 columns=['name', 'description', 'values', 'text_filters', 'qualifiers', 'label', 'id'])
+    filters_df = pd.DataFrame([['ensembl_gene_id', 'Gene stable ID(s)', '[]', '', 'filters', 'id_list', '=', 'gene',
+                                'stable_id_1023'],
+                               ['chromosome_name', 'Chromosome/scaffold name', '[1,2]', '', 'filters', 'list', '=',
+                                'gene', 'name_1059'],
+                               ['upstream_flank', 'Upstream flank', '[]', '', 'filters', 'text', '=', 'gene', 'flank']],
+                              columns=['name', 'description', 'values', 'unknown', 'text_filters', 'data_type',
+                                       'qualifiers', 'label', 'id'])
+    return SciBiomartCatalog(attributes_df, filters_df)
+
+
+class PagedSession(FakeSession):
+    """ Serves ENSG1 and ENSG2 refusing queries that mix pages, ENSG1 has two mouse homologs. """
+
+    def __init__(self, catalog):
+        super().__init__()
+        self.catalog = catalog
+
+    def request(self, method, url, body=None, **kwargs):
+        if 'type=attributes' in url:
+            return FakeResponse(self.catalog.attributes_df.to_csv(sep='\t', header=False, index=False).encode('utf-8'))
+        if 'type=filters' in url:
+            return FakeResponse(self.catalog.filters_df.to_csv(sep='\t', header=False, index=False).encode('utf-8'))
+        return super().request(method, url, body, **kwargs)
+
+    def respond(self, query: str) -> FakeResponse:
+        attrs = re.findall(r'Attribute name = "(\w+)"', query)
+        if not self.catalog.pages(attrs):
+            return FakeResponse(b'Query ERROR: caught BioMart::Exception::Usage: Attributes from multiple attribute '
+                                b'pages are not allowed')
+        rows = []
+        for gene in ['ENSG1', 'ENSG2']:
+            n_rows = 2 if gene == 'ENSG1' and 'mmusculus_homolog_ensembl_gene' in attrs else 1
+            for i in range(n_rows):
+                rows.append('\t'.join(gene if a == 'ensembl_gene_id' else f'{a}_{gene}_{i}' for a in attrs))
+        return FakeResponse(('\n'.join(rows) + '\n[success]\n').encode('utf-8'))
+
+
+class TestCatalog(unittest.TestCase):
+
+    def setUp(self):
+        self.catalog = make_catalog()
+
+    def test_validate(self):
+        self.catalog.validate({'ensembl_gene_id': 'ENSG1'}, ['ensembl_gene_id', 'external_gene_name'])
+        with self.assertRaises(SciBiomartException) as e:
+            self.catalog.validate({'ensembl_gene': 'ENSG1'}, ['ensembl_gene_id', 'external_gene_nme'])
+        assert 'did you mean: external_gene_name' in str(e.exception)
+        assert 'did you mean: ensembl_gene_id' in str(e.exception)
+
+    def test_pages(self):
+        assert self.catalog.pages(['ensembl_gene_id']) == ['feature_page', 'homologs', 'sequences']
+        assert self.catalog.pages(['ensembl_gene_id', 'mmusculus_homolog_ensembl_gene']) == ['homologs']
+        assert self.catalog.pages(['external_gene_name', 'mmusculus_homolog_ensembl_gene']) == []
+        with self.assertRaises(SciBiomartException):
+            self.catalog.validate(None, ['external_gene_name', 'mmusculus_homolog_ensembl_gene'])
+
+    def test_search(self):
+        results_df = self.catalog.search('mouse')
+        assert results_df['name'].values[0] == 'mmusculus_homolog_ensembl_gene'
+        results_df = self.catalog.search('chromosom name')
+        assert 'chromosome_name' in results_df['name'].values
+
+    def test_run_query_validates(self):
+        sb = SciBiomart(validate=True)
+        sb.set_mart('ENSEMBL_MART_ENSEMBL')
+        sb.set_dataset('catalog_test_dataset')
+        SciBiomart.catalogs[(sb.url, sb.mart, sb.dataset)] = self.catalog
+        # Fails before anything is sent
+        sb.session = None
+        with self.assertRaises(SciBiomartException):
+            sb.run_query({'ensembl_gene_id': 'ENSG1'}, ['ensembl_gene_idd'])
+
+    def test_split_attributes(self):
+        sb = SciBiomart()
+        sb.set_mart('ENSEMBL_MART_ENSEMBL')
+        sb.set_dataset('catalog_test_dataset')
+        SciBiomart.catalogs[(sb.url, sb.mart, sb.dataset)] = self.catalog
+        assert sb.split_attributes(['external_gene_name', 'mmusculus_homolog_ensembl_gene', 'chromosome_name']) == \
+            [['ensembl_gene_id', 'external_gene_name', 'chromosome_name'],
+             ['ensembl_gene_id', 'mmusculus_homolog_ensembl_gene']]
+        assert sb.split_attributes(['ensembl_gene_id', 'external_gene_name']) == [['ensembl_gene_id',
+                                                                                  'external_gene_name']]
+
+    def test_run_query_pages(self):
+        for known_catalog in [True, False]:
+            sb = SciBiomart()
+            sb.session = PagedSession(self.catalog)
+            sb.set_mart('ENSEMBL_MART_ENSEMBL')
+            sb.set_dataset(f'catalog_test_dataset_{known_catalog}')
+            errors = []
+            sb.u.err_p = errors.append
+            if known_catalog:
+                SciBiomart.catalogs[(sb.url, sb.mart, sb.dataset)] = self.catalog
+            df = sb.run_query({'ensembl_gene_id': 'ENSG1,ENSG2'}, ['external_gene_name',
+                                                                    'mmusculus_homolog_ensembl_gene'])
+            # When we don't know the pages the server refuses the first query
+            assert len(sb.session.queries) == (2 if known_catalog else 3)
+            # which is handled so isn't logged as an error
+            assert not errors
+            assert list(df.columns) == ['external_gene_name', 'mmusculus_homolog_ensembl_gene']
+            assert list(df['external_gene_name'].values) == ['external_gene_name_ENSG1_0',
+                                                              'external_gene_name_ENSG1_0',
+                                                              'external_gene_name_ENSG2_0']
+            assert list(df['mmusculus_homolog_ensembl_gene'].values) == ['mmusculus_homolog_ensembl_gene_ENSG1_0',
+                                                                          'mmusculus_homolog_ensembl_gene_ENSG1_1',
+                                                                          'mmusculus_homolog_ensembl_gene_ENSG2_0']
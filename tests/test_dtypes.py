@@ -0,0 +1,78 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.mock_mart import MockMart
+from scibiomart.base import SciBiomart
+from scibiomart.dtypes import attribute_types, convert_dtypes, CATEGORY, INTEGER, STRAND
+
+
+class TestDtypes(unittest.TestCase):
+
+    def test_attribute_types(self):
+        attributes_df = pd.DataFrame({'name': ['gene_start_custom', 'chromosome_name'],
+                                      'id': ['seq_region_start_1020', 'name_1059']})
+        attr_types = attribute_types(['ensembl_gene_id', 'entrezgene_id', 'chromosome_name', 'start_position',
+                                      'strand', 'gene_biotype', 'gene_start_custom'], attributes_df)
+        # IDs are left as strings
+        assert 'ensembl_gene_id' not in attr_types
+        assert 'entrezgene_id' not in attr_types
+        assert attr_types['chromosome_name'] == CATEGORY
+        assert attr_types['gene_biotype'] == CATEGORY
+        assert attr_types['start_position'] == INTEGER
+        assert attr_types['strand'] == STRAND
+        # Typed from the column in the attribute metadata
+        assert attr_types['gene_start_custom'] == INTEGER
+
+    def test_convert_dtypes(self):
+        df = pd.DataFrame({'ensembl_gene_id': ['ENSG1', 'ENSG2', 'ENSG3'],
+                           'chromosome_name': ['1', 'X', '1'],
+                           'start_position': ['100', '3000000000', '5'],
+                           'end_position': ['200', '', '10'],
+                           'strand': ['1', '-1', '1']})
+        typed_df = convert_dtypes(df, attribute_types(df.columns))
+        assert typed_df['start_position'].dtype == np.int64  # Too large for an int32
+        assert typed_df['end_position'].dtype == pd.Int32Dtype()  # Missing values
+        assert typed_df['strand'].dtype == np.int8
+        assert isinstance(typed_df['chromosome_name'].dtype, pd.CategoricalDtype)
+        assert typed_df['ensembl_gene_id'].values[0] == 'ENSG1'
+        # The input is left as it was
+        assert df['strand'].values[1] == '-1'
+
+    def test_attribute_metadata_shared(self):
+        attrs = ['ensembl_gene_id', 'start_position']
+        with MockMart(n_genes=20) as mart:
+            sb = SciBiomart(mart.url)
+            sb.set_mart('ENSEMBL_MART_ENSEMBL')
+            sb.set_dataset('hsapiens_gene_ensembl')
+            df = sb.run_query(None, attrs, typed=True)
+            assert df['start_position'].dtype == np.int32
+            # Typing doesn't replace the most recent dataframe with the attribute listing
+            assert sb.get_current_df() is df
+            chunks = list(sb.iter_query(None, attrs, typed=True))
+            assert list(sb.get_current_df().columns) == attrs
+            n_requests = mart.n_requests
+            # A new instance reuses the attribute metadata and only sends the query
+            sb = SciBiomart(mart.url)
+            sb.set_mart('ENSEMBL_MART_ENSEMBL')
+            sb.set_dataset('hsapiens_gene_ensembl')
+            assert sb.run_query(None, attrs, typed=True).equals(pd.concat(chunks))
+            assert mart.n_requests == n_requests + 1
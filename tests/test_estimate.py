@@ -0,0 +1,123 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+import shutil
+import tempfile
+import unittest
+
+from benchmarks.mock_mart import MockMart
+from scibiomart import SciBiomart, SciBiomartCache, SciBiomartStats
+from scibiomart.errors import SciBiomartException
+
+GENE_IDS = [f'ENSG{i:011d}' for i in range(0, 60, 2)]
+ATTRS = ['ensembl_gene_id', 'chromosome_name', 'start_position']
+
+
+class TestEstimate(unittest.TestCase):
+
+    def setUp(self):
+        self.mart = MockMart(n_genes=100).start()
+
+    def tearDown(self):
+        self.mart.stop()
+
+    def get_sb(self, **kwargs):
+        sb = SciBiomart(self.mart.url, **kwargs)
+        sb.set_mart('ENSEMBL_MART_ENSEMBL')
+        sb.set_dataset('hsapiens_gene_ensembl')
+        return sb
+
+    def test_count_query(self):
+        stats = SciBiomartStats()
+        sb = self.get_sb(instruments=[stats])
+        assert sb.count_query(None) == 100
+        assert sb.count_query({'ensembl_gene_id': GENE_IDS[:3]}, ATTRS) == 3
+        # POSTed queries are counted at once, with GET large filters are counted in batches
+        assert sb.count_query({'ensembl_gene_id': GENE_IDS}, ATTRS, batch_size=7) == 30
+        sb.post = False
+        assert sb.count_query({'ensembl_gene_id': GENE_IDS}, ATTRS, batch_size=7) == 30
+        count_df = stats.summary().set_index('phase')
+        assert count_df.loc['count', 'count'] == 4
+        assert count_df.loc['count', 'rows'] == 163
+        assert count_df.loc['request', 'count'] == 3 + 5
+        # Counts are remembered
+        sb.post = True
+        assert sb.count_query(None) == 100
+        assert stats.summary().set_index('phase').loc['request', 'count'] == 8
+
+    def test_count_error_not_cached(self):
+        tmp_dir = tempfile.mkdtemp(prefix='scibiomart_estimate_')
+        try:
+            sb = self.get_sb(cache=SciBiomartCache(tmp_dir))
+            with self.assertRaises(SciBiomartException):
+                sb.count_query(None, ['unknown_attribute'])
+            n_requests = self.mart.n_requests
+            with self.assertRaises(SciBiomartException):
+                sb.count_query(None, ['unknown_attribute'])
+            assert self.mart.n_requests == n_requests + 1
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_count_query_no_dataset(self):
+        sb = SciBiomart(self.mart.url)
+        assert 'err' in sb.count_query(None)
+
+    def test_estimate(self):
+        sb = self.get_sb(batch_size=10)
+        query_estimate = sb.estimate({'ensembl_gene_id': GENE_IDS}, ATTRS)
+        assert query_estimate['rows'] == 30
+        assert query_estimate['batches'] == 3
+        assert query_estimate['strategy'] == 'batched'
+        assert query_estimate['bytes'] > 30 * len(ATTRS)
+        assert query_estimate['memory_bytes'] > query_estimate['bytes']
+        assert sb.estimate({'ensembl_gene_id': GENE_IDS[:5]}, ATTRS)['strategy'] == 'single'
+        sb.stream_rows = 50
+        assert sb.estimate(None, ATTRS)['strategy'] == 'stream'
+
+    def test_auto_strategy(self):
+        sb = self.get_sb(batch_size=10, strategy='auto', stream_rows=50)
+        stats = SciBiomartStats()
+        sb.add_instrument(stats)
+        df = sb.run_query({'ensembl_gene_id': GENE_IDS}, ATTRS)
+        assert list(df['ensembl_gene_id']) == GENE_IDS
+        summary_df = stats.summary().set_index('phase')
+        # The count then a request per batch
+        assert summary_df.loc['request', 'count'] == 4
+        assert 'stream' not in summary_df.index
+        # The count is remembered
+        sb.run_query({'ensembl_gene_id': GENE_IDS}, ATTRS)
+        assert stats.summary().set_index('phase').loc['request', 'count'] == 7
+        # More than stream_rows rows are streamed
+        assert len(sb.run_query(None, ATTRS)) == 100
+        assert stats.summary().set_index('phase').loc['stream', 'count'] == 1
+
+    def test_single_strategy(self):
+        sb = self.get_sb(batch_size=10)
+        stats = SciBiomartStats()
+        sb.add_instrument(stats)
+        df = sb.run_query({'ensembl_gene_id': GENE_IDS}, ATTRS, strategy='single')
+        assert list(df['ensembl_gene_id']) == GENE_IDS
+        assert stats.summary().set_index('phase').loc['request', 'count'] == 1
+        with self.assertRaises(SciBiomartException):
+            sb.run_query(None, ATTRS, strategy='fastest')
+
+    def test_max_rows(self):
+        assert self.get_sb().max_rows is not None
+        sb = self.get_sb(strategy='auto', max_rows=50)
+        assert len(sb.run_query({'ensembl_gene_id': GENE_IDS}, ATTRS)) == 30
+        with self.assertRaises(SciBiomartException):
+            sb.run_query(None, ATTRS)
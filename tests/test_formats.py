@@ -0,0 +1,70 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import pandas as pd
+
+from scibiomart import SciBiomart
+from scibiomart.formats import load_metadata
+
+try:
+    import pyarrow
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+
+class TestFormats(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='scibiomart_formats_')
+        self.df = pd.DataFrame({'ensembl_gene_id': ['ENSG1', 'ENSG2'],
+                                'chromosome_name': pd.Categorical(['1', 'X']),
+                                'start_position': pd.array([100, 200], dtype='int32'),
+                                'strand': pd.array([1, -1], dtype='int8')})
+        self.sb = SciBiomart()
+        self.sb.set_mart('ENSEMBL_MART_ENSEMBL')
+        self.sb.set_dataset('hsapiens_gene_ensembl')
+        self.sb.dataset_version = 'hsapiens_gene_ensembl-GRCh38.p13'
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_csv(self):
+        path = self.sb.save(self.df, os.path.join(self.tmp_dir, 'genes_'), 'tsv')
+        assert path.endswith('genes_hsapiens_gene_ensembl-GRCh38.p13.tsv')
+        df = SciBiomart.load(path)
+        assert list(df['ensembl_gene_id'].values) == ['ENSG1', 'ENSG2']
+        assert self.sb.save_as_csv(self.df, os.path.join(self.tmp_dir, 'genes_')).endswith('.csv')
+
+    @unittest.skipUnless(HAS_PYARROW, 'pyarrow is not installed')
+    def test_columnar(self):
+        for fmt in ['parquet', 'feather', 'arrow']:
+            path = self.sb.save(self.df, os.path.join(self.tmp_dir, 'genes_'), fmt)
+            assert path.endswith(f'.{fmt}')
+            df = SciBiomart.load(path)
+            # The dtypes are kept
+            assert df['strand'].dtype == self.df['strand'].dtype
+            assert isinstance(df['chromosome_name'].dtype, pd.CategoricalDtype)
+            assert df.equals(self.df)
+            metadata = load_metadata(path)
+            assert metadata['dataset_version'] == 'hsapiens_gene_ensembl-GRCh38.p13'
+            assert metadata['dataset'] == 'hsapiens_gene_ensembl'
@@ -0,0 +1,51 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+import subprocess
+import sys
+import unittest
+
+import scibiomart
+
+
+class TestImports(unittest.TestCase):
+
+    def run_python(self, code: str) -> str:
+        return subprocess.run([sys.executable, '-c', code], check=True, stdout=subprocess.PIPE,
+                              universal_newlines=True).stdout
+
+    def test_lazy(self):
+        # Importing the package or printing the version doesn't import the heavy dependencies
+        code = 'import sys, scibiomart; print(sorted(m for m in ["pandas", "numpy", "urllib3"] if m in sys.modules))'
+        assert self.run_python(code).strip() == '[]'
+        code = 'import sys\nfrom scibiomart.__main__ import main\ntry:\n    main(["scibiomart", "--version"])\n' \
+               'except SystemExit:\n    print("pandas" in sys.modules)'
+        assert self.run_python(code).strip().split('\n') == [f'scibiomart v{scibiomart.__version__}', 'False']
+
+    def test_list_marts(self):
+        # Listing the marts doesn't need pandas
+        code = 'import sys\nfrom benchmarks.mock_mart import MockMart\nfrom scibiomart.base import SciBiomart\n' \
+               'with MockMart(n_genes=10) as mart:\n    SciBiomart(mart.url).list_marts(False)\n' \
+               'print("pandas" in sys.modules)'
+        assert self.run_python(code).strip() == 'False'
+
+    def test_attributes(self):
+        from scibiomart.base import SciBiomart
+        assert scibiomart.SciBiomart is SciBiomart
+        assert 'SciBiomartApi' in dir(scibiomart)
+        with self.assertRaises(AttributeError):
+            scibiomart.NotAClass
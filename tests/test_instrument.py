@@ -0,0 +1,114 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+import shutil
+import tempfile
+import unittest
+
+from scibiomart import SciBiomart, SciBiomartCache
+from scibiomart.instrument import CallbackInstrument, OpenTelemetryInstrument, SciBiomartStats
+from tests.fakes import FakeResponse, FakeSession
+
+
+class BusySession(FakeSession):
+    """ Returns a row per ensembl ID (with its length), the first request is refused as the server is busy. """
+
+    def __init__(self):
+        super().__init__(lambda gene_id: [gene_id, str(len(gene_id))])
+        self.busy = True
+
+    def respond(self, query: str) -> FakeResponse:
+        if self.busy:
+            self.busy = False
+            return FakeResponse(b'', 503)
+        if 'type=attributes' in query:
+            return FakeResponse(b'')
+        return super().respond(query)
+
+
+class FakeTracer:
+    """ Records the spans started like an OpenTelemetry tracer. """
+
+    def __init__(self):
+        self.spans = []
+
+    def start_span(self, name, attributes=None, start_time=None):
+        tracer = self
+
+        class FakeSpan:
+            def set_attribute(self, key, value):
+                attributes[key] = value
+
+            def end(self, end_time=None):
+                tracer.spans.append((name, attributes, start_time, end_time))
+        return FakeSpan()
+
+
+class TestInstrument(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='scibiomart_instrument_')
+        self.stats = SciBiomartStats()
+        self.spans = []
+        self.sb = SciBiomart(batch_size=5, cache=SciBiomartCache(self.tmp_dir), backoff_factor=0.01,
+                             instruments=[self.stats, CallbackInstrument(on_span_end=self.spans.append)])
+        self.sb.session = BusySession()
+        self.sb.set_mart('ENSEMBL_MART_ENSEMBL')
+        self.sb.dataset = 'hsapiens_gene_ensembl'
+        self.sb.dataset_version = 'Ensembl Genes 110'
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_stats(self):
+        ids = [f'ENSG{i:011d}' for i in range(12)]
+        df = self.sb.run_query({'ensembl_gene_id': ids}, ['ensembl_gene_id', 'start_position'], typed=True)
+        assert len(df) == 12
+        self.sb.run_query({'ensembl_gene_id': ids}, ['ensembl_gene_id', 'start_position'])
+        summary = self.stats.summary().set_index('phase')
+        assert summary['count']['run_query'] == 2
+        assert summary['rows']['run_query'] == 24
+        # 3 batches, the retry and the attribute metadata for the types, the second query is cached
+        assert summary['count']['request'] == 5
+        assert summary['errors']['request'] == 1
+        assert summary['decoded_bytes']['request'] == 12 * 19 + 3 * len('[success]\n')
+        assert summary['rows']['parse'] == 24
+        assert summary['count']['convert'] == 1
+        assert (summary['p95_s'] >= summary['p50_s']).all()
+        assert self.stats.events['retry'] == 1
+        assert self.stats.events['cache_hit'] == 3
+        self.stats.reset()
+        assert self.stats.summary().empty
+
+    def test_spans(self):
+        self.sb.run_query({'ensembl_gene_id': ['ENSG1']}, ['ensembl_gene_id', 'start_position'], stream=True)
+        by_name = {span.name: span for span in self.spans}
+        assert by_name['run_query'].attributes['rows'] == 1
+        assert by_name['split'].parent is by_name['run_query']
+        assert by_name['stream'].attributes['rows'] == 1
+        assert all(span.end >= span.start for span in self.spans)
+        assert self.spans[-1] is by_name['run_query']
+
+    def test_open_telemetry(self):
+        tracer = FakeTracer()
+        self.sb.add_instrument(OpenTelemetryInstrument(tracer))
+        self.sb.run_query({'ensembl_gene_id': ['ENSG1']}, ['ensembl_gene_id', 'start_position'])
+        names = [span[0] for span in tracer.spans]
+        assert names[-1] == 'scibiomart.run_query'
+        assert 'scibiomart.retry' in names
+        name, attributes, start, end = tracer.spans[-1]
+        assert attributes['scibiomart.rows'] == 1 and end >= start
@@ -0,0 +1,68 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from scibiomart import GeneIndex
+
+
+class TestGeneIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.genes_df = pd.DataFrame({'external_gene_name': ['a', 'b', 'c', 'd', 'e'],
+                                      'chromosome_name': ['1', '1', '1', '2', '1'],
+                                      'start_position': [100, 5000, 150, 100, 20000],
+                                      'end_position': [10000, 6000, 300, 200, 21000],
+                                      'strand': [1, -1, 1, 1, 1]})
+        self.index = GeneIndex(self.genes_df)
+
+    def test_overlaps(self):
+        results = self.index.overlaps(['1', '1', '2', '3'], [250, 7000, 50, 100], [260, 7001, 60, 200])
+        assert list(results['query_idx'].values) == [0, 0, 1]
+        assert sorted(results[results['query_idx'] == 0]['external_gene_name'].values) == ['a', 'c']
+        assert results[results['query_idx'] == 1]['external_gene_name'].values[0] == 'a'
+
+    def test_overlaps_brute_force(self):
+        rng = np.random.default_rng(0)
+        starts = rng.integers(0, 100000, 500)
+        genes_df = pd.DataFrame({'chromosome_name': rng.choice(['1', '2'], 500), 'start_position': starts,
+                                 'end_position': starts + rng.integers(1, 5000, 500),
+                                 'strand': rng.choice([-1, 1], 500)})
+        q_chroms = rng.choice(['1', '2'], 200)
+        q_starts = rng.integers(0, 100000, 200)
+        q_ends = q_starts + rng.integers(0, 1000, 200)
+        results = GeneIndex(genes_df).overlaps(q_chroms, q_starts, q_ends)
+        found = set(zip(results['query_idx'], results['start_position'], results['end_position']))
+        expected = set()
+        for i in range(200):
+            hits = genes_df[(genes_df['chromosome_name'] == q_chroms[i]) & (genes_df['start_position'] <= q_ends[i])
+                            & (genes_df['end_position'] >= q_starts[i])]
+            expected.update((i, s, e) for s, e in zip(hits['start_position'], hits['end_position']))
+        assert found == expected
+
+    def test_nearest_tss(self):
+        results = self.index.nearest_tss(['1', '1', '2', 'X'], [5900, 19000, 1000, 10])
+        assert list(results['external_gene_name'].values) == ['b', 'e', 'd']
+        # b is on the negative strand so its TSS is the end, 5900 is downstream of it
+        assert list(results['distance'].values) == [100, -1000, 900]
+
+    def test_window(self):
+        results = self.index.window(['1'], [5800], [5900], flank=5700)
+        assert sorted(results['external_gene_name'].values) == ['a', 'b', 'c']
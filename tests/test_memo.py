@@ -0,0 +1,112 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from scibiomart import SciBiomart, SciBiomartIdCache
+from tests.fakes import FakeSession, filter_values
+
+
+def id_row(gene_id: str):
+    """ The server has no genes starting with X and matches IDs case insensitively. """
+    return None if gene_id.startswith('X') else [gene_id.upper(), gene_id.lower()]
+
+
+def requested(session: FakeSession) -> list:
+    """ The IDs asked for by each query. """
+    return [filter_values(query) for query in session.queries]
+
+
+class TestIdCache(unittest.TestCase):
+
+    def make_sb(self, id_cache, delay=0.0):
+        sb = SciBiomart(id_cache=id_cache)
+        sb.session = FakeSession(id_row, delay)
+        sb.set_mart('ENSEMBL_MART_ENSEMBL')
+        sb.dataset = 'hsapiens_gene_ensembl'
+        sb.dataset_version = 'Ensembl Genes 110'
+        return sb
+
+    def test_missing_only(self):
+        id_cache = SciBiomartIdCache()
+        sb = self.make_sb(id_cache)
+        attrs = ['ensembl_gene_id', 'external_gene_name']
+        sb.run_query({'ensembl_gene_id': ['ENSG1', 'ENSG2', 'X1']}, attrs)
+        df = sb.run_query({'ensembl_gene_id': ['ENSG3', 'ENSG2', 'X1', 'ENSG1']}, attrs)
+        # Every row came back as asked for so X1 is known to have none
+        assert requested(sb.session) == [['ENSG1', 'ENSG2', 'X1'], ['ENSG3']]
+        assert list(df['ensembl_gene_id']) == ['ENSG3', 'ENSG2', 'ENSG1']
+        assert list(df['external_gene_name']) == ['ensg3', 'ensg2', 'ensg1']
+        assert id_cache.hits == 3 and id_cache.misses == 4
+        assert sb.run_query({'ensembl_gene_id': ['X1']}, attrs) is None
+        assert len(sb.session.queries) == 2
+
+    def test_other_case(self):
+        # The server matches tp53 to TP53, the rows come back every time but only IDs returned as asked are cached.
+        # We can't tell whether X1 has no rows or they are among the unmatched ones so it isn't cached either.
+        id_cache = SciBiomartIdCache()
+        sb = self.make_sb(id_cache)
+        attrs = ['ensembl_gene_id', 'external_gene_name']
+        for i in range(2):
+            df = sb.run_query({'ensembl_gene_id': ['ENSG1', 'ensg2', 'X1']}, attrs)
+            assert list(df['ensembl_gene_id']) == ['ENSG1', 'ENSG2']
+        assert requested(sb.session) == [['ENSG1', 'ensg2', 'X1'], ['ensg2', 'X1']]
+
+    def test_keys(self):
+        id_cache = SciBiomartIdCache()
+        sb = self.make_sb(id_cache)
+        sb.run_query({'ensembl_gene_id': ['ENSG1']}, ['ensembl_gene_id', 'external_gene_name'])
+        # Different attributes, release or other filters aren't shared
+        sb.run_query({'ensembl_gene_id': ['ENSG1']}, ['external_gene_name', 'ensembl_gene_id'])
+        sb.run_query({'ensembl_gene_id': ['ENSG1'], 'biotype': 'protein_coding'},
+                     ['ensembl_gene_id', 'external_gene_name'])
+        sb.dataset_version = 'Ensembl Genes 111'
+        sb.run_query({'ensembl_gene_id': ['ENSG1']}, ['ensembl_gene_id', 'external_gene_name'])
+        assert len(sb.session.queries) == 4
+        # Without the ID in the attributes we can't key the rows so the query always goes to the server
+        assert id_cache.id_filter({'ensembl_gene_id': ['ENSG1']}, ['external_gene_name']) is None
+
+    def test_evict(self):
+        id_cache = SciBiomartIdCache(max_ids=2)
+        sb = self.make_sb(id_cache)
+        attrs = ['ensembl_gene_id', 'external_gene_name']
+        sb.run_query({'ensembl_gene_id': ['ENSG1', 'ENSG2']}, attrs)
+        sb.run_query({'ensembl_gene_id': ['ENSG3']}, attrs)
+        assert id_cache.n_ids == 2
+        sb.run_query({'ensembl_gene_id': ['ENSG1', 'ENSG2', 'ENSG3']}, attrs)
+        assert requested(sb.session)[-1] == ['ENSG1']
+
+    def test_coalesce(self):
+        id_cache = SciBiomartIdCache()
+        attrs = ['ensembl_gene_id', 'external_gene_name']
+        session = FakeSession(id_row, delay=0.2)
+
+        def lookup(ids):
+            sb = self.make_sb(id_cache)
+            sb.session = session
+            return sb.run_query({'ensembl_gene_id': ids}, attrs)
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            first = executor.submit(lookup, ['ENSG1', 'ENSG2'])
+            time.sleep(0.05)
+            dfs = list(executor.map(lookup, [['ENSG1', 'ENSG2'], ['ENSG2', 'ENSG3'], ['ENSG1']]))
+        assert sorted(map(tuple, requested(session))) == [('ENSG1', 'ENSG2'), ('ENSG3',)]
+        assert list(first.result()['ensembl_gene_id']) == ['ENSG1', 'ENSG2']
+        assert list(dfs[1]['external_gene_name']) == ['ensg2', 'ensg3']
+        assert id_cache.coalesced >= 4
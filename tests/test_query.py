@@ -0,0 +1,225 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+import unittest
+from urllib.parse import unquote_plus, urlencode
+
+from benchmarks.mock_mart import MockMart
+from scibiomart import SciBiomart
+from scibiomart.base import SciBiomartException
+from scibiomart.query import get_template
+from tests.fakes import FakeResponse, FakeSession, request_query
+
+
+class FlakySession(FakeSession):
+    """ Fails the first n requests for any ID in fail_ids with the given response. """
+
+    def __init__(self, fail_ids, failures=1, status=503, data=b''):
+        super().__init__()
+        self.fail_ids = fail_ids
+        self.failures = failures
+        self.status = status
+        self.data = data
+
+    def request(self, method, url, body=None, **kwargs):
+        query = request_query(url, body)
+        if self.failures > 0 and any(i in query for i in self.fail_ids):
+            self.failures -= 1
+            self.queries.append(query)
+            return FakeResponse(self.data, self.status)
+        return super().request(method, url, body, **kwargs)
+
+
+class TestQuery(unittest.TestCase):
+
+    def setUp(self):
+        self.sb = SciBiomart(batch_size=10, max_workers=3)
+        self.sb.session = FakeSession()
+        self.sb.set_mart('ENSEMBL_MART_ENSEMBL')
+        self.sb.dataset = 'hsapiens_gene_ensembl'
+
+    def test_build_query(self):
+        query = self.sb.build_query({'external_gene_name': ['A&B', '<"C">'], 'biotype': 'protein_coding'},
+                                    ['ensembl_gene_id', 'external_gene_name'])
+        assert '<Filter name = "external_gene_name" value = "A&amp;B,&lt;&quot;C&quot;&gt;" />' in query
+        assert query.endswith('<Attribute name = "ensembl_gene_id" /><Attribute name = "external_gene_name" />'
+                              '</Dataset></Query>')
+        # The static parts are rendered once for the dataset and attributes
+        assert get_template('hsapiens_gene_ensembl', ('ensembl_gene_id', 'external_gene_name')) is \
+            get_template('hsapiens_gene_ensembl', ('ensembl_gene_id', 'external_gene_name'))
+
+    def test_post(self):
+        query = self.sb.build_query({'ensembl_gene_id': ['ENSG1']}, ['ensembl_gene_id'])
+        request = self.sb.query_request(query)
+        assert request['method'] == 'POST' and request['url'] == f'{self.sb.url}martservice'
+        assert request['body'] == urlencode({'query': query})
+        self.sb.post = False
+        request = self.sb.query_request(query)
+        assert request['method'] == 'GET' and unquote_plus(request['url'].split('?query=')[1]) == query
+        assert self.sb.query_request(f'{self.sb.url}martservice?type=registry')['method'] == 'GET'
+
+    def test_split_filters(self):
+        ids = [f'ENSG{i:011d}' for i in range(25)]
+        batches = self.sb.split_filters({'ensembl_gene_id': ids, 'upstream_flank': 100})
+        assert len(batches) == 3
+        assert batches[2]['ensembl_gene_id'] == ids[20:]
+        assert batches[0]['upstream_flank'] == 100
+        # Strings and short lists are left as they are
+        assert len(self.sb.split_filters({'ensembl_gene_id': ','.join(ids)})) == 1
+        assert len(self.sb.split_filters({'ensembl_gene_id': ids[:10]})) == 1
+
+    def test_run_query_batches(self):
+        ids = [f'ENSG{i:011d}' for i in range(95)]
+        df = self.sb.run_query({'ensembl_gene_id': ids}, ['ensembl_gene_id', 'external_gene_name'])
+        assert len(self.sb.session.queries) == 10
+        # The results are concatenated in the input order
+        assert list(df['ensembl_gene_id'].values) == ids
+        assert df['external_gene_name'].values[0] == ids[0].lower()
+
+    def test_run_query_single(self):
+        df = self.sb.run_query({'ensembl_gene_id': ['ENSG1', 'ENSG2']}, ['ensembl_gene_id', 'external_gene_name'])
+        assert len(self.sb.session.queries) == 1
+        assert len(df) == 2
+
+    def test_run_query_stream(self):
+        ids = [f'ENSG{i:011d}' for i in range(25)]
+        attrs = ['ensembl_gene_id', 'external_gene_name']
+        df = self.sb.run_query({'ensembl_gene_id': ids}, attrs)
+        df_stream = self.sb.run_query({'ensembl_gene_id': ids}, attrs, stream=True)
+        assert df.equals(df_stream)
+        assert self.sb.session.response.released
+
+    def test_stream_parity(self):
+        # Empty leading values (genes without a name) keep their column in both parsers
+        attrs = ['external_gene_name', 'chromosome_name', 'start_position', 'strand']
+        with MockMart(n_genes=50) as mart:
+            sb = SciBiomart(mart.url)
+            sb.set_mart('ENSEMBL_MART_ENSEMBL')
+            sb.set_dataset('hsapiens_gene_ensembl')
+            df = sb.run_query(None, attrs)
+            assert '' in set(df['external_gene_name'])
+            assert list(df['start_position']) == mart.genes['start_position']
+            assert df.equals(sb.run_query(None, attrs, stream=True))
+            assert sb.run_query(None, attrs, typed=True).equals(sb.run_query(None, attrs, stream=True, typed=True))
+            # A single attribute is named (and typed) the same way
+            df = sb.run_query(None, ['start_position'], typed=True)
+            assert list(df.columns) == ['start_position']
+            assert df.equals(sb.run_query(None, ['start_position'], stream=True, typed=True))
+
+    def test_iter_query(self):
+        ids = [f'ENSG{i:011d}' for i in range(25)]
+        chunks = list(self.sb.iter_query({'ensembl_gene_id': ids}, ['ensembl_gene_id', 'external_gene_name'],
+                                         chunksize=4))
+        # 3 batches of 10, 10 and 5 rows in chunks of 4
+        assert [len(chunk) for chunk in chunks] == [4, 4, 2, 4, 4, 2, 4, 1]
+        assert list(chunks[-1]['ensembl_gene_id'].values) == ids[-1:]
+
+    def test_retry_status(self):
+        self.sb.backoff_factor = 0
+        self.sb.session = FlakySession(['ENSG1'], failures=2)
+        df = self.sb.run_query({'ensembl_gene_id': ['ENSG1']}, ['ensembl_gene_id', 'external_gene_name'])
+        assert len(self.sb.session.queries) == 3
+        assert df['external_gene_name'].values[0] == 'ensg1'
+
+    def test_retry_truncated(self):
+        self.sb.backoff_factor = 0
+        self.sb.session = FlakySession(['ENSG1'], failures=1, status=200, data=b'ENSG1\tens')
+        df = self.sb.run_query({'ensembl_gene_id': ['ENSG1']}, ['ensembl_gene_id', 'external_gene_name'],
+                               stream=True)
+        assert len(self.sb.session.queries) == 2
+        assert len(df) == 1
+
+    def test_query_error(self):
+        self.sb.session = FlakySession(['ENSG1'], failures=5, status=200,
+                                       data=b'Query ERROR: caught BioMart::Exception::Usage: Attribute x NOT FOUND')
+        with self.assertRaises(SciBiomartException):
+            self.sb.run_query({'ensembl_gene_id': ['ENSG1']}, ['ensembl_gene_id', 'x'])
+        # Not worth retrying
+        assert len(self.sb.session.queries) == 1
+
+    def test_resume_batches(self):
+        self.sb.retries = 0
+        ids = [f'ENSG{i:011d}' for i in range(25)]
+        self.sb.session = FlakySession([ids[12]], failures=1)
+        with self.assertRaises(SciBiomartException):
+            self.sb.run_query({'ensembl_gene_id': ids}, ['ensembl_gene_id', 'external_gene_name'])
+        assert len(self.sb.session.queries) == 3
+        # Only the failed batch is run again
+        df = self.sb.run_query({'ensembl_gene_id': ids}, ['ensembl_gene_id', 'external_gene_name'])
+        assert len(self.sb.session.queries) == 4
+        assert list(df['ensembl_gene_id'].values) == ids
+        assert not self.sb.completed_batches
+
+    def test_lazy_dataset_version(self):
+        class CountingResponse(FakeResponse):
+            n_reads = 0
+
+            def read(self, *args):
+                self.n_reads += 1
+                return super().read(*args)
+
+        class ConfigSession(FakeSession):
+            def request(self, method, url, **kwargs):
+                self.queries.append(url)
+                self.response = CountingResponse(b'<DatasetConfig dataset="btaurus_gene_ensembl" version="ARS-UCD1.2">'
+                                             + b'<AttributePage />' * 100000 + b'</DatasetConfig>')
+                return self.response
+        sb = SciBiomart()
+        sb.session = ConfigSession()
+        sb.set_mart('ENSEMBL_MART_ENSEMBL')
+        sb.set_dataset('btaurus_gene_ensembl')
+        assert not sb.session.queries
+        assert sb.dataset_version == 'btaurus_gene_ensembl-ARS-UCD1.2'
+        # We stop reading after the root element
+        assert sb.session.response.n_reads == 1
+        # The version is kept for the mart and dataset
+        sb_other = SciBiomart()
+        sb_other.session = sb.session
+        sb_other.set_mart('ENSEMBL_MART_ENSEMBL')
+        sb_other.set_dataset('btaurus_gene_ensembl')
+        assert sb_other.dataset_version == 'btaurus_gene_ensembl-ARS-UCD1.2'
+        assert len(sb.session.queries) == 1
+
+
+class TestCompression(unittest.TestCase):
+
+    def setUp(self):
+        self.mart = MockMart(n_genes=5000).start()
+        genes = self.mart.genes
+        self.body = ''.join(f'{gene_id}\t{biotype}\n' for gene_id, biotype in
+                            zip(genes['ensembl_gene_id'], genes['gene_biotype'])).encode('utf-8') + b'[success]\n'
+
+    def tearDown(self):
+        self.mart.stop()
+
+    def run_query(self, compress, stream):
+        sb = SciBiomart(self.mart.url, compress=compress)
+        sb.set_mart('ENSEMBL_MART_ENSEMBL')
+        sb.dataset = 'hsapiens_gene_ensembl'
+        sb.dataset_version = 'hsapiens_gene_ensembl-GRCh38.p13'
+        df = sb.run_query(None, ['ensembl_gene_id', 'gene_biotype'], stream=stream)
+        assert len(df) == 5000
+        assert df['gene_biotype'].values[-1] == self.mart.genes['gene_biotype'][-1]
+        return sb.transfer_stats
+
+    def test_compressed(self):
+        for stream in [False, True]:
+            stats = self.run_query(True, stream)
+            assert stats['decoded_bytes'] == len(self.body)
+            assert stats['wire_bytes'] < stats['decoded_bytes'] / 3
+            stats = self.run_query(False, stream)
+            assert stats['wire_bytes'] == stats['decoded_bytes'] == len(self.body)
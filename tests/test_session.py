@@ -0,0 +1,86 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+import unittest
+
+import urllib3
+
+from benchmarks.mock_mart import MockMart
+from scibiomart import SciBiomart, SciBiomartApi, SciBiomartSession
+from scibiomart.annot import Annot
+from scibiomart.session import get_default_session, set_default_session
+
+
+class TestSession(unittest.TestCase):
+
+    def setUp(self):
+        self.mart = MockMart(n_genes=200).start()
+        self.url = self.mart.url
+
+    def tearDown(self):
+        self.mart.stop()
+
+    def run_query(self, sb):
+        sb.set_mart('ENSEMBL_MART_ENSEMBL')
+        sb.set_dataset('hsapiens_gene_ensembl')
+        df = sb.run_query(None, ['ensembl_gene_id', 'external_gene_name'])
+        assert list(df['ensembl_gene_id']) == self.mart.genes['ensembl_gene_id']
+
+    def test_default_session(self):
+        # Short lived instances share the process wide pool so the connection is kept alive between them
+        set_default_session(None)
+        for cls in [SciBiomart, SciBiomartApi, Annot]:
+            sb = cls(self.url)
+            assert sb.session is get_default_session()
+            self.run_query(sb)
+        assert self.mart.connections == 1
+        # Closing an instance drops the idle connections but the session can still be used
+        with SciBiomart(self.url) as sb:
+            self.run_query(sb)
+        self.run_query(SciBiomart(self.url))
+        assert self.mart.connections == 2
+        assert not get_default_session().closed
+
+    def test_injected_session(self):
+        with SciBiomartSession(maxsize=2, read_timeout=5.0) as session:
+            for i in range(3):
+                self.run_query(SciBiomartApi(self.url, session=session))
+            assert session.timeout.read_timeout == 5.0
+            assert not session.closed
+        assert session.closed
+        assert self.mart.connections == 1
+
+    def test_uncompressed(self):
+        # Without compression the default session is still shared, the responses just aren't compressed
+        for compress in [True, False]:
+            sb = SciBiomart(self.url, compress=compress)
+            assert sb.session is get_default_session()
+            sb.set_mart('ENSEMBL_MART_ENSEMBL')
+            sb.set_dataset('hsapiens_gene_ensembl')
+            sb.run_query(None, ['ensembl_gene_id', 'description'])
+            stats = sb.transfer_stats
+            assert (stats['wire_bytes'] < stats['decoded_bytes']) == compress
+
+    def test_close_default(self):
+        session = get_default_session()
+        session.close()
+        assert get_default_session() is not session
+
+    def test_proxy(self):
+        session = SciBiomartSession(proxy='http://127.0.0.1:3128')
+        assert isinstance(session.pool, urllib3.ProxyManager)
+        assert isinstance(SciBiomartSession().pool, urllib3.PoolManager)
@@ -0,0 +1,133 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+import shutil
+import tempfile
+import unittest
+
+import pandas as pd
+
+from scibiomart import SciBiomartApi, SciBiomartSnapshot
+from tests.fakes import FakeResponse, FakeSession
+
+
+class ServerSession(FakeSession):
+    """ Serves one fixed gene table, the attribute and filter lists. Fails if called when it shouldn't be. """
+
+    def __init__(self):
+        super().__init__()
+        self.offline = False
+        self.genes = 'ENSG1\tA\t1\t100\t200\t1\nENSG2\tB\t2\t50\t80\t-1\nENSG3\t\tX\t10\t20\t1\n' \
+                     'ENSG4\tD\t1\t150\t300\t-1\n'
+
+    @property
+    def n_requests(self) -> int:
+        return len(self.queries)
+
+    def respond(self, query: str) -> FakeResponse:
+        assert not self.offline
+        if 'type=attributes' in query:
+            data = 'ensembl_gene_id\tGene stable ID\tStable ID\tfeature_page\thtml,txt\tgene\tstable_id_1023\n'
+        elif 'type=filters' in query:
+            data = 'chromosome_name\tChromosome\t[1,2]\t\tfilters\ttext\t=\tgene\tname_1059\n'
+        elif 'type=configuration' in query:
+            data = '<DatasetConfig dataset="hsapiens_gene_ensembl" version="GRCh38.p13"></DatasetConfig>'
+        else:
+            data = f'{self.genes}[success]\n'
+        return FakeResponse(data.encode('utf-8'))
+
+
+class TestSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='scibiomart_snapshot_')
+        self.snapshot = SciBiomartSnapshot(self.tmp_dir)
+        sb = SciBiomartApi()
+        sb.session = ServerSession()
+        sb.set_mart('ENSEMBL_MART_ENSEMBL')
+        sb.set_dataset('hsapiens_gene_ensembl')
+        sb.dataset_version = 'hsapiens_gene_ensembl-GRCh38.p13'
+        self.snapshot.create(sb, ['ensembl_gene_id', 'external_gene_name', 'chromosome_name', 'start_position',
+                                  'end_position', 'strand'], fmt='csv')
+        self.sb = SciBiomartApi(snapshot=self.snapshot)
+        self.sb.session = ServerSession()
+        self.sb.session.offline = True
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_offline_default(self):
+        results_df = self.sb.get_human_default({'ensembl_gene_id': ['ENSG4', 'ENSG1', 'ENSG9']})
+        assert list(results_df['ensembl_gene_id'].values) == ['ENSG1', 'ENSG4']
+        assert results_df['start_position'].values[1] == 150
+        assert self.sb.dataset_version == 'hsapiens_gene_ensembl-GRCh38.p13'
+        assert self.sb.list_attributes(False)['name'].values[0] == 'ensembl_gene_id'
+
+    def test_filters(self):
+        self.sb.set_mart('ENSEMBL_MART_ENSEMBL')
+        self.sb.set_dataset('hsapiens_gene_ensembl')
+        results_df = self.sb.run_query({'chromosome_name': '1,X', 'strand': -1}, ['ensembl_gene_id', 'strand'])
+        assert list(results_df['ensembl_gene_id'].values) == ['ENSG4']
+        # Untyped like the server
+        assert results_df['strand'].values[0] == '-1'
+        results_df = self.sb.run_query({'chromosome_name': '1', 'start': 120, 'end': 160}, ['ensembl_gene_id'])
+        assert list(results_df['ensembl_gene_id'].values) == ['ENSG1', 'ENSG4']
+
+    def test_not_in_snapshot(self):
+        assert not self.snapshot.can_answer('ENSEMBL_MART_ENSEMBL', 'hsapiens_gene_ensembl', None, ['uniprot_gn_id'])
+        assert not self.snapshot.can_answer('ENSEMBL_MART_ENSEMBL', 'hsapiens_gene_ensembl',
+                                            {'with_hgnc': True}, ['ensembl_gene_id'])
+        assert pd.isnull(self.snapshot.query('ENSEMBL_MART_ENSEMBL', 'mmusculus_gene_ensembl', None,
+                                             ['ensembl_gene_id']))
+
+    def test_filtered_snapshot(self):
+        # A snapshot of chromosome 1 only answers queries within chromosome 1
+        sb = SciBiomartApi()
+        sb.session = ServerSession()
+        sb.set_mart('ENSEMBL_MART_ENSEMBL')
+        sb.set_dataset('hsapiens_gene_ensembl')
+        sb.dataset_version = 'hsapiens_gene_ensembl-GRCh38.p13'
+        snapshot = SciBiomartSnapshot(tempfile.mkdtemp(dir=self.tmp_dir))
+        attr_list = ['ensembl_gene_id', 'external_gene_name', 'chromosome_name', 'start_position', 'end_position',
+                     'strand']
+        snapshot.create(sb, attr_list, {'chromosome_name': '1'}, fmt='csv')
+        mart, dataset = 'ENSEMBL_MART_ENSEMBL', 'hsapiens_gene_ensembl'
+        assert not snapshot.can_answer(mart, dataset, None, ['ensembl_gene_id'])
+        assert not snapshot.can_answer(mart, dataset, {'chromosome_name': '2'}, ['ensembl_gene_id'])
+        assert not snapshot.can_answer(mart, dataset, {'chromosome_name': ['1', '2']}, ['ensembl_gene_id'])
+        assert snapshot.can_answer(mart, dataset, {'chromosome_name': ['1']}, ['ensembl_gene_id'])
+        results_df = snapshot.query(mart, dataset, {'chromosome_name': '1', 'strand': -1}, ['ensembl_gene_id'])
+        assert list(results_df['ensembl_gene_id'].values) == ['ENSG4']
+        # Queries outside the snapshot go to the server
+        sb.snapshot = snapshot
+        n_requests = sb.session.n_requests
+        sb.run_query({'chromosome_name': '2'}, attr_list)
+        assert sb.session.n_requests == n_requests + 1
+
+    def test_empty_snapshot(self):
+        sb = SciBiomartApi()
+        sb.session = ServerSession()
+        sb.session.genes = ''
+        sb.set_mart('ENSEMBL_MART_ENSEMBL')
+        sb.set_dataset('hsapiens_gene_ensembl')
+        sb.dataset_version = 'hsapiens_gene_ensembl-GRCh38.p13'
+        snapshot = SciBiomartSnapshot(tempfile.mkdtemp(dir=self.tmp_dir))
+        snapshot.create(sb, ['ensembl_gene_id', 'chromosome_name'], {'chromosome_name': 'Y'}, fmt='csv')
+        assert snapshot.metadata('ENSEMBL_MART_ENSEMBL', 'hsapiens_gene_ensembl')['rows'] == 0
+        results_df = snapshot.query('ENSEMBL_MART_ENSEMBL', 'hsapiens_gene_ensembl', {'chromosome_name': 'Y'},
+                                    ['ensembl_gene_id'])
+        assert list(results_df.columns) == ['ensembl_gene_id'] and not len(results_df)
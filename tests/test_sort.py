@@ -0,0 +1,65 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import pandas as pd
+
+from scibiomart import SciBiomart
+
+
+class TestSort(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='scibiomart_sort_')
+        self.df = pd.DataFrame({'external_gene_name': ['a', 'b', 'c', 'd', 'e', 'f'],
+                                'chromosome_name': ['2', '11', 'X', '2', 'MT', '1'],
+                                'start_position': ['500', '100', '10', '100', '1', '1000'],
+                                'end_position': ['600', '200', '20', '1000', '5', '2000'],
+                                'strand': ['1', '1', '-1', '-1', '1', '1']})
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_lexicographic(self):
+        sorted_df = SciBiomart.sort_df_on_starts(self.df)
+        # b on 11 is before 2 (as in bedtools), on chr 2 a starts at 500 and d is on - so its start is 1000
+        assert list(sorted_df['external_gene_name'].values) == ['f', 'b', 'a', 'd', 'e', 'c']
+        # The input isn't changed
+        assert list(self.df.columns) == ['external_gene_name', 'chromosome_name', 'start_position',
+                                         'end_position', 'strand']
+
+    def test_natural(self):
+        sorted_df = SciBiomart.sort_df_on_starts(self.df, 'natural')
+        assert list(sorted_df['external_gene_name'].values) == ['f', 'a', 'd', 'b', 'c', 'e']
+
+    def test_fai(self):
+        fai = os.path.join(self.tmp_dir, 'genome.fa.fai')
+        with open(fai, 'w') as fh:
+            fh.write('X\t100\t5\t60\t61\n2\t100\t5\t60\t61\n')
+        sorted_df = SciBiomart.sort_df_on_starts(self.df, fai)
+        # Anything not in the index goes at the end
+        assert list(sorted_df['external_gene_name'].values) == ['c', 'a', 'd', 'f', 'b', 'e']
+
+    def test_typed(self):
+        df = self.df.astype({'start_position': int, 'end_position': int, 'strand': 'int8',
+                             'chromosome_name': 'category'})
+        sorted_df = SciBiomart.sort_df_on_starts(df)
+        assert list(sorted_df['external_gene_name'].values) == ['f', 'b', 'a', 'd', 'e', 'c']
@@ -0,0 +1,97 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+import gzip
+import io
+import os
+import random
+import tempfile
+import unittest
+
+import pandas as pd
+
+from scibiomart import SciBiomart
+from scibiomart.errors import SciBiomartException
+from tests.fakes import FakeResponse, FakeSession
+
+
+class GeneSession(FakeSession):
+    """ Returns random genes with names, positions and strands (and no attribute metadata). """
+
+    def __init__(self, n_genes=1000):
+        super().__init__()
+        rng = random.Random(0)
+        chromosomes = ['1', '2', '10', 'X', 'MT', 'KI270728.1']
+        rows = []
+        for i in range(n_genes):
+            start = rng.randint(1, 100000)
+            chromosome = rng.choice(chromosomes)
+            end = start + rng.randint(0, 5000)
+            rows.append(f'ENSG{i:011d}\tGENE,"{i}"\t{chromosome}\t{start}\t{end}\t{rng.choice(["1", "-1"])}\n')
+        self.data = (''.join(rows) + '[success]\n').encode('utf-8')
+
+    def respond(self, query: str) -> FakeResponse:
+        return FakeResponse(b'' if 'type=attributes' in query else self.data)
+
+
+class TestStream(unittest.TestCase):
+
+    attrs = ['ensembl_gene_id', 'external_gene_name', 'chromosome_name', 'start_position', 'end_position', 'strand']
+
+    def setUp(self):
+        self.sb = SciBiomart()
+        self.sb.session = GeneSession()
+        self.sb.set_mart('ENSEMBL_MART_ENSEMBL')
+        self.sb.dataset = 'hsapiens_gene_ensembl'
+        self.sb.dataset_version = 'Ensembl Genes 110'
+
+    def test_unsorted(self):
+        out = io.StringIO()
+        path, n_rows = self.sb.stream_query(None, self.attrs, out, chunksize=64)
+        assert path is out and n_rows == 1000
+        expected = self.sb.run_query(None, self.attrs).to_csv(index=False)
+        assert out.getvalue() == expected
+
+    def test_sorted(self):
+        for chrom_order in ['lexicographic', 'natural']:
+            out = io.StringIO()
+            self.sb.stream_query(None, self.attrs, out, fmt='tsv', sort=True, chrom_order=chrom_order, chunksize=100)
+            streamed_df = pd.read_csv(io.StringIO(out.getvalue()), sep='\t', dtype=str)
+            df = self.sb.sort_df_on_starts(self.sb.run_query(None, self.attrs, typed=True), chrom_order)
+            assert list(streamed_df['ensembl_gene_id']) == list(df['ensembl_gene_id'])
+            assert list(streamed_df['external_gene_name']) == list(df['external_gene_name'])
+
+    def test_file(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path, n_rows = self.sb.stream_query(None, self.attrs, os.path.join(tmp_dir, 'genes_'), compression='gzip',
+                                                sort=True, chunksize=128, tmp_dir=tmp_dir)
+            assert path == os.path.join(tmp_dir, 'genes_Ensembl Genes 110.csv')
+            # The temporary runs are removed
+            assert os.listdir(tmp_dir) == ['genes_Ensembl Genes 110.csv']
+            with gzip.open(path, 'rt') as f:
+                assert len(pd.read_csv(f)) == n_rows == 1000
+        with self.assertRaises(Exception):
+            self.sb.stream_query(None, self.attrs, '-', fmt='parquet')
+
+    def test_failed_download(self):
+        # A truncated response doesn't leave a partial file that looks like a complete download
+        self.sb.retries = 0
+        self.sb.session.data = self.sb.session.data[:len(self.sb.session.data) // 2]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with self.assertRaises(SciBiomartException):
+                self.sb.stream_query(None, self.attrs, os.path.join(tmp_dir, 'genes_'), chunksize=64)
+            assert os.listdir(tmp_dir) == []
@@ -0,0 +1,106 @@
+###############################################################################
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+###############################################################################
+
+import asyncio
+import os
+import shutil
+import tempfile
+import unittest
+
+from benchmarks.mock_mart import MockMart
+from scibiomart import SciBiomart, CassetteTransport, AiohttpTransport
+from scibiomart.transport import SciBiomartTransport
+from scibiomart.base import SciBiomartException
+from tests.fakes import run_async
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+ATTRS = ['ensembl_gene_id', 'chromosome_name', 'start_position']
+
+
+class TestTransport(unittest.TestCase):
+
+    def setUp(self):
+        self.mart = MockMart(n_genes=500).start()
+        self.tmp_dir = tempfile.mkdtemp(prefix='scibiomart_cassette_')
+
+    def tearDown(self):
+        self.mart.stop()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def run_queries(self, transport) -> list:
+        sb = SciBiomart(self.mart.url, session=transport)
+        sb.set_mart('ENSEMBL_MART_ENSEMBL')
+        sb.set_dataset('hsapiens_gene_ensembl')
+        return [sb.dataset_version, sb.run_query({'chromosome_name': ['1', '2']}, ATTRS),
+                sb.run_query(None, ATTRS, stream=True)]
+
+    def test_cassette(self):
+        version, df, stream_df = self.run_queries(CassetteTransport(self.tmp_dir))
+        n_requests = self.mart.n_requests
+        assert len(os.listdir(self.tmp_dir)) == 2 * n_requests
+        # Replayed without the server
+        self.mart.stop()
+        cassette = CassetteTransport(self.tmp_dir, mode='replay')
+        replayed = self.run_queries(cassette)
+        assert replayed[0] == version
+        assert replayed[1].equals(df) and replayed[2].equals(stream_df)
+        # The dataset version is remembered by SciBiomart so isn't requested again
+        assert cassette.hits == n_requests - 1
+        with self.assertRaises(SciBiomartException):
+            cassette.request('GET', f'{self.mart.url}martservice?type=registry')
+        self.mart.start()
+
+    def test_record_mode(self):
+        cassette = CassetteTransport(self.tmp_dir, mode='record')
+        response = cassette.request('GET', f'{self.mart.url}martservice?type=unknown')
+        assert response.status == 400
+        assert cassette.recorded == 1
+        with self.assertRaises(SciBiomartException):
+            CassetteTransport(self.tmp_dir, mode='rewind')
+
+    def test_transport_needs_request(self):
+        class NoRequest(SciBiomartTransport):
+            pass
+        with self.assertRaises(TypeError):
+            NoRequest()
+
+    @unittest.skipIf(aiohttp is None, 'aiohttp is not installed')
+    def test_aiohttp(self):
+        with AiohttpTransport(limit=4) as transport:
+            version, df, stream_df = self.run_queries(transport)
+            assert version == 'hsapiens_gene_ensembl-Human genes (GRCh38.p13)'
+            assert set(df['chromosome_name']) == {'1', '2'}
+            assert len(stream_df) == 500
+
+            async def fetch():
+                urls = [f'{self.mart.url}martservice?type={t}' for t in ['registry', 'datasets', 'attributes']]
+                return await asyncio.gather(*[transport.arequest('GET', url) for url in urls])
+            responses = run_async(fetch())
+            assert [r.status for r in responses] == [200, 200, 200]
+            assert b'ENSEMBL_MART_ENSEMBL' in responses[0].data
+        assert transport.closed
+
+    @unittest.skipIf(aiohttp is None, 'aiohttp is not installed')
+    def test_aiohttp_uncompressed(self):
+        with AiohttpTransport(compress=False) as transport:
+            version, df, stream_df = self.run_queries(transport)
+            assert set(df['chromosome_name']) == {'1', '2'}
+            assert len(stream_df) == 500